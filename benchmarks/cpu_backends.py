@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Throughput of the CPU inference configurations.
+
+Runs the same synthetic images through each configuration and prints
+images/sec relative to the old CPU fallback (fp16 with contiguous NCHW
+tensors). All configurations use the same thread count. Differences are
+measured against the baseline's output, e.g.
+
+    python benchmarks/cpu_backends.py --size 128 --count 4 --configs fp16-nchw fp32 bf16 onnx
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from upscaler import ImageUpscaler  # noqa: E402
+from tile_batching import synthetic_images, time_call  # noqa: E402
+
+# name -> (ImageUpscaler keyword arguments, keep channels_last)
+CONFIGS = {
+    'fp16-nchw': ({'precision': 'fp16'}, False),
+    'fp32': ({'precision': 'fp32'}, True),
+    'bf16': ({'precision': 'bf16'}, True),
+    'onnx': ({'backend': 'onnx'}, True),
+}
+
+def build(name: str, model_name: str, tile_batch_size: int, threads: int) -> ImageUpscaler:
+    kwargs, channels_last = CONFIGS[name]
+    upscaler = ImageUpscaler(model_name=model_name, device='cpu', tile_batch_size=tile_batch_size,
+                             cpu_threads=threads, **kwargs)
+    if not channels_last:
+        engine = upscaler.engine
+        engine.model.to(memory_format=torch.contiguous_format)
+        engine.memory_format = torch.contiguous_format
+    return upscaler
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU inference precisions and backends")
+    parser.add_argument('--model', default='RealESRGAN_x4plus', help='Model to benchmark')
+    parser.add_argument('--size', type=int, default=128, help='Edge of the square synthetic images')
+    parser.add_argument('--count', type=int, default=4, help='Number of images per run')
+    parser.add_argument('--tile-batch-size', type=int, default=4, help='Tiles per forward call')
+    parser.add_argument('--threads', type=int, help='Intra-op threads (default: every usable CPU)')
+    parser.add_argument('--configs', nargs='+', choices=list(CONFIGS), default=list(CONFIGS),
+                        help='Configurations to measure; the first one is the baseline')
+    parser.add_argument('--repeats', type=int, default=2, help='Timed repetitions per measurement')
+    args = parser.parse_args()
+
+    images = synthetic_images(args.size, args.count)
+    print(f"{args.count} images of {args.size}x{args.size}, {args.model}")
+    baseline = None
+    reference = None
+    for name in args.configs:
+        try:
+            upscaler = build(name, args.model, args.tile_batch_size, args.threads)
+        except Exception as e:
+            print(f"{name:>10}: unavailable ({e})")
+            continue
+        outputs = upscaler.upscale_arrays(images)
+        elapsed = time_call(lambda: upscaler.upscale_arrays(images), args.repeats)
+        baseline = baseline or elapsed
+        reference = reference if reference is not None else outputs
+        error = max(np.abs(a.astype(np.int16) - b).max() for a, b in zip(outputs, reference))
+        print(f"{name:>10}: {args.count / elapsed:8.3f} images/sec ({baseline / elapsed:.2f}x, "
+              f"max abs difference {error} levels)")
+
+if __name__ == '__main__':
+    main()
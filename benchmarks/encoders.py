@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Encode time and size of the output formats and encoder settings.
+
+Encodes a synthetic image of the size of a 4x output with every setting
+and prints milliseconds per encode, the encoded size and the base64
+payload a handler response would carry, e.g.
+
+    python benchmarks/encoders.py --size 2048
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from upscaler import OutputFormat  # noqa: E402
+from tile_batching import synthetic_images, time_call  # noqa: E402
+
+SETTINGS = {
+    'jpg q95': OutputFormat('.jpg'),
+    'jpg q85': OutputFormat('.jpg', quality=85),
+    'jpg q95 progressive': OutputFormat('.jpg', progressive=True),
+    'png (fastest)': OutputFormat('.png'),
+    'png level 3': OutputFormat('.png', png_compression=3),
+    'png level 6': OutputFormat('.png', png_compression=6),
+    'webp q90': OutputFormat('.webp'),
+    'webp lossless': OutputFormat('.webp', lossless=True),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare output encoders")
+    parser.add_argument('--size', type=int, default=2048, help='Edge of the square output image')
+    parser.add_argument('--repeats', type=int, default=2, help='Timed repetitions per setting')
+    parser.add_argument('--settings', nargs='+', choices=list(SETTINGS), default=list(SETTINGS),
+                        help='Settings to measure')
+    args = parser.parse_args()
+
+    # Upscaled outputs are smooth, so enlarge a smaller synthetic image
+    img = cv2.resize(synthetic_images(args.size // 4, 1)[0], (args.size, args.size),
+                     interpolation=cv2.INTER_CUBIC)
+    print(f"{args.size}x{args.size} image")
+    for name in args.settings:
+        output_format = SETTINGS[name]
+        size = len(output_format.encode(img))
+        elapsed = time_call(lambda: output_format.encode(img), args.repeats)
+        print(f"{name:>20}: {elapsed * 1000:8.1f} ms, {size / 1024:8.0f}KB "
+              f"({size * 4 / 3 / 1024:8.0f}KB as base64)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Reproducible local benchmark of the upscaler on the CPU.
+
+Generates seeded synthetic images at several resolutions and measures:
+
+- stages: upscale_image with metrics enabled, reporting the time of each
+  stage (read, decode, pre-process, tile inference, stitch, encode, ...)
+- upscale_image: ImageUpscaler.upscale_image end to end
+- batch_upscale: ImageUpscaler.batch_upscale over a directory
+- handler: runpod_handler.handler with a base64 payload (needs the runpod package)
+- handler_concurrent: the images of the batch as concurrent single-image jobs
+  on runpod_handler.async_handler, as a worker running several jobs at once
+
+Every scenario records wall time, images/sec, latency and peak RSS.
+Results are written as JSON. A saved result can serve as the baseline of a
+later run, which flags throughput drops and memory growth beyond a
+threshold, e.g.
+
+    python benchmarks/suite.py --output baseline.json
+    python benchmarks/suite.py --output current.json --baseline baseline.json
+    python benchmarks/suite.py --compare baseline.json current.json
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from upscaler import ImageUpscaler  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from tile_batching import synthetic_images  # noqa: E402
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter of this process, where supported (Linux)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss_mb() -> float:
+    """Peak resident set size since the last reset_peak_rss(), in MB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak over the whole process lifetime (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+def summarize(latencies, images: int, peak_rss: float, stages=None) -> dict:
+    """Result record of one measurement."""
+    wall = sum(latencies)
+    result = {
+        'wall_s': round(wall, 4),
+        'images_per_sec': round(images / wall, 4) if wall else None,
+        'latency_p50_s': round(float(np.median(latencies)), 4),
+        'latency_max_s': round(max(latencies), 4),
+        'peak_rss_mb': round(peak_rss, 1),
+    }
+    if stages is not None:
+        result['stages_s'] = {name: round(seconds / len(latencies), 4) for name, seconds in stages.items()}
+    return result
+
+def bench_stages(upscaler: ImageUpscaler, path: Path, out_dir: Path, repeats: int) -> dict:
+    """Run upscale_image with metrics enabled and report the average time of every stage."""
+    output_path = out_dir / f"{path.stem}_stages{path.suffix}"
+    upscaler.upscale_image(path, output_path)
+    reset_peak_rss()
+    metrics = Metrics()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if not upscaler.upscale_image(path, output_path, metrics=metrics):
+            raise RuntimeError(f"upscale_image failed on {path}")
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, repeats, peak_rss_mb(), dict(metrics.timings))
+
+def bench_upscale_image(upscaler: ImageUpscaler, path: Path, out_dir: Path, repeats: int) -> dict:
+    output_path = out_dir / f"{path.stem}_out{path.suffix}"
+    upscaler.upscale_image(path, output_path)
+    reset_peak_rss()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        if not upscaler.upscale_image(path, output_path):
+            raise RuntimeError(f"upscale_image failed on {path}")
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, repeats, peak_rss_mb())
+
+def bench_batch(upscaler: ImageUpscaler, in_dir: Path, out_dir: Path, count: int, repeats: int) -> dict:
+    upscaler.batch_upscale(in_dir, out_dir, force=True)
+    reset_peak_rss()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        upscaler.batch_upscale(in_dir, out_dir, force=True)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies, count * repeats, peak_rss_mb())
+
+def bench_handler(path: Path, model_name: str, repeats: int) -> dict:
+    # A fresh upscaler without result cache, so every request runs the model
+    os.environ['RESULT_CACHE_MEMORY_MB'] = '0'
+    os.environ['RESULT_CACHE_DIR'] = ''
+    import runpod_handler
+    event = {'input': {'image': base64.b64encode(path.read_bytes()).decode('utf-8'), 'model': model_name}}
+    runpod_handler.handler(event)
+    reset_peak_rss()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = runpod_handler.handler(event)
+        latencies.append(time.perf_counter() - start)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+    return summarize(latencies, repeats, peak_rss_mb())
+
+def bench_handler_concurrent(in_dir: Path, model_name: str, repeats: int) -> dict:
+    os.environ['RESULT_CACHE_MEMORY_MB'] = '0'
+    os.environ['RESULT_CACHE_DIR'] = ''
+    import runpod_handler
+    events = [{'input': {'image': base64.b64encode(path.read_bytes()).decode('utf-8'), 'model': model_name}}
+              for path in sorted(in_dir.iterdir())]
+
+    async def run_jobs():
+        return await asyncio.gather(*(runpod_handler.async_handler(event) for event in events))
+
+    asyncio.run(run_jobs())
+    reset_peak_rss()
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        responses = asyncio.run(run_jobs())
+        latencies.append(time.perf_counter() - start)
+        for response in responses:
+            if 'error' in response:
+                raise RuntimeError(response['error'])
+    return summarize(latencies, len(events) * repeats, peak_rss_mb())
+
+def run(args) -> dict:
+    upscaler = ImageUpscaler(model_name=args.model, device='cpu', precision=args.precision,
+                             cpu_threads=args.threads)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for size in args.sizes:
+            in_dir = tmp / f'in_{size}'
+            out_dir = tmp / f'out_{size}'
+            in_dir.mkdir()
+            out_dir.mkdir()
+            for index, img in enumerate(synthetic_images(size, args.count, seed=size)):
+                cv2.imwrite(str(in_dir / f'{index:03d}.png'), img)
+            first = sorted(in_dir.iterdir())[0]
+
+            scenarios = {
+                'stages': lambda: bench_stages(upscaler, first, out_dir, args.repeats),
+                'upscale_image': lambda: bench_upscale_image(upscaler, first, out_dir, args.repeats),
+                'batch_upscale': lambda: bench_batch(upscaler, in_dir, out_dir, args.count, args.repeats),
+                'handler': lambda: bench_handler(first, args.model, args.repeats),
+                'handler_concurrent': lambda: bench_handler_concurrent(in_dir, args.model, args.repeats),
+            }
+            for name in args.scenarios:
+                key = f'{name}/{size}'
+                print(f"Running {key}...", file=sys.stderr)
+                try:
+                    results[key] = scenarios[name]()
+                except ImportError as e:
+                    print(f"Skipping {key}: {e}", file=sys.stderr)
+                except Exception as e:
+                    print(f"{key} failed: {e}", file=sys.stderr)
+                    results[key] = {'error': str(e)}
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'machine': platform.machine(),
+            'cpu_threads': upscaler.cpu_threads,
+            'model': args.model,
+            'precision': upscaler.precision,
+            'backend': upscaler.backend,
+            'sizes': args.sizes,
+            'count': args.count,
+            'repeats': args.repeats,
+        },
+        'results': results,
+    }
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    List the regressions of `current` against `baseline`.
+
+    A regression is a drop in images/sec or a rise in peak RSS by more than
+    `threshold` (a fraction) in a scenario present in both runs, or a
+    scenario that failed or measured no throughput this time.
+    """
+    regressions = []
+    for key, base in baseline['results'].items():
+        cur = current['results'].get(key)
+        if cur is None or 'error' in base:
+            continue
+        if 'error' in cur:
+            regressions.append(f"{key}: failed ({cur['error']})")
+            continue
+        if base['images_per_sec'] and cur['images_per_sec'] is None:
+            regressions.append(f"{key}: images/sec missing")
+        elif base['images_per_sec'] and cur['images_per_sec'] < base['images_per_sec'] * (1 - threshold):
+            regressions.append(f"{key}: images/sec {base['images_per_sec']} -> {cur['images_per_sec']}")
+        if cur['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f"{key}: peak RSS {base['peak_rss_mb']}MB -> {cur['peak_rss_mb']}MB")
+    return regressions
+
+def print_comparison(baseline: dict, current: dict, threshold: float) -> int:
+    """Print throughput changes per scenario and return the number of regressions."""
+    for key, cur in current['results'].items():
+        base = baseline['results'].get(key)
+        if base is None or 'error' in base or 'error' in cur or not base['images_per_sec']:
+            continue
+        if cur['images_per_sec'] is None:
+            print(f"{key:>24}: {base['images_per_sec']:8.3f} -> missing")
+            continue
+        print(f"{key:>24}: {base['images_per_sec']:8.3f} -> {cur['images_per_sec']:8.3f} images/sec "
+              f"({cur['images_per_sec'] / base['images_per_sec']:.2f}x), "
+              f"peak RSS {base['peak_rss_mb']:.0f} -> {cur['peak_rss_mb']:.0f}MB")
+    regressions = compare(baseline, current, threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return len(regressions)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upscaler throughput, latency and peak memory on CPU")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128, 256],
+                        help='Edges of the square synthetic images')
+    parser.add_argument('--count', type=int, default=4, help='Images per resolution in batch_upscale')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed repetitions per scenario')
+    scenarios = ['stages', 'upscale_image', 'batch_upscale', 'handler', 'handler_concurrent']
+    parser.add_argument('--scenarios', nargs='+', default=scenarios, choices=scenarios,
+                        help='Scenarios to run')
+    parser.add_argument('--model', default='RealESRGAN_x4plus', help='Model to benchmark')
+    parser.add_argument('--precision', choices=['fp16', 'bf16', 'fp32'],
+                        help='Inference precision (default: picked for the CPU)')
+    parser.add_argument('--threads', type=int, help='Intra-op threads (default: every usable CPU)')
+    parser.add_argument('--output', help='Write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--baseline', help='Compare the results against this saved run')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help='Only compare two saved runs')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change counted as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    if args.compare:
+        baseline, current = (json.loads(Path(path).read_text()) for path in args.compare)
+        sys.exit(1 if print_comparison(baseline, current, args.threshold) else 0)
+
+    current = run(args)
+    text = json.dumps(current, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        sys.exit(1 if print_comparison(baseline, current, args.threshold) else 0)
+
+if __name__ == '__main__':
+    main()
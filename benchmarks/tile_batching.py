@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Throughput comparison between RealESRGANer's per-tile loop and TileBatchEngine.
+
+Runs both paths on the same synthetic images and the same tile settings and
+prints images/sec for each tile batch size, e.g.
+
+    python benchmarks/tile_batching.py --device cpu --size 128 --count 8 --batch-sizes 1 4 8
+
+The reference path needs `pip install realesrgan`, which requirements.txt
+leaves out.
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from upscaler import ImageUpscaler  # noqa: E402
+
+def synthetic_images(size: int, count: int, seed: int = 0):
+    """Smooth random images, closer to real content than white noise."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        coarse = rng.random((max(2, size // 16), max(2, size // 16), 3)).astype(np.float32)
+        img = np.kron(coarse, np.ones((16, 16, 1), dtype=np.float32))[:size, :size]
+        images.append((img * 255).astype(np.uint8))
+    return images
+
+def time_call(fn, repeats: int) -> float:
+    """Best wall time of `repeats` calls, after one warm-up call."""
+    fn()
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-tile and batched tile inference")
+    parser.add_argument('--device', choices=['cuda', 'cpu'], help='Device to use (default: auto-detect)')
+    parser.add_argument('--size', type=int, default=256, help='Edge of the square synthetic images')
+    parser.add_argument('--count', type=int, default=8, help='Number of images per run')
+    parser.add_argument('--tile-size', type=int, default=128, help='Tile edge used by both paths')
+    parser.add_argument('--tile-pad', type=int, default=32, help='Tile padding used by both paths')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8],
+                        help='Tile batch sizes to measure for the batched engine')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed repetitions per measurement')
+    parser.add_argument('--precision', choices=['fp16', 'fp32'],
+                        help='Precision of both paths (default: fp16 on GPU, fp32 on CPU)')
+    args = parser.parse_args()
+
+    # RealESRGANer only runs fp16 or fp32, so the CPU default (bf16 where supported) is not used
+    precision = args.precision or ('fp16' if args.device != 'cpu' and torch.cuda.is_available() else 'fp32')
+    upscaler = ImageUpscaler(device=args.device, memory_efficient=True, precision=precision)
+    upscaler.upscaler.tile_size = args.tile_size
+    upscaler.upscaler.tile_pad = args.tile_pad
+    upscaler.engine.tile_size = args.tile_size
+    upscaler.engine.tile_pad = args.tile_pad
+    images = synthetic_images(args.size, args.count)
+
+    def per_tile():
+        # RealESRGANer prints a line per tile
+        with contextlib.redirect_stdout(io.StringIO()):
+            for img in images:
+                upscaler.upscaler.enhance(img, outscale=4)
+
+    baseline = time_call(per_tile, args.repeats)
+    print(f"{args.count} images of {args.size}x{args.size}, tile {args.tile_size} pad {args.tile_pad} "
+          f"on {upscaler.device}")
+    print(f"per-tile loop:        {args.count / baseline:8.3f} images/sec")
+    for batch_size in args.batch_sizes:
+        upscaler.engine.batch_size = batch_size
+        elapsed = time_call(lambda: upscaler.upscale_arrays(images), args.repeats)
+        print(f"batched (batch={batch_size:>3}): {args.count / elapsed:8.3f} images/sec "
+              f"({baseline / elapsed:.2f}x)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Speedup of skipping flat and duplicate tiles on poster-like images.
+
+Generates a synthetic poster (solid background, a gradient band and a
+repeated logo) and upscales it with every tile going through the network,
+with duplicate tiles reused, and with flat tiles interpolated as well. For
+each run it prints the skipped tiles, the speedup and the largest
+difference to the full run, e.g.
+
+    python benchmarks/tile_skipping.py --size 512 --tile-size 64 --threshold 1
+"""
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from upscaler import ImageUpscaler  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from tile_batching import time_call  # noqa: E402
+
+def synthetic_poster(size: int, tile_size: int, seed: int = 0) -> np.ndarray:
+    """Solid background with a gradient band on top and a logo repeated on the tile grid."""
+    rng = np.random.default_rng(seed)
+    img = np.empty((size, size, 3), dtype=np.uint8)
+    img[:] = (200, 120, 40)
+    band = size // 8
+    ramp = np.linspace(40, 40 + band // 4, size)
+    img[:band, :, 0] = ramp[None, :].astype(np.uint8)
+    img[:band, :, 1:] = (80, 200)
+    logo = cv2.resize(rng.integers(0, 256, (4, 4, 3), dtype=np.uint8), (tile_size // 2, tile_size // 2))
+    offset = tile_size // 4
+    for y in range(size // 2 - tile_size, size - tile_size, 2 * tile_size):
+        for x in range(tile_size, size - tile_size, 2 * tile_size):
+            img[y + offset:y + offset + logo.shape[0], x + offset:x + offset + logo.shape[1]] = logo
+    return img
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure flat and duplicate tile skipping")
+    parser.add_argument('--model', default='RealESRGAN_x4plus', help='Model to benchmark')
+    parser.add_argument('--size', type=int, default=512, help='Edge of the square synthetic poster')
+    parser.add_argument('--tile-size', type=int, default=128, help='Tile edge')
+    parser.add_argument('--threshold', type=float, default=1.0, help='Flat tile threshold in 8-bit levels')
+    parser.add_argument('--repeats', type=int, default=2, help='Timed repetitions per configuration')
+    args = parser.parse_args()
+
+    img = synthetic_poster(args.size, args.tile_size)
+    configs = {
+        'every tile': {'flat_tile_threshold': None, 'dedup_tiles': False},
+        'duplicates': {'flat_tile_threshold': None, 'dedup_tiles': True},
+        'duplicates + flat': {'flat_tile_threshold': args.threshold, 'dedup_tiles': True},
+    }
+    print(f"{args.size}x{args.size} poster, tiles of {args.tile_size}, {args.model}")
+    baseline = None
+    reference = None
+    for name, kwargs in configs.items():
+        upscaler = ImageUpscaler(model_name=args.model, **kwargs)
+        upscaler.max_tile_size = args.tile_size
+        engine = upscaler.engine
+        engine.tile_size = args.tile_size - args.tile_size % engine.mod_scale
+        metrics = Metrics()
+        output = upscaler.upscale_array(img, metrics=metrics)
+        elapsed = time_call(lambda: upscaler.upscale_array(img), args.repeats)
+        baseline = baseline or elapsed
+        reference = output if reference is None else reference
+        counters = metrics.counters
+        skipped = counters['tiles_flat'] + counters['tiles_duplicate']
+        error = np.abs(output.astype(np.int16) - reference).max()
+        print(f"{name:>18}: {elapsed:7.2f}s ({baseline / elapsed:.2f}x), skipped {skipped}/"
+              f"{skipped + counters['tiles']} tiles ({counters['tiles_flat']} flat, "
+              f"{counters['tiles_duplicate']} duplicate), max abs difference {error} levels")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Client for the upscale endpoint that keeps many jobs in flight.
+
+Images are submitted concurrently over one pooled HTTP session. Small
+payloads use /runsync, which returns the result in the same request;
+larger ones use /run and poll /status with exponential backoff, starting
+from the typical duration of the jobs already finished. Results are
+written to disk as each job completes, so memory holds only the jobs in
+flight. Works against RunPod or the local stand-in in fake_endpoint.py:
+
+    python endpoint_client.py --input images/ --output results/ --endpoint-id ID
+    python endpoint_client.py --input images/ --output results/ --url http://localhost:8000
+"""
+import os
+import time
+import base64
+import random
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Union
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+RUNPOD_API = 'https://api.runpod.ai/v2'
+# Responses after which a status poll can be sent again; a submitted job is
+# only sent again after 429, which means it was refused rather than queued
+_RETRY_STATUS_CODES = {429, 502, 503, 504}
+_FINAL_STATUSES = {'COMPLETED', 'FAILED', 'CANCELLED', 'TIMED_OUT'}
+_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp']
+
+class EndpointClient:
+    """
+    Submit upscale jobs to an endpoint and collect their results.
+
+    Args:
+        endpoint_url: Base URL of the endpoint, e.g. https://api.runpod.ai/v2/<endpoint id>
+        api_key: Bearer token sent with every request
+        concurrency: Jobs in flight at once, and connections kept in the pool
+        sync_max_bytes: Largest base64 payload sent to /runsync; larger ones use /run
+        poll_interval: First delay between status polls in seconds
+        max_poll_interval: Longest delay between status polls in seconds
+        timeout: Seconds a job may take before it is given up
+        retries: Attempts per request after an error that is safe to retry: for status
+            polls a connection error, timeout or 429/5xx response, for job submissions
+            only a failed connection or a 429 response, so no job is submitted twice
+    """
+
+    def __init__(self, endpoint_url: str, api_key: Optional[str] = None, concurrency: int = 8,
+                 sync_max_bytes: int = 2 * 1024**2, poll_interval: float = 0.25,
+                 max_poll_interval: float = 5.0, timeout: float = 600, retries: int = 5):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.concurrency = max(1, concurrency)
+        self.sync_max_bytes = sync_max_bytes
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.retries = retries
+        # Moving average of job durations, where the polling of the next job starts
+        self._typical_duration = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if api_key:
+            self.session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _request(self, method: str, path: str, **kwargs) -> Dict:
+        """
+        Send a request, retrying with backoff the failures that cannot duplicate work.
+
+        GET requests are idempotent and are retried after connection errors,
+        timeouts and 429/5xx responses. A POST may already have queued a job
+        when its response is lost or is a 5xx, so it is only retried when the
+        connection was never made or the endpoint answered 429.
+        """
+        idempotent = method == 'GET'
+        delay = self.poll_interval
+        for attempt in range(self.retries + 1):
+            try:
+                # /runsync holds the request open until the job finishes or its wait ends
+                response = self.session.request(method, f"{self.endpoint_url}/{path}", timeout=(10, 150), **kwargs)
+                if response.status_code not in _RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                error = f"HTTP {response.status_code}"
+                retry = idempotent or response.status_code == 429
+            except requests.Timeout as e:
+                error = f"timed out: {e}"
+                retry = idempotent or isinstance(e, requests.ConnectTimeout)
+            except requests.ConnectionError as e:
+                error = str(e)
+                retry = idempotent or _never_sent(e)
+            if not retry:
+                raise RuntimeError(f"{method} {path} failed and may have been received, so it is not retried: {error}")
+            if attempt == self.retries:
+                raise RuntimeError(f"{method} {path} failed after {attempt + 1} attempts: {error}")
+            time.sleep(delay * (1 + random.random()))
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def _wait(self, job_id: str, started: float) -> Dict:
+        """Poll a job until it reaches a final status."""
+        # The first poll comes when a typical job would be about done
+        delay = max(self.poll_interval, 0.8 * (self._typical_duration or 0) - (time.monotonic() - started))
+        while True:
+            if time.monotonic() - started + delay > self.timeout:
+                raise TimeoutError(f"Job {job_id} did not finish within {self.timeout}s")
+            time.sleep(delay * random.uniform(0.9, 1.1))
+            status = self._request('GET', f'status/{job_id}')
+            if status.get('status') in _FINAL_STATUSES:
+                return status
+            delay = min(delay * 1.5, self.max_poll_interval)
+
+    def run(self, job_input: Dict) -> Dict:
+        """
+        Run one job and return its output.
+
+        Args:
+            job_input: The "input" of the job, as accepted by runpod_handler
+
+        Returns:
+            dict: The handler's output, e.g. {"image": ..., "format": ..., "size": ...}
+
+        Raises:
+            RuntimeError: If the job failed or the endpoint could not be reached
+            TimeoutError: If the job did not finish within the client's timeout
+        """
+        started = time.monotonic()
+        payload_size = sum(len(value) for value in job_input.values() if isinstance(value, str))
+        route = 'runsync' if payload_size <= self.sync_max_bytes else 'run'
+        status = self._request('POST', route, json={'input': job_input})
+        if status.get('status') not in _FINAL_STATUSES:
+            status = self._wait(status['id'], started)
+        if status['status'] != 'COMPLETED':
+            raise RuntimeError(f"Job {status.get('id')} {status['status'].lower()}: {status.get('error')}")
+        duration = time.monotonic() - started
+        typical = self._typical_duration
+        self._typical_duration = duration if typical is None else 0.8 * typical + 0.2 * duration
+        output = status.get('output') or {}
+        # The handler wraps successful results in {"output": ...}
+        if isinstance(output.get('output'), dict):
+            output = output['output']
+        if 'error' in output:
+            raise RuntimeError(output['error'])
+        return output
+
+    def upscale_file(self, input_path: Union[str, Path], output_dir: Union[str, Path],
+                     options: Optional[Dict] = None) -> Path:
+        """
+        Upscale one image file and write the result into `output_dir`.
+
+        Args:
+            input_path: Image to upscale
+            output_dir: Directory the result is written to, as <stem>_upscaled.<format>
+            options: Further job input, e.g. {"model": ..., "format": "webp"}
+
+        Returns:
+            Path: The written result
+        """
+        input_path = Path(input_path)
+        job_input = dict(options or {}, image=base64.b64encode(input_path.read_bytes()).decode('utf-8'))
+        output = self.run(job_input)
+        ext = output.get('format') or input_path.suffix.lstrip('.')
+        output_path = Path(output_dir) / f"{input_path.stem}_upscaled.{ext}"
+        output_path.write_bytes(base64.b64decode(output['image']))
+        return output_path
+
+    def upscale_files(self, input_paths: Iterable[Union[str, Path]], output_dir: Union[str, Path],
+                      options: Optional[Dict] = None,
+                      on_done: Optional[Callable[[Path, Optional[Path], float], None]] = None) -> int:
+        """
+        Upscale many image files with up to `concurrency` jobs in flight.
+
+        Each image is read and encoded only when its job starts, and its result
+        is written as soon as the job completes.
+
+        Args:
+            input_paths: Images to upscale
+            output_dir: Directory the results are written to
+            options: Further job input applied to every image
+            on_done: Called with (input_path, output_path or None on failure, seconds)
+                as each image finishes
+
+        Returns:
+            int: Number of images upscaled successfully
+        """
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        successful = 0
+
+        def upscale(input_path):
+            started = time.monotonic()
+            return self.upscale_file(input_path, output_dir, options), time.monotonic() - started
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            futures = {pool.submit(upscale, Path(path)): Path(path) for path in input_paths}
+            for future in as_completed(futures):
+                input_path = futures[future]
+                try:
+                    output_path, duration = future.result()
+                    successful += 1
+                except Exception as e:
+                    logger.error(f"Error processing {input_path}: {str(e)}")
+                    output_path, duration = None, 0.0
+                if on_done:
+                    on_done(input_path, output_path, duration)
+        return successful
+
+def _never_sent(error: requests.ConnectionError) -> bool:
+    """Whether a connection error happened before the request reached the server."""
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+def _collect_inputs(inputs: List[str]) -> List[Path]:
+    """Expand the given files and directories into the image files to upscale."""
+    paths = []
+    for name in inputs:
+        path = Path(name)
+        if path.is_dir():
+            paths.extend(sorted(p for p in path.iterdir() if p.suffix.lower() in _IMAGE_EXTENSIONS))
+        else:
+            paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Upscale images on the endpoint with many jobs in flight")
+    parser.add_argument('--input', nargs='+', required=True, help='Image files or directories of images')
+    parser.add_argument('--output', required=True, help='Directory for the upscaled images')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--endpoint-id', help='RunPod endpoint ID')
+    target.add_argument('--url', help='Base URL of the endpoint, e.g. http://localhost:8000 for fake_endpoint.py')
+    parser.add_argument('--api-key', default=os.getenv('RUNPOD_API_KEY'),
+                        help='API key (default: $RUNPOD_API_KEY)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Jobs in flight at once (default: 8)')
+    parser.add_argument('--sync-max-kb', type=int, default=2048,
+                        help='Largest base64 payload in KB sent to /runsync; larger ones use /run (default: 2048)')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds a job may take (default: 600)')
+    parser.add_argument('--model', help='Model to use (default: the endpoint\'s model)')
+    parser.add_argument('--format', choices=['jpg', 'png', 'webp'], help='Output format (default: jpg)')
+    parser.add_argument('--quality', type=int, help='JPEG or lossy WebP quality, 1-100')
+    args = parser.parse_args()
+
+    paths = _collect_inputs(args.input)
+    if not paths:
+        parser.error("No images found")
+    options = {key: value for key, value in
+               (('model', args.model), ('format', args.format), ('quality', args.quality)) if value is not None}
+    endpoint_url = args.url or f"{RUNPOD_API}/{args.endpoint_id}"
+
+    def on_done(input_path, output_path, duration):
+        if output_path:
+            logger.info(f"Saved {output_path} ({duration:.2f}s)")
+
+    started = time.perf_counter()
+    with EndpointClient(endpoint_url, api_key=args.api_key, concurrency=args.concurrency,
+                        sync_max_bytes=args.sync_max_kb * 1024, timeout=args.timeout) as client:
+        successful = client.upscale_files(paths, args.output, options, on_done=on_done)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Upscaled {successful}/{len(paths)} images in {elapsed:.2f}s "
+                f"({successful / elapsed:.2f} images/sec)")
+    if successful < len(paths):
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the RunPod endpoint, serving runpod_handler.handler over HTTP.
+
+Implements the parts of the RunPod serverless API the clients use:
+
+- POST .../run: queue a job, returns {"id": ..., "status": "IN_QUEUE"}
+- POST .../runsync: run a job and wait up to --sync-wait seconds for it;
+  a job still running then is returned like /run and can be polled
+- GET .../status/<id>: the job's status, with its "output" or "error" once final
+
+Up to runpod_handler.MAX_CONCURRENCY jobs run at once, like on a worker.
+Finished jobs are kept for --result-ttl seconds. Handler results with an
+"error" are reported as FAILED, as RunPod does. Any path prefix is
+accepted, so http://localhost:8000 and http://localhost:8000/v2/<id> both work:
+
+    python fake_endpoint.py --port 8000
+    python endpoint_client.py --input images/ --output results/ --url http://localhost:8000
+"""
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import runpod_handler
+
+logger = logging.getLogger(__name__)
+
+class JobStore:
+    """
+    Jobs of the fake endpoint, run on a pool of MAX_CONCURRENCY threads.
+
+    Args:
+        concurrency: Jobs run at once
+        result_ttl: Seconds a finished job stays available to /status
+    """
+
+    def __init__(self, concurrency: int, result_ttl: float = 600):
+        self.result_ttl = result_ttl
+        self._jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='job')
+
+    def submit(self, job_input: Dict) -> Dict:
+        """Queue a job and return its record."""
+        self._prune()
+        job = {'id': str(uuid.uuid4()), 'status': 'IN_QUEUE', 'submitted': time.monotonic(),
+               'done': threading.Event()}
+        with self._lock:
+            self._jobs[job['id']] = job
+        self._executor.submit(self._run, job, {'id': job['id'], 'input': job_input})
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Dict, event: Dict):
+        job['started'] = time.monotonic()
+        job['status'] = 'IN_PROGRESS'
+        try:
+            result = runpod_handler.handler(event)
+        except Exception as e:
+            result = {'error': f"Handler raised: {str(e)}"}
+        if isinstance(result, dict) and 'error' in result:
+            job['error'] = result['error']
+            job['status'] = 'FAILED'
+        else:
+            job['output'] = result
+            job['status'] = 'COMPLETED'
+        job['finished'] = time.monotonic()
+        job['done'].set()
+
+    def _prune(self):
+        """Forget jobs that finished more than result_ttl seconds ago."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['done'].is_set() and now - job['finished'] > self.result_ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    @staticmethod
+    def describe(job: Dict) -> Dict:
+        """The job as RunPod reports it, with delay and execution times in milliseconds."""
+        status = {'id': job['id'], 'status': job['status']}
+        if 'started' in job:
+            status['delayTime'] = round((job['started'] - job['submitted']) * 1000)
+        if 'finished' in job:
+            status['executionTime'] = round((job['finished'] - job['started']) * 1000)
+        for key in ('output', 'error'):
+            if key in job:
+                status[key] = job[key]
+        return status
+
+def make_request_handler(store: JobStore, sync_wait: float, api_key: Optional[str] = None):
+    """Build the HTTP request handler class serving `store`."""
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, code: int, body: Dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            if api_key and self.headers.get('Authorization') != f'Bearer {api_key}':
+                self._send(401, {'error': 'Unauthorized'})
+                return False
+            return True
+
+        def do_POST(self):
+            # Read the body first, so the connection stays usable whatever the reply
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not self._authorized():
+                return
+            route = self.path.rstrip('/').rsplit('/', 1)[-1]
+            if route not in ('run', 'runsync'):
+                self._send(404, {'error': f'Unknown route: {self.path}'})
+                return
+            try:
+                job_input = json.loads(body)['input']
+            except (ValueError, KeyError, TypeError):
+                self._send(400, {'error': 'Expected a JSON body with "input"'})
+                return
+            job = store.submit(job_input)
+            if route == 'runsync':
+                job['done'].wait(sync_wait)
+            self._send(200, store.describe(job))
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            parts = self.path.rstrip('/').split('/')
+            if len(parts) < 2 or parts[-2] != 'status':
+                self._send(404, {'error': f'Unknown route: {self.path}'})
+                return
+            job = store.get(parts[-1])
+            if job is None:
+                self._send(404, {'error': f'Unknown job: {parts[-1]}'})
+                return
+            self._send(200, store.describe(job))
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return RequestHandler
+
+def serve(port: int = 8000, host: str = '127.0.0.1', sync_wait: float = 90, result_ttl: float = 600,
+          api_key: Optional[str] = None) -> ThreadingHTTPServer:
+    """
+    Create the fake endpoint server; call serve_forever() on it to run it.
+
+    Args:
+        port: Port to listen on (0 picks a free one)
+        host: Address to listen on
+        sync_wait: Seconds /runsync waits for a job before returning it unfinished
+        result_ttl: Seconds a finished job stays available to /status
+        api_key: Bearer token requests must carry (default: none required)
+
+    Returns:
+        ThreadingHTTPServer: The bound server
+    """
+    store = JobStore(runpod_handler.MAX_CONCURRENCY, result_ttl)
+    server = ThreadingHTTPServer((host, port), make_request_handler(store, sync_wait, api_key))
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve runpod_handler locally with the RunPod endpoint API")
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on (default: 8000)')
+    parser.add_argument('--sync-wait', type=float, default=90,
+                        help='Seconds /runsync waits before returning an unfinished job (default: 90)')
+    parser.add_argument('--result-ttl', type=float, default=600,
+                        help='Seconds finished jobs stay available to /status (default: 600)')
+    parser.add_argument('--api-key', help='Require this bearer token (default: no authentication)')
+    args = parser.parse_args()
+
+    server = serve(args.port, args.host, args.sync_wait, args.result_ttl, args.api_key)
+    threading.Thread(target=runpod_handler._warm_up, name='warm-up', daemon=True).start()
+    logger.info(f"Fake endpoint listening on http://{args.host}:{server.server_address[1]} "
+                f"({runpod_handler.MAX_CONCURRENCY} concurrent jobs)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the object storage that inputs and outputs are passed through.
+
+Serves a directory over HTTP so a job can reference its input and output by
+URL instead of sending them inline:
+
+- GET /<path>: the file, streamed in chunks
+- PUT /<path>: store the request body as the file, creating its directories
+
+Query strings are ignored, so presigned-looking URLs work too:
+
+    python fake_storage.py --root /tmp/storage --port 9000
+    curl -T photo.jpg http://localhost:9000/inputs/photo.jpg
+    # then send {"image_url": "http://localhost:9000/inputs/photo.jpg",
+    #            "output_url": "http://localhost:9000/outputs/photo.jpg"}
+"""
+import os
+import logging
+import argparse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+from transport import CHUNK_SIZE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def make_request_handler(root: str):
+    """Build the HTTP request handler class serving the files below `root`."""
+    root = os.path.realpath(root)
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send_status(self, code: int, message: str = ''):
+            data = message.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _file_path(self) -> Optional[str]:
+            """The file the request path names, or None if it escapes the root."""
+            path = os.path.realpath(os.path.join(root, unquote(urlparse(self.path).path).lstrip('/')))
+            if not path.startswith(root + os.sep):
+                self._send_status(403, 'Outside the storage root')
+                return None
+            return path
+
+        def do_GET(self):
+            path = self._file_path()
+            if path is None:
+                return
+            try:
+                f = open(path, 'rb')
+            except (FileNotFoundError, IsADirectoryError):
+                self._send_status(404, 'Not found')
+                return
+            with f:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+                self.end_headers()
+                try:
+                    while chunk := f.read(CHUNK_SIZE):
+                        self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading, e.g. at its size limit
+                    self.close_connection = True
+
+        def do_PUT(self):
+            if 'Content-Length' not in self.headers:
+                self._send_status(411, 'Content-Length required')
+                return
+            remaining = int(self.headers['Content-Length'])
+            path = self._file_path()
+            if path is None:
+                self.close_connection = True
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = os.path.join(os.path.dirname(path), f'.upload-{uuid.uuid4().hex}')
+            try:
+                with open(tmp_path, 'xb') as f:
+                    while remaining:
+                        chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise ConnectionError('Request body ended early')
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                os.replace(tmp_path, path)
+            except Exception:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+            self._send_status(201)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return RequestHandler
+
+def serve(root: str, port: int = 9000, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Create the fake storage server; call serve_forever() on it to run it.
+
+    Args:
+        root: Directory the files are read from and written to
+        port: Port to listen on (0 picks a free one)
+        host: Address to listen on
+
+    Returns:
+        ThreadingHTTPServer: The bound server
+    """
+    os.makedirs(root, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), make_request_handler(root))
+    server.daemon_threads = True
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a directory for GET and PUT, like object storage")
+    parser.add_argument('--root', required=True, help='Directory to serve')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=9000, help='Port to listen on (default: 9000)')
+    args = parser.parse_args()
+
+    server = serve(args.root, args.port, args.host)
+    logger.info(f"Fake storage serving {args.root} on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+class Metrics:
+    """
+    Stage timings, counters and memory readings of one unit of work.
+
+    Code is instrumented with `with metrics.stage('decode'):` blocks,
+    `metrics.count(...)` and `metrics.gauge(...)`. Repeated stages add up,
+    and all methods are safe to call from several threads. Pass
+    NULL_METRICS (the default everywhere) to switch instrumentation off: its
+    methods do nothing and never read the clock.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as (part of) stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name] += seconds
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def gauge(self, name: str, value: float):
+        """Record a reading, keeping the largest seen (e.g. peak memory)."""
+        with self._lock:
+            self.gauges[name] = max(value, self.gauges.get(name, value))
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        """Return `fn` timed as stage `name`, for work handed to other threads."""
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return timed
+
+    def merge(self, other: 'Metrics'):
+        """Add the readings of `other`, e.g. of a batch this unit of work took part in."""
+        timings, counters, gauges = other.snapshot()
+        with self._lock:
+            for name, seconds in timings.items():
+                self.timings[name] += seconds
+            for name, value in counters.items():
+                self.counters[name] += value
+            for name, value in gauges.items():
+                self.gauges[name] = max(value, self.gauges.get(name, value))
+
+    def snapshot(self) -> Tuple[Dict[str, float], Dict[str, int], Dict[str, float]]:
+        """Return copies of the timings (seconds), counters and gauges."""
+        with self._lock:
+            return dict(self.timings), dict(self.counters), dict(self.gauges)
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        """Timings in milliseconds, counters, and gauges (memory in MB)."""
+        timings, counters, gauges = self.snapshot()
+        return {
+            'timings_ms': {name: round(seconds * 1000, 2) for name, seconds in timings.items()},
+            'counters': counters,
+            'memory_mb': {name: round(value / 1024**2, 1) for name, value in gauges.items()},
+        }
+
+class _NullMetrics:
+    """Metrics that record nothing; see Metrics."""
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name: str):
+        return self._context
+
+    def add_time(self, name: str, seconds: float):
+        pass
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+    def gauge(self, name: str, value: float):
+        pass
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        return fn
+
+    def merge(self, other: Metrics):
+        pass
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        return {'timings_ms': {}, 'counters': {}, 'memory_mb': {}}
+
+NULL_METRICS = _NullMetrics()
+
+class MetricsRegistry:
+    """
+    Process-wide totals of recorded Metrics, rendered in the Prometheus text format.
+
+    Stage timings and counters accumulate as Prometheus counters, gauges
+    keep their last value, and the duration of each observed unit of work
+    goes into a histogram.
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, prefix: str = 'upscaler'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stage_seconds = defaultdict(float)
+        self._stage_calls = defaultdict(int)
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._buckets = [0] * len(self.BUCKETS)
+        self._duration_sum = 0.0
+        self._duration_count = 0
+
+    def observe(self, metrics: Metrics, duration: Optional[float] = None):
+        """
+        Add the readings of one unit of work (a request, an image, a batch run).
+
+        Args:
+            metrics: Readings to add. Disabled metrics are ignored.
+            duration: Wall time of the unit of work in seconds, for the duration histogram
+        """
+        if not metrics.enabled:
+            return
+        timings, counters, gauges = metrics.snapshot()
+        with self._lock:
+            for name, seconds in timings.items():
+                self._stage_seconds[name] += seconds
+                self._stage_calls[name] += 1
+            for name, value in counters.items():
+                self._counters[name] += value
+            self._gauges.update(gauges)
+            if duration is not None:
+                self._duration_sum += duration
+                self._duration_count += 1
+                # Every bucket the duration fits in counts it, so the counts are cumulative
+                for index, bound in enumerate(self.BUCKETS):
+                    if duration <= bound:
+                        self._buckets[index] += 1
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text exposition format."""
+        p = self.prefix
+        with self._lock:
+            lines = [f'# HELP {p}_stage_seconds_total Time spent in each processing stage',
+                     f'# TYPE {p}_stage_seconds_total counter']
+            lines += [f'{p}_stage_seconds_total{{stage="{name}"}} {seconds:.6f}'
+                      for name, seconds in sorted(self._stage_seconds.items())]
+            lines += [f'# HELP {p}_stage_runs_total Units of work that went through each stage',
+                      f'# TYPE {p}_stage_runs_total counter']
+            lines += [f'{p}_stage_runs_total{{stage="{name}"}} {calls}'
+                      for name, calls in sorted(self._stage_calls.items())]
+            lines += [f'# HELP {p}_events_total Counted events (cache hits, tiles, retries, ...)',
+                      f'# TYPE {p}_events_total counter']
+            lines += [f'{p}_events_total{{event="{name}"}} {value}'
+                      for name, value in sorted(self._counters.items())]
+            lines += [f'# HELP {p}_memory_bytes Last memory readings',
+                      f'# TYPE {p}_memory_bytes gauge']
+            lines += [f'{p}_memory_bytes{{kind="{name}"}} {value:.0f}'
+                      for name, value in sorted(self._gauges.items())]
+            lines += [f'# HELP {p}_duration_seconds Wall time of each unit of work',
+                      f'# TYPE {p}_duration_seconds histogram']
+            for bound, count in zip(self.BUCKETS, self._buckets):
+                lines.append(f'{p}_duration_seconds_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{p}_duration_seconds_bucket{{le="+Inf"}} {self._duration_count}')
+            lines.append(f'{p}_duration_seconds_sum {self._duration_sum:.6f}')
+            lines.append(f'{p}_duration_seconds_count {self._duration_count}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        """Serve render() at /metrics from a daemon thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        return server
+
+# Shared by the handler and the CLI
+REGISTRY = MetricsRegistry()
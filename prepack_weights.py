@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Prepack model weights so workers load them by memory-mapping instead of unpickling.
+
+Run once after the checkpoints are in place (the Dockerfile does this at
+build time). Without arguments every model whose checkpoint is available
+locally is prepacked.
+"""
+import sys
+import argparse
+from upscaler import MODEL_REGISTRY, prepack_weights, _model_path, _is_url, logger
+
+def main():
+    parser = argparse.ArgumentParser(description='Prepack Real-ESRGAN weights for fast loading')
+    parser.add_argument('models', nargs='*',
+                        help=f"Models to prepack, from: {', '.join(MODEL_REGISTRY)} "
+                             "(default: every model available locally)")
+    parser.add_argument('--default-model', type=str, default='RealESRGAN_x4plus', choices=list(MODEL_REGISTRY),
+                        help='Model whose weights MODEL_PATH points to')
+    args = parser.parse_args()
+
+    models = args.models or [name for name in MODEL_REGISTRY
+                             if not _is_url(_model_path(name, args.default_model))]
+    failed = 0
+    for name in models:
+        try:
+            prepack_weights(name, default_model=args.default_model)
+        except Exception as e:
+            logger.error(f"Could not prepack {name}: {str(e)}")
+            failed += 1
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
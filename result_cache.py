@@ -0,0 +1,201 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+class ResultCache:
+    """
+    Content-addressed cache of encoded upscale results.
+
+    Results are keyed by a hash of the input bytes and every setting that
+    influences the output. A bounded in-memory LRU tier sits in front of an
+    optional on-disk tier, which is size-capped and evicts least recently
+    used entries. Disk writes go through a temporary file and os.replace, so
+    a crash never leaves a truncated entry behind.
+    """
+
+    def __init__(self, memory_bytes: int = 256 * 1024**2, disk_dir: Union[str, Path] = None,
+                 disk_bytes: int = 2 * 1024**3):
+        """
+        Initialize the cache.
+
+        Args:
+            memory_bytes: Maximum total size of entries kept in memory (0 disables the memory tier)
+            disk_dir: Directory of the on-disk tier. If None, only the memory tier is used.
+            disk_bytes: Maximum total size of entries kept on disk
+        """
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(data: bytes, **params) -> str:
+        """
+        Build the cache key of an input and the settings used to process it.
+
+        Args:
+            data: Encoded input image bytes
+            **params: Every setting that affects the output (model, scale, tiling, format, ...)
+
+        Returns:
+            str: Hex digest identifying the result
+        """
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / key
+
+    def _load_disk_index(self):
+        """Rebuild the LRU order of the disk tier from file modification times."""
+        entries = []
+        for path in self.disk_dir.glob('*/*'):
+            if path.name.startswith('.'):
+                # Leftover temporary file from an interrupted write
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._delete(self._evict_disk())
+        logger.info(f"Result cache loaded {len(self._disk)} entries ({self._disk_size / 1024**2:.1f}MB) "
+                    f"from {self.disk_dir}")
+
+    def _remember(self, key: str, value: bytes):
+        """Store an entry in the memory tier, evicting the least recently used ones."""
+        if len(value) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _evict_disk(self) -> List[Path]:
+        """Drop least recently used disk entries over the size cap; returns their files to delete."""
+        evicted = []
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            evicted.append(self._disk_path(key))
+        return evicted
+
+    @staticmethod
+    def _delete(paths: List[Path]):
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Look up a result.
+
+        The lock only covers the LRU bookkeeping; disk entries are read
+        outside it, so concurrent lookups do not wait on each other's I/O.
+
+        Args:
+            key: Key returned by make_key
+
+        Returns:
+            Optional[bytes]: The cached result, or None on a miss
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            on_disk = self.disk_dir is not None and key in self._disk
+            if not on_disk:
+                self.misses += 1
+                return None
+
+        path = self._disk_path(key)
+        try:
+            value = path.read_bytes()
+            os.utime(path)
+        except OSError as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+            value = None
+        with self._lock:
+            if value is None:
+                # Unreadable, or evicted while it was being read
+                if key in self._disk:
+                    self._disk_size -= self._disk.pop(key)
+                self.misses += 1
+                return None
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._remember(key, value)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: bytes):
+        """
+        Store a result in every enabled tier.
+
+        The disk entry is written to a temporary file and moved into place
+        outside the lock; only the index update holds it.
+
+        Args:
+            key: Key returned by make_key
+            value: Encoded result bytes
+        """
+        with self._lock:
+            self._remember(key, value)
+        if not self.disk_dir or len(value) > self.disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = None
+        try:
+            path.parent.mkdir(exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if tmp_path:
+                Path(tmp_path).unlink(missing_ok=True)
+            logger.warning(f"Could not write cache entry {key}: {str(e)}")
+            return
+        with self._lock:
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)
+            self._disk[key] = len(value)
+            self._disk_size += len(value)
+            evicted = self._evict_disk()
+        self._delete(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current size of each tier."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_size,
+            }
@@ -1,10 +1,17 @@
 import os
+import json
+import asyncio
+import time
 import base64
-import runpod
+import binascii
 import logging
-from PIL import Image
-from io import BytesIO
-from upscaler import ImageUpscaler
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import runpod
+from result_cache import ResultCache
+from transport import CONTENT_TYPES, check_reference, read_reference, write_reference
+from metrics import Metrics, NULL_METRICS, REGISTRY
 
 # Set up logging
 logging.basicConfig(
@@ -13,103 +20,335 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize the upscaler with error handling
-try:
-    logger.info("Initializing upscaler...")
-    upscaler = ImageUpscaler(device='cuda', memory_efficient=True)
-    logger.info("Upscaler initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize upscaler: {str(e)}")
-    raise
-
-def save_base64_image(base64_string, output_path):
-    """Save a base64 string as an image"""
+# torch, OpenCV and the model weights are only loaded by get_upscaler(), so the
+# worker can start polling for jobs while the model is still loading
+_upscaler = None
+_upscaler_lock = threading.Lock()
+# With METRICS_ENABLED every request is instrumented and added to the Prometheus
+# registry, which METRICS_PORT serves at /metrics. Otherwise only requests asking
+# for "metrics" are instrumented.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+# Up to MAX_CONCURRENCY jobs are in flight at once. Their images are decoded and
+# encoded on these threads, while inference runs one batch at a time from the
+# upscaler's queue; small images wait up to MICRO_BATCH_WAIT_MS to share a batch
+MAX_CONCURRENCY = int(os.getenv('MAX_CONCURRENCY', '4'))
+MAX_IMAGES = int(os.getenv('MAX_IMAGES', '64'))
+_item_executor = ThreadPoolExecutor(max_workers=int(os.getenv('IMAGE_WORKERS', '8')), thread_name_prefix='image')
+# Seconds spent in each startup phase, logged once after the first request
+_startup_timings = {}
+_startup_reported = False
+
+def get_upscaler():
+    """Return the shared upscaler, importing and initializing it on first use."""
+    global _upscaler
+    with _upscaler_lock:
+        if _upscaler is not None:
+            return _upscaler
+        try:
+            logger.info("Initializing upscaler...")
+            started = time.perf_counter()
+            import torch
+            from upscaler import ImageUpscaler
+            _startup_timings['import'] = time.perf_counter() - started
+            logger.info(f"PyTorch {torch.__version__}, CUDA available: {torch.cuda.is_available()}")
+            # Repeated submissions of the same image are served from the result cache.
+            # Set RESULT_CACHE_DIR to an empty string to keep the cache in memory only.
+            cache = ResultCache(
+                memory_bytes=int(os.getenv('RESULT_CACHE_MEMORY_MB', '256')) * 1024**2,
+                disk_dir=os.getenv('RESULT_CACHE_DIR', '/workspace/cache/results'),
+                disk_bytes=int(os.getenv('RESULT_CACHE_DISK_MB', '2048')) * 1024**2
+            )
+            _upscaler = ImageUpscaler(device='cuda', memory_efficient=True, cache=cache,
+                                      model_memory_budget=int(os.getenv('MODEL_MEMORY_MB', '2048')) * 1024**2,
+                                      precision=os.getenv('PRECISION') or None,
+                                      backend=os.getenv('INFERENCE_BACKEND', 'torch'),
+                                      micro_batch_wait=float(os.getenv('MICRO_BATCH_WAIT_MS', '5')) / 1000,
+                                      micro_batch_size=int(os.getenv('MICRO_BATCH_SIZE', '8')),
+                                      flat_tile_threshold=(float(os.environ['FLAT_TILE_THRESHOLD'])
+                                                           if os.getenv('FLAT_TILE_THRESHOLD') else None),
+                                      pad_batches=bool(os.getenv('MICRO_BATCH_PAD')))
+            logger.info("Upscaler initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize upscaler: {str(e)}")
+            raise
+        return _upscaler
+
+def _warm_up():
+    """Load the model in the background; a failure is reported again by the first request."""
     try:
-        img_data = base64.b64decode(base64_string)
-        with open(output_path, 'wb') as f:
-            f.write(img_data)
-        return True
-    except Exception as e:
-        logger.error(f"Error saving base64 image: {str(e)}")
-        return False
+        get_upscaler()
+    except Exception:
+        pass
+
+def _report_startup(upscaler):
+    """Log the startup timings once the first inference has run."""
+    global _startup_reported
+    if _startup_reported or 'first_inference' not in upscaler.startup_timings:
+        return
+    _startup_reported = True
+    timings = dict(_startup_timings, **upscaler.startup_timings)
+    timings['total'] = sum(timings.values())
+    logger.info(f"Startup timings: {json.dumps({k: round(v, 3) for k, v in timings.items()})}")
 
-def image_to_base64(image_path):
-    """Convert an image file to base64 string"""
+def decode_base64_image(base64_string):
+    """Decode a base64 string into raw image bytes"""
     try:
-        with open(image_path, 'rb') as f:
-            return base64.b64encode(f.read()).decode('utf-8')
-    except Exception as e:
-        logger.error(f"Error converting image to base64: {str(e)}")
+        return base64.b64decode(base64_string)
+    except (binascii.Error, ValueError, TypeError) as e:
+        logger.error(f"Error decoding base64 image: {str(e)}")
         return None
 
-def handler(event):
+# Output options a request sets for all its images and an image can override
+_OUTPUT_OPTIONS = ("format", "quality", "png_compression", "progressive", "lossless", "target_size", "max_edge")
+
+def _output_size(options):
+    """Validate the requested output size; returns (target_size, max_edge) or raises ValueError."""
+    target_size, max_edge = options["target_size"], options["max_edge"]
+    if target_size is not None and max_edge is not None:
+        raise ValueError("Give only one of 'target_size' and 'max_edge'")
+    if target_size is not None:
+        if (not isinstance(target_size, (list, tuple)) or len(target_size) != 2
+                or not all(isinstance(value, int) and value > 0 for value in target_size)):
+            raise ValueError("'target_size' must be [width, height] in pixels")
+        target_size = tuple(target_size)
+    if max_edge is not None and (not isinstance(max_edge, int) or max_edge <= 0):
+        raise ValueError("'max_edge' must be a positive number of pixels")
+    return target_size, max_edge
+
+def _upscale_item(upscaler, item, defaults, metrics=NULL_METRICS):
+    """
+    Upscale one requested image.
+    
+    Args:
+        upscaler: The shared ImageUpscaler
+        item: Base64 string, or dict with "image" or "image_url", an optional
+            "output_url", and optional per-image "model" and output options
+        defaults: The request input, whose "model" and output options apply when
+            the item sets none
+        metrics: Receives stage timings and counters
+        
+    Returns:
+        dict: {"image": base64_string, "format": ..., "size": encoded_bytes} on success,
+            with "output_url" instead of "image" when the item gives one,
+            {"error": message} otherwise
+    """
+    from upscaler import MODEL_REGISTRY, OutputFormat
+    if isinstance(item, str):
+        item = {"image": item}
+    if (not isinstance(item, dict) or ("image" in item) == ("image_url" in item)
+            or not isinstance(item.get("image", item.get("image_url")), str)
+            or not isinstance(item.get("output_url", ""), str)):
+        return {"error": "Each image must be a base64 string or an object with either an 'image' base64 string "
+                         "or an 'image_url' string, and optionally an 'output_url' string"}
+
+    model_name = item.get("model") or defaults.get("model") or upscaler.model_name
+    if model_name not in MODEL_REGISTRY:
+        error_msg = f"Unsupported model: {model_name}. Available: {', '.join(MODEL_REGISTRY)}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+    options = {key: item.get(key, defaults.get(key)) for key in _OUTPUT_OPTIONS}
+    suffix = ''
+    if "output_url" in item:
+        suffix = os.path.splitext(urlparse(item["output_url"]).path)[1].lower().lstrip('.')
+        try:
+            check_reference(item["output_url"])
+            if suffix and suffix not in CONTENT_TYPES:
+                raise ValueError(f"Unsupported extension .{suffix}. Use one of "
+                                 f"{', '.join('.' + ext for ext in CONTENT_TYPES)} or none")
+        except ValueError as e:
+            error_msg = f"Invalid output_url: {str(e)}"
+            logger.error(error_msg)
+            return {"error": error_msg}
+        if options["format"] is None and suffix:
+            # Without a format, the extension of the target picks it
+            options["format"] = suffix
+    try:
+        output_format = OutputFormat(options["format"] or "jpg", quality=options["quality"],
+                                     png_compression=options["png_compression"],
+                                     progressive=bool(options["progressive"]), lossless=bool(options["lossless"]))
+        target_size, max_edge = _output_size(options)
+    except (ValueError, TypeError, AttributeError) as e:
+        error_msg = f"Invalid output options: {str(e)}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+    if suffix and CONTENT_TYPES[suffix] != CONTENT_TYPES[output_format.ext[1:]]:
+        error_msg = f"Invalid output_url: format {output_format.ext[1:]} does not match its extension .{suffix}"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+    if "image_url" in item:
+        # Fetch the input by reference instead of receiving it inline
+        try:
+            with metrics.stage('download'):
+                input_bytes = read_reference(item["image_url"])
+        except Exception as e:
+            error_msg = f"Failed to read input image: {str(e)}"
+            logger.error(error_msg)
+            metrics.count('errors')
+            return {"error": error_msg}
+    else:
+        # Decode the input image
+        with metrics.stage('base64_decode'):
+            input_bytes = decode_base64_image(item["image"])
+    if not input_bytes:
+        error_msg = "Failed to decode input image"
+        logger.error(error_msg)
+        return {"error": error_msg}
+
+    try:
+        output_bytes = upscaler.upscale_bytes(input_bytes, fmt=output_format, model_name=model_name,
+                                              metrics=metrics, target_size=target_size, max_edge=max_edge)
+    except Exception as e:
+        error_msg = f"Failed to process image: {str(e)}"
+        logger.error(error_msg)
+        metrics.count('errors')
+        return {"error": error_msg}
+
+    ext = output_format.ext[1:]
+    if "output_url" in item:
+        # Store the output at the reference and return only where it is
+        try:
+            with metrics.stage('upload'):
+                location = write_reference(item["output_url"], output_bytes, CONTENT_TYPES[ext])
+        except Exception as e:
+            error_msg = f"Failed to write output image: {str(e)}"
+            logger.error(error_msg)
+            metrics.count('errors')
+            return {"error": error_msg}
+        return {"output_url": location, "format": ext, "size": len(output_bytes)}
+
+    # Convert output to base64
+    with metrics.stage('base64_encode'):
+        output_base64 = base64.b64encode(output_bytes).decode('utf-8')
+    return {"image": output_base64, "format": ext, "size": len(output_bytes)}
+
+def concurrency_modifier(current_concurrency):
+    """Number of jobs RunPod may run on this worker at once."""
+    return MAX_CONCURRENCY
+
+async def async_handler(event):
     """
     Handler function for RunPod serverless requests
     
+    Images are decoded, upscaled and re-encoded entirely in memory, so
+    concurrent requests never share any files. Decoding and encoding run on
+    a thread pool, so they overlap the inference of other images and jobs,
+    and small images share inference batches.
+    
     Input format:
     {
         "input": {
-            "image": "base64_encoded_image_string"
+            "image": "base64_encoded_image_string",
+            "model": "RealESRGAN_x4plus",  # optional, any key of MODEL_REGISTRY
+            "format": "jpg",  # optional, "jpg", "png" or "webp"
+            "quality": 95,  # optional, JPEG or lossy WebP quality (1-100)
+            "png_compression": null,  # optional, PNG zlib level (0-9), default the fastest
+            "progressive": false,  # optional, progressive JPEG
+            "lossless": false,  # optional, lossless WebP
+            "max_edge": 3840,  # optional, long edge of the output in pixels
+            "target_size": [3840, 2160],  # optional, exact output size instead of max_edge
+            "metrics": false  # optional, return per-stage timings, counters and memory
         }
     }
+    
+    or, for several images, "images" instead of "image". Each entry is a
+    base64 string or {"image": ..., "model": ...} with any of the output
+    options; options an image leaves out are taken from the request. Entries
+    may use "image_url" and "output_url" too; output targets are per image
+    and never taken from the request. The output then holds "images", one
+    {"image": ...}, {"output_url": ...} or {"error": ...} per input, in order,
+    and a failed image does not fail the others. Every result reports its
+    "format" and encoded "size" in bytes.
+    
+    Instead of "image", "image_url" passes the input by reference: a path on
+    a shared volume (below SHARED_VOLUME_ROOTS), an http(s):// URL or an
+    s3://bucket/key. With "output_url", a reference of the same kinds (for
+    http(s) one that accepts a PUT, e.g. a presigned URL), the output is
+    stored there and the result holds its "output_url" instead of "image".
+    Large images then never pass through the job payload as base64. The
+    extension of an "output_url", if it has one, must be .jpg, .jpeg, .png
+    or .webp and match "format"; without a "format" it picks the format.
     """
     try:
         # Validate input
-        if not event or "input" not in event or "image" not in event["input"]:
-            error_msg = "Invalid input format. Expected {'input': {'image': 'base64_string'}}"
-            logger.error(error_msg)
-            return {"error": error_msg}
-            
-        # Get the input image
-        input_image = event["input"]["image"]
-        
-        # Save input image
-        input_path = "/workspace/input/image.jpg"
-        if not save_base64_image(input_image, input_path):
-            error_msg = "Failed to save input image"
+        job_input = event.get("input") if isinstance(event, dict) else None
+        if not isinstance(job_input, dict) or not any(key in job_input for key in ("image", "image_url", "images")):
+            error_msg = ("Invalid input format. Expected {'input': {'image': 'base64_string'}}, "
+                         "{'input': {'image_url': 'reference'}} or {'input': {'images': [...]}}")
             logger.error(error_msg)
             return {"error": error_msg}
-        
-        # Process image
-        output_path = "/workspace/output/upscaled.jpg"
-        logger.info("Starting image upscaling...")
-        success = upscaler.upscale_image(input_path, output_path)
-        
-        if not success:
-            error_msg = "Failed to process image"
+        items = job_input.get("images")
+        if items is not None and (not isinstance(items, list) or not items or len(items) > MAX_IMAGES):
+            error_msg = f"'images' must be a list of 1 to {MAX_IMAGES} images"
             logger.error(error_msg)
             return {"error": error_msg}
-        
-        # Convert output to base64
-        output_base64 = image_to_base64(output_path)
-        if not output_base64:
-            error_msg = "Failed to convert output image to base64"
-            logger.error(error_msg)
-            return {"error": error_msg}
-        
-        # Clean up
+            
+        want_metrics = bool(job_input.get("metrics"))
+        metrics = Metrics() if want_metrics or METRICS_ENABLED else NULL_METRICS
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+            
         try:
-            os.remove(input_path)
-            os.remove(output_path)
+            with metrics.stage('init'):
+                upscaler = await loop.run_in_executor(None, get_upscaler)
         except Exception as e:
-            logger.warning(f"Error cleaning up temporary files: {str(e)}")
+            error_msg = f"Failed to initialize upscaler: {str(e)}"
+            logger.error(error_msg)
+            return {"error": error_msg}
+            
+        logger.info("Starting image upscaling...")
+        if items is None:
+            item = {key: job_input[key] for key in ("image", "image_url", "output_url") if key in job_input}
+            result = await loop.run_in_executor(_item_executor, _upscale_item, upscaler, item, job_input, metrics)
+            if "error" in result:
+                if METRICS_ENABLED:
+                    REGISTRY.observe(metrics, time.perf_counter() - started)
+                return result
+            output = result
+        else:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(_item_executor, _upscale_item, upscaler, item, job_input, metrics)
+                for item in items))
+            failed = sum("error" in result for result in results)
+            metrics.count('images', len(results))
+            output = {"images": results}
+            logger.info(f"Upscaled {len(results) - failed}/{len(results)} images")
         
-        logger.info("Successfully processed image")
-        return {
-            "output": {
-                "image": output_base64
-            }
-        }
+        _report_startup(upscaler)
+        stats = upscaler.cache.stats()
+        logger.info(f"Successfully processed request (cache hits: {stats['hits']}, misses: {stats['misses']})")
+        if metrics.enabled:
+            metrics.add_time('total', time.perf_counter() - started)
+            metrics.count('requests')
+            if METRICS_ENABLED:
+                REGISTRY.observe(metrics, time.perf_counter() - started)
+            readings = metrics.to_dict()
+            logger.info(f"Request metrics: {json.dumps(readings)}")
+            if want_metrics:
+                output["metrics"] = readings
+        return {"output": output}
         
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
         logger.error(error_msg)
         return {"error": error_msg}
 
-# Start the serverless handler with error handling
-try:
-    logger.info("Starting RunPod serverless handler...")
-    runpod.serverless.start({"handler": handler})
-except Exception as e:
-    logger.error(f"Failed to start serverless handler: {str(e)}")
-    raise 
\ No newline at end of file
+def handler(event):
+    """Synchronous form of async_handler, for callers without an event loop."""
+    return asyncio.run(async_handler(event))
+
+if __name__ == '__main__':
+    threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+    if METRICS_ENABLED and METRICS_PORT:
+        REGISTRY.serve(METRICS_PORT)
+        logger.info(f"Serving Prometheus metrics on port {METRICS_PORT}")
+    # Start the serverless handler with error handling
+    try:
+        logger.info("Starting RunPod serverless handler...")
+        runpod.serverless.start({"handler": async_handler, "concurrency_modifier": concurrency_modifier})
+    except Exception as e:
+        logger.error(f"Failed to start serverless handler: {str(e)}")
+        raise
+ 
\ No newline at end of file
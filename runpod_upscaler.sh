@@ -63,7 +63,7 @@ setup_environment() {
     # Install dependencies and copy files
     runpodctl exec $POD_ID -- bash -c '
         apt-get update && apt-get install -y git python3-pip
-        pip install basicsr facexlib gfpgan numpy opencv-python Pillow torch torchvision tqdm realesrgan
+        pip install numpy opencv-python Pillow torch tqdm
         # Clear pip cache to save space
         pip cache purge
     '
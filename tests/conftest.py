@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+import upscaler
+
+class NearestNetwork(torch.nn.Module):
+    """Nearest-neighbour upscaling in place of a model's network, so no weights are needed."""
+
+    def __init__(self, scale: int):
+        super().__init__()
+        self.scale = scale
+        self.weight = torch.nn.Parameter(torch.zeros(1))
+        self.calls = []
+
+    def forward(self, batch):
+        self.calls.append(tuple(batch.shape))
+        return torch.nn.functional.interpolate(batch, scale_factor=self.scale, mode='nearest')
+
+def nearest(img, scale=4):
+    """Expected output of NearestNetwork for an HxW(xC) image."""
+    return img.repeat(scale, axis=0).repeat(scale, axis=1)
+
+def touch(path, data=b'x'):
+    """Write a small file, creating its directories."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+@pytest.fixture
+def make_upscaler(monkeypatch):
+    """Build CPU ImageUpscalers whose models upscale by nearest neighbour; model.calls records their passes."""
+    monkeypatch.setattr(upscaler, '_load_state_dict', lambda model_name, path: ({}, 'test'))
+    monkeypatch.setattr(upscaler, '_build_network',
+                        lambda model_name, state_dict: NearestNetwork(upscaler.MODEL_REGISTRY[model_name]['scale']))
+
+    def make(**kwargs):
+        return upscaler.ImageUpscaler(**dict({'device': 'cpu', 'precision': 'fp32'}, **kwargs))
+
+    return make
@@ -0,0 +1,79 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import upscaler
+from conftest import touch
+from upscaler import LargestFirstQueue, _scan_images
+
+def test_scan_yields_images_depth_first_in_name_order(tmp_path):
+    for name in ('b.PNG', 'a.jpg', 'notes.txt', 'sub/c.png', 'sub/deeper/d.webp', 'skip/e.png', 'out/f.png'):
+        touch(tmp_path / name)
+    found = lambda **kwargs: [p.relative_to(tmp_path).as_posix()
+                              for p in _scan_images(tmp_path, ['.jpg', '.png', '.webp'], **kwargs)]
+
+    assert found() == ['a.jpg', 'b.PNG']
+    assert found(recursive=True, exclude=['skip'], skip_dirs=[tmp_path / 'out']) == \
+        ['a.jpg', 'b.PNG', 'sub/c.png', 'sub/deeper/d.webp']
+    assert found(recursive=True, include=['sub/*']) == ['sub/c.png', 'sub/deeper/d.webp']
+
+def test_scan_yields_linked_files_once_and_does_not_follow_linked_dirs(tmp_path):
+    touch(tmp_path / 'a.png')
+    os.link(tmp_path / 'a.png', tmp_path / 'hard.png')
+    os.symlink(tmp_path / 'a.png', tmp_path / 'soft.png')
+    os.symlink(tmp_path, tmp_path / 'loop')
+    assert [p.name for p in _scan_images(tmp_path, ['.png'], recursive=True)] == ['a.png']
+
+def test_largest_first_queue_hands_out_the_largest_job_found_so_far():
+    sizes = {'small': 1, 'large': 100, 'medium': 10, 'tie': 10}
+    jobs = LargestFirstQueue(iter(sizes), key=sizes.get)
+    assert list(jobs) == ['large', 'medium', 'tie', 'small']
+    assert jobs.count == 4
+
+def test_largest_first_queue_serves_jobs_while_discovery_runs():
+    more = threading.Event()
+
+    def discover():
+        yield 'first'
+        assert more.wait(10)
+        yield 'second'
+
+    jobs = LargestFirstQueue(discover(), key=len)
+    assert jobs.get(timeout=10) == 'first'
+    with pytest.raises(queue.Empty):
+        jobs.get(timeout=0.05)
+    more.set()
+    assert list(jobs) == ['second']
+
+def test_largest_first_queue_keeps_jobs_found_before_an_error():
+    def discover():
+        yield 'a'
+        raise OSError('listing failed')
+
+    assert list(LargestFirstQueue(discover(), key=len)) == ['a']
+
+def test_sharded_batch_keeps_feeding_workers_that_hold_a_full_pipeline(make_upscaler, monkeypatch, tmp_path):
+    # fork lets the workers inherit the nearest-neighbour model from make_upscaler
+    fork = mp.get_context('fork')
+    monkeypatch.setattr(upscaler.mp, 'get_context', lambda method=None: fork)
+    (tmp_path / 'in').mkdir()
+    # More small images than the parent queues ahead of the results
+    for i in range(40):
+        cv2.imwrite(str(tmp_path / 'in' / f'{i:02d}.png'), np.full((16, 16, 3), i, dtype=np.uint8))
+
+    run = threading.Thread(target=upscaler.sharded_batch_upscale, daemon=True,
+                           args=(tmp_path / 'in', tmp_path / 'out'),
+                           kwargs=dict(workers=1, device='cpu', prefetch=4, tile_batch_size=4,
+                                       precision='fp32'))
+    run.start()
+    run.join(30)
+    hung = run.is_alive()
+    for child in fork.active_children():
+        child.terminate()
+    assert not hung
+    assert len(list((tmp_path / 'out').glob('*_upscaled.png'))) == 40
@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+
+from conftest import touch
+from upscaler import BatchManifest
+
+def test_manifest_resumes_only_unfinished_inputs(tmp_path):
+    inputs = {name: touch(tmp_path / 'in' / f'{name}.png') for name in ('done', 'failed', 'changed', 'lost', 'new')}
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    outputs = {name: output_dir / f'{name}_upscaled.png' for name in inputs}
+
+    manifest = BatchManifest(output_dir)
+    for name in ('done', 'failed', 'changed', 'lost'):
+        assert not manifest.is_up_to_date(inputs[name], outputs[name])
+        touch(outputs[name])
+        manifest.record(inputs[name], outputs[name], success=name != 'failed', duration=0.5)
+    # Interrupted run: the manifest is not closed
+    touch(inputs['changed'], b'edited')
+    outputs['lost'].unlink()
+
+    resumed = BatchManifest(output_dir)
+    assert [name for name in inputs if not resumed.is_up_to_date(inputs[name], outputs[name])] == \
+        ['failed', 'changed', 'lost', 'new']
+    # An output written elsewhere than recorded does not count
+    assert not resumed.is_up_to_date(inputs['done'], output_dir / 'done_upscaled.jpg')
+    resumed.close()
+
+def test_manifest_skips_a_torn_line_and_compacts_on_close(tmp_path):
+    image = touch(tmp_path / 'a.png')
+    output = touch(tmp_path / 'a_upscaled.png')
+    manifest = BatchManifest(tmp_path)
+    manifest.is_up_to_date(image, output)
+    manifest.record(image, output, success=False, duration=1)
+    manifest.is_up_to_date(image, output)
+    manifest.record(image, output, success=True, duration=1)
+    manifest.close()
+    assert len(manifest.path.read_text().splitlines()) == 1
+    with open(manifest.path, 'a') as f:
+        f.write('{"input": "trunc')
+
+    assert BatchManifest(tmp_path).is_up_to_date(image, output)
+
+def test_input_modified_while_processing_is_redone(tmp_path):
+    image = touch(tmp_path / 'a.png')
+    output = touch(tmp_path / 'a_upscaled.png')
+    manifest = BatchManifest(tmp_path)
+    manifest.is_up_to_date(image, output)
+    touch(image, b'modified during the run')
+    manifest.record(image, output, success=True, duration=1)
+    manifest.close()
+    assert not BatchManifest(tmp_path).is_up_to_date(image, output)
+
+def test_batch_rerun_only_processes_new_and_changed_images(tmp_path, make_upscaler):
+    input_dir = tmp_path / 'in'
+    for name in ('a', 'b'):
+        touch(input_dir / f'{name}.png', cv2.imencode('.png', np.full((8, 8, 3), ord(name), np.uint8))[1].tobytes())
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus')
+    calls = upscaler._models['RealESRGAN_x4plus'][0].model.calls
+    images_run = lambda: sum(shape[0] for shape in calls)
+    upscaler.batch_upscale(input_dir, tmp_path / 'out')
+    assert images_run() == 2
+    assert cv2.imread(str(tmp_path / 'out' / 'a_upscaled.png')).shape == (32, 32, 3)
+
+    touch(input_dir / 'b.png', cv2.imencode('.png', np.zeros((8, 8, 3), np.uint8))[1].tobytes())
+    touch(input_dir / 'c.png', cv2.imencode('.png', np.ones((8, 8, 3), np.uint8))[1].tobytes())
+    upscaler.batch_upscale(input_dir, tmp_path / 'out')
+    assert images_run() == 4
@@ -0,0 +1,29 @@
+import numpy as np
+
+def test_models_load_on_demand_and_evict_least_recently_used(make_upscaler):
+    # NearestNetwork has 4 bytes of weights, so the budget holds two models
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus', model_memory_budget=8)
+    img = np.zeros((8, 8, 3), np.uint8)
+    assert upscaler.upscale_array(img, model_name='RealESRGAN_x2plus').shape == (16, 16, 3)
+    upscaler.upscale_array(img)
+    assert upscaler.resident_models == ['RealESRGAN_x2plus', 'RealESRGAN_x4plus']
+    upscaler.upscale_array(img, model_name='realesr-general-x4v3')
+    assert upscaler.resident_models == ['RealESRGAN_x4plus', 'realesr-general-x4v3']
+
+def test_models_are_only_loaded_under_the_inference_lock(make_upscaler, monkeypatch, tmp_path):
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus')
+    load_model = upscaler._load_model
+    unlocked = []
+
+    def checked_load_model(model_name):
+        if not upscaler._lock.locked():
+            unlocked.append(model_name)
+        return load_model(model_name)
+
+    monkeypatch.setattr(upscaler, '_load_model', checked_load_model)
+    np.save(tmp_path / 'in.npy', np.zeros((40, 40, 3), np.uint8))
+    assert upscaler.upscale_large_image(tmp_path / 'in.npy', tmp_path / 'out.npy', block_size=16,
+                                        model_name='RealESRGAN_x2plus')
+    assert np.load(tmp_path / 'out.npy').shape == (80, 80, 3)
+    assert upscaler.engine.scale == 4
+    assert unlocked == []
@@ -0,0 +1,62 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import nearest
+from upscaler import _write_png_strips
+
+@pytest.mark.parametrize('shape, dtype', [
+    ((300, 257), np.uint8),
+    ((300, 257, 3), np.uint8),
+    ((300, 257, 4), np.uint8),
+    ((70, 33, 3), np.uint16),
+])
+def test_png_strips_round_trip(tmp_path, shape, dtype):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, np.iinfo(dtype).max, shape, dtype=dtype, endpoint=True)
+    path = tmp_path / 'strips.png'
+    _write_png_strips(path, img, strip_rows=64)
+    np.testing.assert_array_equal(cv2.imread(str(path), cv2.IMREAD_UNCHANGED), img)
+
+def test_png_strips_from_a_memmap(tmp_path):
+    img = np.lib.format.open_memmap(tmp_path / 'big.npy', mode='w+', dtype=np.uint8, shape=(513, 200, 3))
+    img[:] = np.arange(513 * 200 * 3, dtype=np.uint32).reshape(img.shape) % 251
+    path = tmp_path / 'strips.png'
+    _write_png_strips(path, img, strip_rows=100, compression=6)
+    np.testing.assert_array_equal(cv2.imread(str(path), cv2.IMREAD_UNCHANGED), img)
+
+@pytest.mark.parametrize('suffix', ['.npy', '.png'])
+def test_large_image_is_upscaled_in_blocks(tmp_path, make_upscaler, suffix):
+    img = np.random.default_rng(0).integers(0, 256, (70, 90, 3), dtype=np.uint8)
+    np.save(tmp_path / 'in.npy', img)
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus')
+    output_path = tmp_path / 'out' / f'big{suffix}'
+    assert upscaler.upscale_large_image(tmp_path / 'in.npy', output_path, block_size=32)
+    output = np.load(output_path) if suffix == '.npy' else cv2.imread(str(output_path), cv2.IMREAD_UNCHANGED)
+    np.testing.assert_array_equal(output, nearest(img))
+    assert os.listdir(tmp_path / 'out') == [output_path.name]
+
+@pytest.mark.parametrize('suffix', ['.npy', '.png'])
+def test_failed_large_image_leaves_no_partial_output(tmp_path, make_upscaler, monkeypatch, suffix):
+    np.save(tmp_path / 'in.npy', np.zeros((70, 90, 3), np.uint8))
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus')
+    upscale_array = upscaler.upscale_array
+    blocks = []
+
+    def fail_on_the_third_block(window, **kwargs):
+        blocks.append(window.shape)
+        if len(blocks) == 3:
+            raise RuntimeError('killed')
+        return upscale_array(window, **kwargs)
+
+    monkeypatch.setattr(upscaler, 'upscale_array', fail_on_the_third_block)
+    assert not upscaler.upscale_large_image(tmp_path / 'in.npy', tmp_path / 'out' / f'big{suffix}', block_size=32)
+    assert os.listdir(tmp_path / 'out') == []
+
+def test_large_image_rejects_formats_that_need_the_whole_image(tmp_path, make_upscaler):
+    np.save(tmp_path / 'in.npy', np.zeros((8, 8, 3), np.uint8))
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus')
+    assert not upscaler.upscale_large_image(tmp_path / 'in.npy', tmp_path / 'big.jpg')
+    assert not (tmp_path / 'big.jpg').exists()
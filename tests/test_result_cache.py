@@ -0,0 +1,93 @@
+import os
+import threading
+
+from result_cache import ResultCache
+
+def test_key_depends_on_data_and_settings():
+    key = ResultCache.make_key(b'image', model='x4', fmt='.png')
+    assert key == ResultCache.make_key(b'image', fmt='.png', model='x4')
+    assert key != ResultCache.make_key(b'image', model='x4', fmt='.jpg')
+    assert key != ResultCache.make_key(b'other', model='x4', fmt='.png')
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResultCache(memory_bytes=10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    assert cache.get('a') == b'aaaa'
+    cache.put('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('c') == b'cccc'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['memory_entries'], stats['memory_bytes']) == (3, 1, 2, 8)
+
+def test_entries_larger_than_the_memory_tier_are_not_kept():
+    cache = ResultCache(memory_bytes=4)
+    cache.put('a', b'too large')
+    assert cache.get('a') is None
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    cache = ResultCache(memory_bytes=0, disk_dir=tmp_path)
+    cache.put('ab12', b'result')
+    assert cache.get('ab12') == b'result'
+
+    reopened = ResultCache(memory_bytes=0, disk_dir=tmp_path)
+    assert reopened.get('ab12') == b'result'
+    assert reopened.stats()['disk_entries'] == 1
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(memory_bytes=0, disk_dir=tmp_path, disk_bytes=10)
+    cache.put('aa', b'1111')
+    cache.put('bb', b'2222')
+    assert cache.get('aa') == b'1111'
+    cache.put('cc', b'3333')
+    assert cache.get('bb') is None
+    assert not (tmp_path / 'bb' / 'bb').exists()
+    assert cache.get('aa') == b'1111'
+    assert cache.stats()['disk_bytes'] == 8
+
+def test_restart_drops_temporary_files_and_enforces_the_cap(tmp_path):
+    cache = ResultCache(memory_bytes=0, disk_dir=tmp_path)
+    for key in ('aa', 'bb', 'cc'):
+        cache.put(key, b'1234')
+    # An older modification time makes 'bb' the least recently used entry
+    os.utime(tmp_path / 'bb' / 'bb', (0, 0))
+    (tmp_path / 'aa' / '.leftover').write_bytes(b'partial')
+
+    reopened = ResultCache(memory_bytes=0, disk_dir=tmp_path, disk_bytes=8)
+    assert not (tmp_path / 'aa' / '.leftover').exists()
+    assert reopened.get('bb') is None
+    assert reopened.get('aa') == b'1234' and reopened.get('cc') == b'1234'
+
+def test_missing_disk_file_is_a_miss(tmp_path):
+    cache = ResultCache(memory_bytes=0, disk_dir=tmp_path)
+    cache.put('ab', b'result')
+    (tmp_path / 'ab' / 'ab').unlink()
+    assert cache.get('ab') is None
+    assert cache.stats()['disk_entries'] == 0
+
+def test_disk_reads_do_not_hold_the_lock(tmp_path, monkeypatch):
+    cache = ResultCache(memory_bytes=0, disk_dir=tmp_path)
+    cache.put('ab', b'slow')
+    cache.put('cd', b'fast')
+    reading = threading.Event()
+    release = threading.Event()
+    read_bytes = type(tmp_path).read_bytes
+
+    def blocking_read(path):
+        if path.name == 'ab':
+            reading.set()
+            assert release.wait(10)
+        return read_bytes(path)
+
+    monkeypatch.setattr(type(tmp_path), 'read_bytes', blocking_read)
+    results = {}
+    slow = threading.Thread(target=lambda: results.update(ab=cache.get('ab')))
+    slow.start()
+    assert reading.wait(10)
+    # Another lookup and a store complete while the first read is still blocked
+    results['cd'] = cache.get('cd')
+    cache.put('ef', b'new')
+    release.set()
+    slow.join(10)
+    assert results == {'ab': b'slow', 'cd': b'fast'}
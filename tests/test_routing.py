@@ -0,0 +1,55 @@
+import sys
+
+import numpy as np
+import pytest
+
+import upscaler
+
+@pytest.fixture
+def upscaler_x4(make_upscaler):
+    return make_upscaler(model_name='RealESRGAN_x4plus')
+
+@pytest.mark.parametrize('kwargs, route', [
+    # Already large enough: resize only
+    (dict(max_edge=150), (None, (200, 100), (150, 75))),
+    # 2x is reached by the x2 model of the family on the full input
+    (dict(target_size=(400, 200)), ('RealESRGAN_x2plus', (200, 100), (400, 200))),
+    # 3x: the x4 model on an input shrunk so its output just covers the size
+    (dict(target_size=(600, 300)), ('RealESRGAN_x4plus', (150, 75), (600, 300))),
+    # Beyond the largest scale the model runs on the full input
+    (dict(max_edge=1600), ('RealESRGAN_x4plus', (200, 100), (1600, 800))),
+    # An exact size with another aspect ratio is covered on both axes
+    (dict(target_size=(300, 400)), ('RealESRGAN_x4plus', (75, 100), (300, 400))),
+])
+def test_plan_route(upscaler_x4, kwargs, route):
+    assert upscaler_x4.plan_route(100, 200, **kwargs) == route
+
+def test_plan_route_stays_within_the_model_family(upscaler_x4):
+    assert upscaler_x4.plan_route(100, 200, 'realesr-general-x4v3', target_size=(400, 200)) == \
+        ('realesr-general-x4v3', (100, 50), (400, 200))
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(target_size=(400, 200), max_edge=400),
+    dict(max_edge=0),
+    dict(max_edge=-1),
+    dict(target_size=(0, 200)),
+    dict(target_size=(400, -200)),
+])
+def test_plan_route_rejects_invalid_sizes(upscaler_x4, kwargs):
+    with pytest.raises(ValueError):
+        upscaler_x4.plan_route(100, 200, **kwargs)
+
+def test_upscale_to_reaches_the_requested_size(upscaler_x4):
+    img = np.random.default_rng(0).integers(0, 256, (100, 200, 3), dtype=np.uint8)
+    assert upscaler_x4.upscale_to(img, target_size=(600, 300)).shape == (300, 600, 3)
+    assert upscaler_x4.upscale_to(img, max_edge=120).shape == (60, 120, 3)
+
+@pytest.mark.parametrize('option', [['--max-edge', '0'], ['--max-edge', '-5'],
+                                    ['--target-size', '0x100'], ['--target-size', '100x-1']])
+def test_cli_rejects_non_positive_sizes(monkeypatch, tmp_path, option):
+    monkeypatch.setattr(sys, 'argv', ['upscaler.py', '--input', str(tmp_path / 'in.png'),
+                                      '--output', str(tmp_path / 'out.png')] + option)
+    with pytest.raises(SystemExit) as exit_info:
+        upscaler.main()
+    assert exit_info.value.code == 2
@@ -0,0 +1,98 @@
+import asyncio
+import base64
+import importlib
+import os
+import sys
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+import transport
+from conftest import nearest
+from result_cache import ResultCache
+
+@pytest.fixture
+def runpod_handler(monkeypatch, make_upscaler):
+    """runpod_handler imported with a stub runpod module, serving a nearest-neighbour x4 upscaler."""
+    runpod = types.ModuleType('runpod')
+    runpod.serverless = types.SimpleNamespace(start=lambda config: None)
+    monkeypatch.setitem(sys.modules, 'runpod', runpod)
+    monkeypatch.delitem(sys.modules, 'runpod_handler', raising=False)
+    module = importlib.import_module('runpod_handler')
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus', cache=ResultCache(), tile_batch_size=6,
+                             micro_batch_wait=0.01)
+    monkeypatch.setattr(module, '_upscaler', upscaler)
+    yield module
+    # Later imports get the real runpod module again
+    sys.modules.pop('runpod_handler', None)
+
+def png_image(height, width, seed):
+    img = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return img, base64.b64encode(cv2.imencode('.png', img)[1]).decode('utf-8')
+
+def decode(result):
+    return cv2.imdecode(np.frombuffer(base64.b64decode(result['image']), np.uint8), cv2.IMREAD_UNCHANGED)
+
+def calls(runpod_handler):
+    return runpod_handler._upscaler._models['RealESRGAN_x4plus'][0].model.calls
+
+def test_concurrent_jobs_share_forward_passes(runpod_handler, monkeypatch):
+    # A batch is sent as soon as it is full, so the long wait only matters if the jobs did not overlap
+    monkeypatch.setattr(runpod_handler._upscaler._batcher, 'max_wait', 10.0)
+    images = [png_image(40, 60, seed) for seed in range(6)]
+
+    async def run_jobs():
+        return await asyncio.gather(*(runpod_handler.async_handler({'input': {'image': data, 'format': 'png'}})
+                                      for _, data in images))
+
+    results = asyncio.run(run_jobs())
+    for (img, _), result in zip(images, results):
+        assert result['output']['format'] == 'png'
+        np.testing.assert_array_equal(decode(result['output']), nearest(img))
+    # All six jobs were in flight at once and their images ran in one batch
+    assert len(calls(runpod_handler)) == 1
+
+def test_repeated_job_is_served_from_the_cache(runpod_handler):
+    img, data = png_image(20, 30, 0)
+    job = {'input': {'image': data, 'format': 'png', 'metrics': True}}
+    first = runpod_handler.handler(job)
+    second = runpod_handler.handler(job)
+    assert second['output']['image'] == first['output']['image']
+    assert second['output']['metrics']['counters']['cache_hits'] == 1
+    assert len(calls(runpod_handler)) == 1
+
+def test_a_failed_image_does_not_fail_the_others(runpod_handler):
+    img, data = png_image(20, 30, 0)
+    result = runpod_handler.handler({'input': {'images': [
+        data,
+        'not an image',
+        {'image': data, 'format': 'webp', 'max_edge': 60},
+        {'image': data, 'model': 'unknown'},
+    ], 'format': 'png'}})
+    good, bad, resized, unknown = result['output']['images']
+    np.testing.assert_array_equal(decode(good), nearest(img))
+    assert 'error' in bad
+    assert resized['format'] == 'webp' and decode(resized).shape == (40, 60, 3)
+    assert 'Unsupported model' in unknown['error']
+
+def test_output_url_on_the_shared_volume(runpod_handler, tmp_path, monkeypatch):
+    monkeypatch.setattr(transport, 'SHARED_VOLUME_ROOTS', [os.path.realpath(tmp_path)])
+    img, data = png_image(20, 30, 0)
+    (tmp_path / 'in.png').write_bytes(base64.b64decode(data))
+
+    result = runpod_handler.handler({'input': {'image_url': str(tmp_path / 'in.png'),
+                                               'output_url': str(tmp_path / 'out' / 'in.png')}})
+    assert result['output']['format'] == 'png'
+    np.testing.assert_array_equal(cv2.imread(str(tmp_path / 'out' / 'in.png')), nearest(img))
+
+    for output_url, options in [('out/in.gif', {}), ('out/in.png', {'format': 'jpg'})]:
+        result = runpod_handler.handler({'input': dict(options, image=data, output_url=str(tmp_path / output_url))})
+        assert 'Invalid output_url' in result['error']
+    result = runpod_handler.handler({'input': {'image': data, 'output_url': '/etc/upscaled.png'}})
+    assert 'outside the shared volume' in result['error']
+
+@pytest.mark.parametrize('event', [{}, {'input': {}}, {'input': {'images': []}}, {'input': {'image': 'eA=='}}])
+def test_invalid_requests_return_an_error(runpod_handler, event):
+    assert 'error' in runpod_handler.handler(event)
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import NearestNetwork, nearest
+from upscaler import TileBatchEngine
+
+class BlurNetwork(NearestNetwork):
+    """Blurs before upscaling, so every output pixel depends on its neighbours like a real network's."""
+
+    def forward(self, batch):
+        return super().forward(torch.nn.functional.avg_pool2d(batch, 3, stride=1, padding=1,
+                                                              count_include_pad=False))
+
+def make_engine(scale=4, batch_size=4, tile_size=512, network=NearestNetwork, **kwargs):
+    return TileBatchEngine(network(scale), scale, 'cpu', tile_size=tile_size, tile_pad=32,
+                           batch_size=batch_size, dedup_tiles=False, **kwargs)
+
+def random_image(height, width, seed=0):
+    return np.random.default_rng(seed).random((height, width, 3), dtype=np.float32)
+
+def test_windows_of_a_frame_share_one_shape():
+    engine = make_engine()
+    plans = engine._plan_tiles(1080, 1920, 512)
+    assert len(plans) == 8
+    assert {(wy1 - wy0, wx1 - wx0) for _, _, _, _, wy0, wy1, wx0, wx1 in plans} == {(576, 576)}
+    covered = np.zeros((1080, 1920), dtype=int)
+    for y0, y1, x0, x1, wy0, wy1, wx0, wx1 in plans:
+        covered[y0:y1, x0:x1] += 1
+        # Every tile has tile_pad of context, except where it meets the image border
+        assert wy0 <= y0 and y1 <= wy1 and wx0 <= x0 and x1 <= wx1
+        assert y0 == 0 or y0 - wy0 >= 32
+        assert y1 == 1080 or wy1 - y1 >= 32
+        assert x0 == 0 or x0 - wx0 >= 32
+        assert x1 == 1920 or wx1 - x1 >= 32
+    assert (covered == 1).all()
+
+def test_tiles_of_an_image_share_a_forward_pass():
+    engine = make_engine()
+    img = random_image(600, 700)
+    output, = engine.infer([img], tile_size=512)
+    assert engine.model.calls == [(4, 3, 576, 576)]
+    np.testing.assert_array_equal(output, nearest(img, 4))
+
+def test_small_images_of_different_sizes_run_apart_by_default():
+    engine = make_engine(batch_size=8)
+    imgs = [random_image(48, 64, seed) for seed in range(2)] + [random_image(44, 60, seed) for seed in range(2)]
+    engine.infer(imgs, tile_size=0)
+    assert sorted(engine.model.calls) == [(2, 3, 44, 60), (2, 3, 48, 64)]
+
+def test_output_does_not_depend_on_the_batch_by_default():
+    img = random_image(44, 60)
+    alone, = make_engine(network=BlurNetwork).infer([img], tile_size=0)
+    batched = make_engine(network=BlurNetwork).infer([img, random_image(48, 64, 1)], tile_size=0)[0]
+    np.testing.assert_array_equal(batched, alone)
+    # Padded batching changes what the network sees next to the right and bottom edges
+    padded = make_engine(network=BlurNetwork, pad_batches=True).infer([img, random_image(48, 64, 1)],
+                                                                      tile_size=0)[0]
+    assert not np.array_equal(padded, alone)
+    np.testing.assert_array_equal(padded[:-4, :-4], alone[:-4, :-4])
+
+def test_small_images_of_two_sizes_share_forward_passes():
+    engine = make_engine(pad_batches=True)
+    imgs = [random_image(48, 64, seed) for seed in range(2)] + [random_image(44, 60, seed) for seed in range(2)]
+    outputs = engine.infer(imgs, tile_size=0)
+    assert engine.model.calls == [(4, 3, 48, 64)]
+    for img, output in zip(imgs, outputs):
+        np.testing.assert_array_equal(output, nearest(img, 4))
+
+def test_very_different_sizes_are_not_padded_together():
+    engine = make_engine(pad_batches=True)
+    engine.infer([random_image(16, 16), random_image(256, 256)], tile_size=0)
+    assert sorted(engine.model.calls) == [(1, 3, 16, 16), (1, 3, 256, 256)]
+
+@pytest.mark.parametrize('scale', [2, 4])
+def test_padded_windows_crop_to_the_image(scale):
+    # x2 networks pixel-unshuffle their input, so windows also keep a multiple of 2
+    engine = make_engine(scale=scale, batch_size=8, pad_batches=True)
+    imgs = [random_image(30, 50, 1), random_image(37, 41, 2), random_image(44, 36, 3)]
+    outputs = engine.infer(imgs, tile_size=0)
+    assert len(engine.model.calls) == 1
+    for img, output in zip(imgs, outputs):
+        np.testing.assert_array_equal(output, nearest(img, scale))
+
+def test_micro_batcher_runs_concurrent_thumbnails_of_two_sizes_together(make_upscaler):
+    upscaler = make_upscaler(model_name='RealESRGAN_x4plus', tile_batch_size=4, micro_batch_size=8,
+                             micro_batch_wait=1.0, dedup_tiles=False, pad_batches=True)
+    rng = np.random.default_rng(0)
+    imgs = [rng.integers(0, 256, shape, dtype=np.uint8) for shape in [(48, 64, 3)] * 2 + [(44, 60, 3)] * 2]
+    futures = [upscaler._batcher.submit(img) for img in imgs]
+    outputs = [future.result(timeout=30) for future in futures]
+    assert upscaler._models['RealESRGAN_x4plus'][0].model.calls == [(4, 3, 48, 64)]
+    for img, output in zip(imgs, outputs):
+        np.testing.assert_array_equal(output, nearest(img, 4))
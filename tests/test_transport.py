@@ -0,0 +1,139 @@
+import http.server
+import os
+import threading
+
+import pytest
+
+import fake_storage
+import transport
+
+@pytest.fixture
+def volume(tmp_path, monkeypatch):
+    root = tmp_path / 'volume'
+    root.mkdir()
+    monkeypatch.setattr(transport, 'SHARED_VOLUME_ROOTS', [os.path.realpath(root)])
+    return root
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(transport, 'ALLOWED_URL_HOSTS', ['127.0.0.1'])
+    server = fake_storage.serve(str(tmp_path / 'storage'), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', tmp_path / 'storage'
+    server.shutdown()
+    server.server_close()
+
+def test_volume_paths_inside_the_root_resolve(volume):
+    assert transport._volume_path(str(volume / 'in' / 'a.png')) == os.path.realpath(volume / 'in' / 'a.png')
+    assert transport._volume_path(f'file://{volume}/in/a%20b.png') == os.path.realpath(volume / 'in' / 'a b.png')
+    assert transport._volume_path(str(volume / 'in' / '..' / 'a.png')) == os.path.realpath(volume / 'a.png')
+
+@pytest.mark.parametrize('reference', [
+    '{volume}/../outside.png',
+    '{volume}/in/../../outside.png',
+    '{volume}-sibling/a.png',
+    'file://{volume}/%2e%2e/outside.png',
+    '/etc/passwd',
+    'relative/a.png',
+])
+def test_volume_paths_outside_the_root_are_refused(volume, reference):
+    with pytest.raises(ValueError, match='outside the shared volume'):
+        transport._volume_path(reference.format(volume=volume))
+
+def test_symlinks_out_of_the_volume_are_refused(volume, tmp_path):
+    (tmp_path / 'secret').mkdir()
+    os.symlink(tmp_path / 'secret', volume / 'link')
+    with pytest.raises(ValueError, match='outside the shared volume'):
+        transport._volume_path(str(volume / 'link' / 'a.png'))
+
+def test_check_reference_refuses_unsupported_references(volume, monkeypatch):
+    monkeypatch.setattr(transport, 'ALLOWED_URL_HOSTS', ['example.com'])
+    transport.check_reference('https://example.com/a.png')
+    transport.check_reference('s3://bucket/key.png')
+    for reference in ('ftp://example.com/a.png', 's3://bucket', '/etc/passwd'):
+        with pytest.raises(ValueError):
+            transport.check_reference(reference)
+
+def test_volume_round_trip(volume, monkeypatch):
+    monkeypatch.setattr(transport, 'CHUNK_SIZE', 7)
+    data = bytes(range(256)) * 3
+    path = transport.write_reference(str(volume / 'out' / 'a.png'), data)
+    assert path == os.path.realpath(volume / 'out' / 'a.png')
+    assert bytes(transport.read_reference(path)) == data
+    assert os.listdir(volume / 'out') == ['a.png']
+    with pytest.raises(ValueError, match='larger than'):
+        transport.read_reference(path, max_bytes=100)
+
+def test_failed_volume_write_keeps_its_error(volume, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise PermissionError('refused')
+
+    monkeypatch.setattr(transport, 'open', refuse, raising=False)
+    with pytest.raises(PermissionError, match='refused'):
+        transport.write_reference(str(volume / 'a.png'), b'data')
+    assert os.listdir(volume) == []
+
+def test_http_round_trip(storage):
+    url, root = storage
+    data = os.urandom(3 * transport.CHUNK_SIZE // 2)
+    location = transport.write_reference(f'{url}/out/a.png?X-Amz-Signature=abc', data, 'image/png')
+    assert location == f'{url}/out/a.png'
+    assert (root / 'out' / 'a.png').read_bytes() == data
+    assert bytes(transport.read_reference(location)) == data
+    with pytest.raises(ValueError, match='larger than'):
+        transport.read_reference(location, max_bytes=len(data) - 1)
+
+@pytest.mark.parametrize('reference', [
+    'http://169.254.169.254/latest/meta-data/',
+    'http://localhost:9000/a.png',
+    'https://example.com.attacker.net/a.png',
+    'https://user@internal/a.png',
+    'http:///a.png',
+])
+def test_urls_to_hosts_that_are_not_allowed_are_refused(monkeypatch, reference):
+    monkeypatch.setattr(transport, 'ALLOWED_URL_HOSTS', ['example.com', '*.s3.amazonaws.com'])
+    with pytest.raises(ValueError, match='not allowed'):
+        transport.check_reference(reference)
+    with pytest.raises(ValueError, match='not allowed'):
+        transport.read_reference(reference)
+    with pytest.raises(ValueError, match='not allowed'):
+        transport.write_reference(reference, b'data')
+    transport.check_reference('https://bucket.s3.amazonaws.com/a.png')
+    transport.check_reference('HTTPS://EXAMPLE.COM:8443/a.png')
+
+def test_redirects_are_not_followed(storage):
+    url, root = storage
+    transport.write_reference(f'{url}/a.png', b'data')
+
+    class Redirect(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(302)
+            self.send_header('Location', f'{url}/a.png')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        do_PUT = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), Redirect)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        redirecting = f'http://127.0.0.1:{server.server_address[1]}/a.png'
+        with pytest.raises(ValueError, match='redirected'):
+            transport.read_reference(redirecting)
+        with pytest.raises(ValueError, match='redirected'):
+            transport.write_reference(redirecting, b'data')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_uploads_read_the_content_through_a_view():
+    data = bytearray(os.urandom(1000))
+    reader = transport._ViewReader(memoryview(data))
+    assert reader.seek(0, 2) == 1000 and reader.seek(0) == 0
+    assert reader.read(600) == data[:600]
+    assert reader.read() == data[600:]
+    assert reader.read(1) == b''
@@ -0,0 +1,235 @@
+import io
+import os
+import fnmatch
+import logging
+import uuid
+import threading
+from pathlib import Path
+from urllib.parse import unquote, urlparse, urlunparse
+from typing import Union
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Inputs and outputs can be passed by reference instead of inline base64:
+# - a path on a shared volume, plain or as file://, below one of SHARED_VOLUME_ROOTS
+# - an http(s):// URL on one of ALLOWED_URL_HOSTS, read with GET and written
+#   with PUT (e.g. presigned URLs)
+# - an s3://bucket/key URL, read and written with boto3; S3_ENDPOINT_URL
+#   points it at an S3-compatible store
+SHARED_VOLUME_ROOTS = [os.path.realpath(root) for root in
+                       os.getenv('SHARED_VOLUME_ROOTS', '/runpod-volume').split(os.pathsep) if root]
+# Hosts (fnmatch patterns, separated by commas) that http(s) references may point
+# to; none by default, so requests cannot reach internal or metadata endpoints
+ALLOWED_URL_HOSTS = [host.strip().lower() for host in os.getenv('ALLOWED_URL_HOSTS', '').split(',')
+                     if host.strip()]
+MAX_INPUT_BYTES = int(os.getenv('MAX_INPUT_MB', '256')) * 1024**2
+CHUNK_SIZE = 1024**2
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+
+_s3 = None
+_s3_lock = threading.Lock()
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+class _ViewReader(io.RawIOBase):
+    """Seekable file over a bytes-like object, read without copying it as a whole."""
+
+    def __init__(self, data: BytesLike):
+        self._view = memoryview(data).cast('B')
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:count] = self._view[self._pos:self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+def _s3_client():
+    """Return the shared boto3 S3 client, creating it on first use."""
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ValueError("s3:// references need boto3 (pip install boto3)")
+            _s3 = boto3.client('s3', endpoint_url=os.getenv('S3_ENDPOINT_URL') or None)
+        return _s3
+
+def _s3_location(reference: str):
+    """Split an s3://bucket/key reference."""
+    parsed = urlparse(reference)
+    key = parsed.path.lstrip('/')
+    if not parsed.netloc or not key:
+        raise ValueError(f"Expected s3://bucket/key, got {reference}")
+    return parsed.netloc, key
+
+def _volume_path(reference: str) -> str:
+    """Resolve a path reference, refusing anything outside SHARED_VOLUME_ROOTS."""
+    path = unquote(urlparse(reference).path) if reference.startswith('file://') else reference
+    resolved = os.path.realpath(path)
+    if not any(resolved == root or resolved.startswith(root + os.sep) for root in SHARED_VOLUME_ROOTS):
+        raise ValueError(f"{path} is outside the shared volume ({', '.join(SHARED_VOLUME_ROOTS)})")
+    return resolved
+
+def _check_host(reference: str):
+    """Refuse http(s) references to hosts that are not in ALLOWED_URL_HOSTS."""
+    host = (urlparse(reference).hostname or '').lower()
+    if not host or not any(fnmatch.fnmatchcase(host, pattern) for pattern in ALLOWED_URL_HOSTS):
+        raise ValueError(f"Host {host or '(none)'} is not allowed. Add it to ALLOWED_URL_HOSTS to use it")
+
+def _scheme(reference: str) -> str:
+    scheme = urlparse(reference).scheme.lower()
+    if scheme in ('', 'file'):
+        return 'file'
+    if scheme in ('http', 'https'):
+        _check_host(reference)
+        return scheme
+    if scheme == 's3':
+        return scheme
+    raise ValueError(f"Unsupported reference: {reference}. Use a shared volume path, http(s):// or s3://")
+
+def check_reference(reference: str):
+    """
+    Check that a reference can be used, without accessing it.
+
+    Raises:
+        ValueError: If the scheme is not supported, a path is outside the shared volume
+            or a URL's host is not in ALLOWED_URL_HOSTS
+    """
+    scheme = _scheme(reference)
+    if scheme == 'file':
+        _volume_path(reference)
+    elif scheme == 's3':
+        _s3_location(reference)
+
+def _check_response(response: requests.Response, reference: str):
+    """Raise for error statuses and for redirects, which are not followed."""
+    if response.is_redirect:
+        raise ValueError(f"{urlparse(reference).hostname} redirected the request, which is not followed")
+    response.raise_for_status()
+
+def read_reference(reference: str, max_bytes: int = MAX_INPUT_BYTES) -> BytesLike:
+    """
+    Read the content a reference points to.
+
+    The content is received a chunk at a time into one buffer, so oversized
+    inputs are refused before they are fully downloaded. It is not streamed
+    any further: the whole content is held in memory, where the image is
+    decoded from, and max_bytes bounds how much that is. Redirects are not
+    followed, so an allowed host cannot point the request elsewhere.
+
+    Args:
+        reference: Shared volume path, http(s):// URL or s3://bucket/key
+        max_bytes: Largest content accepted
+
+    Returns:
+        The content, as a bytes-like object
+
+    Raises:
+        ValueError: If the reference is not supported, the content exceeds max_bytes
+            or an http(s) URL redirects
+    """
+    scheme = _scheme(reference)
+    too_large = ValueError(f"Input is larger than {max_bytes / 1024**2:g}MB: {reference}")
+    if scheme == 'file':
+        with open(_volume_path(reference), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > max_bytes:
+                raise too_large
+            buffer = bytearray(size)
+            view = memoryview(buffer)
+            read = 0
+            while read < size:
+                count = f.readinto(view[read:read + CHUNK_SIZE])
+                if not count:
+                    break
+                read += count
+            return view[:read]
+
+    if scheme == 's3':
+        client = _s3_client()
+        bucket, key = _s3_location(reference)
+        if client.head_object(Bucket=bucket, Key=key)['ContentLength'] > max_bytes:
+            raise too_large
+        buffer = io.BytesIO()
+        # Downloads in parts, several at once for large objects
+        client.download_fileobj(bucket, key, buffer)
+        return buffer.getbuffer()
+
+    with requests.get(reference, stream=True, timeout=(10, 60), allow_redirects=False) as response:
+        _check_response(response, reference)
+        if int(response.headers.get('Content-Length') or 0) > max_bytes:
+            raise too_large
+        buffer = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            buffer += chunk
+            if len(buffer) > max_bytes:
+                raise too_large
+        return buffer
+
+def write_reference(reference: str, data: BytesLike, content_type: str = 'application/octet-stream') -> str:
+    """
+    Write content to a reference target.
+
+    Shared volume files are written in chunks to a temporary file that then
+    replaces the target, so readers never see a partial file. http(s)
+    targets receive a PUT with a Content-Length (as presigned URLs require)
+    and s3:// targets are uploaded in parts by boto3. Both read the content
+    through a view, a block or part at a time, so it is not copied as a
+    whole; the content itself is already in memory, as the encoder made it.
+
+    Args:
+        reference: Shared volume path, http(s):// URL or s3://bucket/key
+        data: Content to write
+        content_type: MIME type sent along with http(s) and s3 uploads
+
+    Returns:
+        str: Where the content now is; for http(s) the URL without its query
+            string, so signatures are not passed on
+    """
+    scheme = _scheme(reference)
+    if scheme == 'file':
+        path = _volume_path(reference)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A unique name opened exclusively, so the file gets the usual umask permissions
+        tmp_path = os.path.join(os.path.dirname(path), f'.upload-{uuid.uuid4().hex}')
+        try:
+            with open(tmp_path, 'xb') as f:
+                view = memoryview(data)
+                for start in range(0, len(view), CHUNK_SIZE):
+                    f.write(view[start:start + CHUNK_SIZE])
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        logger.debug(f"Wrote {len(data)} bytes to {path}")
+        return path
+
+    if scheme == 's3':
+        bucket, key = _s3_location(reference)
+        _s3_client().upload_fileobj(_ViewReader(data), bucket, key, ExtraArgs={'ContentType': content_type})
+        logger.debug(f"Uploaded {len(data)} bytes to {reference}")
+        return reference
+
+    response = requests.put(reference, data=_ViewReader(data), headers={'Content-Type': content_type},
+                            timeout=(10, 300), allow_redirects=False)
+    _check_response(response, reference)
+    location = urlunparse(urlparse(reference)._replace(query='', fragment=''))
+    logger.debug(f"Uploaded {len(data)} bytes to {location}")
+    return location
@@ -1,15 +1,35 @@
 #!/usr/bin/env python3
 import os
+import sys
+import json
+import math
+import time
 import logging
 import argparse
+import fnmatch
+import heapq
+import threading
+import multiprocessing as mp
+import queue
+import struct
+import subprocess
+import tempfile
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Union, List
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple, Union, List
+import cv2
+import numpy as np
 import torch
 import gc
-from basicsr.archs.rrdbnet_arch import RRDBNet
-from realesrgan import RealESRGANer
-from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+import hashlib
+import io
 from tqdm import tqdm
+from archs import RRDBNet, SRVGGNetCompact
+from result_cache import ResultCache
+from metrics import Metrics, NULL_METRICS, REGISTRY
 
 # Set up logging
 logging.basicConfig(
@@ -18,20 +38,1332 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_RELEASES = 'https://github.com/xinntao/Real-ESRGAN/releases/download'
+
+# Supported models: how to build each network, its native scale, where its
+# weights are published, roughly how many activation elements per input
+# pixel its forward pass needs (used to size tiles) and its family (models
+# of one family at different scales can stand in for each other when
+# upscaling to a target size)
+MODEL_REGISTRY = {
+    'RealESRGAN_x4plus': {
+        'build': lambda: RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4),
+        'scale': 4,
+        'url': f'{_RELEASES}/v0.1.0/RealESRGAN_x4plus.pth',
+        'activation_elements': 4096,
+        'family': 'RealESRGAN',
+    },
+    'RealESRGAN_x2plus': {
+        'build': lambda: RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2),
+        'scale': 2,
+        'url': f'{_RELEASES}/v0.2.1/RealESRGAN_x2plus.pth',
+        'activation_elements': 2048,
+        'family': 'RealESRGAN',
+    },
+    'RealESRGAN_x4plus_anime_6B': {
+        'build': lambda: RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=6, num_grow_ch=32, scale=4),
+        'scale': 4,
+        'url': f'{_RELEASES}/v0.2.2.4/RealESRGAN_x4plus_anime_6B.pth',
+        'activation_elements': 4096,
+        'family': 'RealESRGAN_anime_6B',
+    },
+    'realesr-general-x4v3': {
+        'build': lambda: SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4,
+                                         act_type='prelu'),
+        'scale': 4,
+        'url': f'{_RELEASES}/v0.2.5.0/realesr-general-x4v3.pth',
+        'activation_elements': 1024,
+        'family': 'realesr-general',
+    },
+}
+
+def _model_path(model_name: str, default_model: str) -> str:
+    """
+    Locate the weights of a model.
+    
+    MODEL_PATH overrides the default model's weights. Otherwise
+    MODEL_DIR/<name>.pth is used when present, and the release URL (which
+    is downloaded into MODEL_DIR on first use) when not.
+    """
+    if model_name == default_model and os.getenv('MODEL_PATH'):
+        model_path = os.getenv('MODEL_PATH')
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found at {model_path}")
+        return model_path
+    local_path = os.path.join(os.getenv('MODEL_DIR', '/workspace/models'), f"{model_name}.pth")
+    if os.path.exists(local_path):
+        return local_path
+    return MODEL_REGISTRY[model_name]['url']
+
+def _is_url(path: str) -> bool:
+    return path.startswith(('http://', 'https://'))
+
+def _download_weights(url: str, model_name: str) -> str:
+    """Download a model's published weights into MODEL_DIR and return the local path."""
+    model_dir = os.getenv('MODEL_DIR', '/workspace/models')
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, f"{model_name}.pth")
+    logger.info(f"Downloading {url} to {path}")
+    torch.hub.download_url_to_file(url, path, progress=True)
+    return path
+
+def _derived_path(weights_path: str, model_name: str, suffix: str) -> str:
+    """Location of a file derived from a checkpoint (prepacked weights, ONNX export)."""
+    if _is_url(weights_path):
+        # Where the checkpoint itself would be downloaded to
+        return os.path.join(os.getenv('MODEL_DIR', '/workspace/models'), f"{model_name}{suffix}")
+    return os.path.splitext(weights_path)[0] + suffix
+
+def _is_fresh(path: str, weights_path: str) -> bool:
+    """Whether a derived file exists and is at least as new as its checkpoint."""
+    return os.path.exists(path) and (_is_url(weights_path)
+                                     or os.path.getmtime(path) >= os.path.getmtime(weights_path))
+
+def _prepacked_path(weights_path: str, model_name: str) -> str:
+    """Location of the prepacked weights belonging to a checkpoint (see prepack_weights)."""
+    return _derived_path(weights_path, model_name, '.prepacked.pt')
+
+def _read_checkpoint(path: str) -> Dict[str, torch.Tensor]:
+    """Load a published checkpoint on the CPU, preferring its EMA weights like RealESRGANer."""
+    checkpoint = torch.load(path, map_location='cpu')
+    for key in ('params_ema', 'params'):
+        if key in checkpoint:
+            return checkpoint[key]
+    return checkpoint
+
+def _read_prepacked(path: str) -> Dict[str, torch.Tensor]:
+    """Memory-map a prepacked state dict, so its tensors are paged in rather than copied."""
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        # torch < 2.1 cannot memory-map checkpoints
+        return torch.load(path, map_location='cpu')
+
+def _load_state_dict(model_name: str, weights_path: str) -> Tuple[Dict[str, torch.Tensor], str]:
+    """
+    Load the weights of a model, from its prepacked file when one is up to date.
+    
+    Returns:
+        Tuple[Dict[str, torch.Tensor], str]: The state dict and the file it was read from
+    """
+    prepacked = _prepacked_path(weights_path, model_name)
+    if _is_fresh(prepacked, weights_path):
+        return _read_prepacked(prepacked), prepacked
+    if _is_url(weights_path):
+        weights_path = _download_weights(weights_path, model_name)
+    return _read_checkpoint(weights_path), weights_path
+
+def _build_network(model_name: str, state_dict: Dict[str, torch.Tensor]) -> torch.nn.Module:
+    """
+    Instantiate a registry model holding the given weights.
+    
+    The network is built on the meta device and the weights are assigned to
+    it, which skips the random initialisation of every layer and, for
+    memory-mapped weights, the copy into freshly allocated parameters.
+    """
+    build = MODEL_REGISTRY[model_name]['build']
+    try:
+        with torch.device('meta'):
+            model = build()
+        model.load_state_dict(state_dict, strict=True, assign=True)
+    except (AttributeError, TypeError):
+        # torch < 2.1: no meta-device context or assign, initialise normally and copy
+        model = build()
+        model.load_state_dict(state_dict, strict=True)
+    return model.eval()
+
+def prepack_weights(model_name: str, default_model: str = 'RealESRGAN_x4plus') -> str:
+    """
+    Write a model's weights in the form that loads fastest.
+    
+    The prepacked file holds only the network's state dict, validated against
+    the architecture and saved in torch's zip format, next to the checkpoint
+    it was made from. ImageUpscaler memory-maps it instead of unpickling the
+    published checkpoint whenever it is newer than that checkpoint.
+    
+    Args:
+        model_name: Name of the model (a key of MODEL_REGISTRY)
+        default_model: Model whose weights MODEL_PATH overrides
+        
+    Returns:
+        str: Path of the prepacked file
+    """
+    if model_name not in MODEL_REGISTRY:
+        raise ValueError(f"Unsupported model: {model_name}. Available: {', '.join(MODEL_REGISTRY)}")
+    weights_path = _model_path(model_name, default_model)
+    if _is_url(weights_path):
+        weights_path = _download_weights(weights_path, model_name)
+    state_dict = _read_checkpoint(weights_path)
+    _build_network(model_name, state_dict)
+    path = _prepacked_path(weights_path, model_name)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.prepack-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            torch.save({key: tensor.contiguous() for key, tensor in state_dict.items()}, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    logger.info(f"Prepacked {model_name} weights to {path}")
+    return path
+
+# Peak activation size of an RRDBNet x4 forward pass per input pixel, in tensor
+# elements. Measured on CPU at ~3.7-4k (the 4x upsampling convolutions dominate);
+# CUDA needs less, so this errs on the safe side there. Used when a model does
+# not declare its own figure.
+_ACTIVATION_ELEMENTS_PER_PIXEL = 4096
+# Share of the currently free memory a single inference may plan to use
+_MEMORY_SAFETY_FRACTION = 0.7
+# Smallest tile tried before giving up on an out-of-memory error
+_MIN_TILE_SIZE = 32
+
+def _system_available_memory() -> int:
+    """Bytes of RAM available to new allocations, from /proc/meminfo when present."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+def _current_rss() -> int:
+    """Resident set size of this process in bytes, from /proc/self/statm when present."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def _is_out_of_memory(error: BaseException) -> bool:
+    """Whether an exception raised during inference means the device ran out of memory."""
+    if isinstance(error, MemoryError):
+        return True
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and ('out of memory' in message or "can't allocate memory" in message)
+
+_PRECISIONS = {'fp16': torch.float16, 'bf16': torch.bfloat16, 'fp32': torch.float32}
+
+def _cpu_flags() -> set:
+    """Instruction set flags of the CPU, from /proc/cpuinfo when present."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return set(line.split(':', 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+def _default_precision(device: str) -> str:
+    """
+    Inference precision used when none is requested.
+    
+    fp16 on GPUs. On CPUs fp16 convolutions have no fast kernels (they run
+    slower than fp32), so bf16 is used where the CPU has native bf16 matrix
+    instructions (AVX512-BF16 or AMX) and fp32 everywhere else.
+    """
+    if device.startswith('cuda'):
+        return 'fp16'
+    if torch.backends.mkldnn.is_available() and _cpu_flags() & {'avx512_bf16', 'amx_bf16'}:
+        return 'bf16'
+    return 'fp32'
+
+def _cpu_thread_count() -> int:
+    """
+    Number of CPUs this process can actually use.
+    
+    torch defaults to the machine's core count, which oversubscribes
+    containers limited by affinity or a cgroup CPU quota.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+    try:
+        # cgroup v2; "max" means no quota
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+class _OnnxModel:
+    """
+    A network exported to ONNX and run by ONNX Runtime on the CPU.
+    
+    Called like the torch network: takes an NCHW float tensor and returns the
+    upscaled NCHW float32 tensor.
+    """
+
+    def __init__(self, path: str, threads: int):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend needs onnxruntime: pip install onnxruntime")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.nbytes = os.path.getsize(path)
+
+    @staticmethod
+    def export(model: torch.nn.Module, path: str):
+        """Export a network with dynamic batch and image size, atomically."""
+        logger.info(f"Exporting model to {path}")
+        model = model.float().cpu()
+        dummy = torch.zeros((1, 3, 64, 64))
+        axes = {0: 'batch', 2: 'height', 3: 'width'}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.export-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                kwargs = dict(input_names=['input'], output_names=['output'], opset_version=17,
+                              dynamic_axes={'input': axes, 'output': axes})
+                try:
+                    torch.onnx.export(model, (dummy,), f, dynamo=False, **kwargs)
+                except TypeError:
+                    # torch < 2.5 only has the TorchScript exporter
+                    torch.onnx.export(model, (dummy,), f, **kwargs)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        output, = self.session.run(None, {'input': batch.float().contiguous().numpy()})
+        return torch.from_numpy(output)
+
+def _read_image(path: Path) -> np.ndarray:
+    """Decode an image file, raising if OpenCV cannot read it."""
+    img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"Could not read image: {path}")
+    return img
+
+# Encoder of each supported output extension
+_ENCODERS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp'}
+# Outputs upscale_large_image can write without holding the image in memory
+_OUT_OF_CORE_FORMATS = ('.png', '.npy')
+
+def _encode_webp_pillow(img: np.ndarray, quality: int, lossless: bool) -> Optional[bytes]:
+    """Encode an 8-bit image as WebP with Pillow's fastest method, or None without Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    if img.ndim == 2:
+        image = Image.fromarray(img)
+    elif img.shape[2] == 4:
+        image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA))
+    else:
+        image = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    buffer = io.BytesIO()
+    # For lossless WebP, quality is the compression effort
+    image.save(buffer, 'WEBP', quality=0 if lossless else quality, lossless=lossless, method=0)
+    return buffer.getvalue()
+
+class OutputFormat:
+    """
+    How upscaled images are encoded.
+    
+    JPEG and PNG are encoded by OpenCV (libjpeg-turbo and zlib). PNG left at
+    the default compression uses OpenCV's fastest setting, level 1 with
+    run-length matching, which is several times faster than higher levels
+    on 4x outputs. WebP is encoded by Pillow at its fastest method when it
+    is installed, about 3x faster than OpenCV's encoder, and by OpenCV
+    otherwise.
+    
+    Args:
+        ext: Output extension ('.jpg', '.jpeg', '.png' or '.webp'). None keeps the
+            extension of each output path.
+        quality: JPEG or lossy WebP quality, 1-100 (default: 95 for JPEG, 90 for WebP)
+        png_compression: PNG zlib level, 0-9 (default: OpenCV's fastest setting)
+        progressive: Write progressive JPEG (smaller, but slower to encode)
+        lossless: Write lossless WebP
+    """
+
+    def __init__(self, ext: Optional[str] = None, quality: Optional[int] = None,
+                 png_compression: Optional[int] = None, progressive: bool = False, lossless: bool = False):
+        if ext is not None:
+            ext = ext.lower() if ext.startswith('.') else f'.{ext.lower()}'
+            if ext not in _ENCODERS:
+                raise ValueError(f"Unsupported output format: {ext}. Available: {', '.join(_ENCODERS)}")
+        quality = None if quality is None else int(quality)
+        png_compression = None if png_compression is None else int(png_compression)
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError(f"Quality must be between 1 and 100, got {quality}")
+        if png_compression is not None and not 0 <= png_compression <= 9:
+            raise ValueError(f"PNG compression must be between 0 and 9, got {png_compression}")
+        self.ext = ext
+        self.quality = quality
+        self.png_compression = png_compression
+        self.progressive = progressive
+        self.lossless = lossless
+
+    def for_path(self, path: Union[str, Path]) -> 'OutputFormat':
+        """These settings with the extension of `path` (or of this format, or PNG, if it has none)."""
+        return OutputFormat(Path(path).suffix or self.ext or '.png', self.quality, self.png_compression,
+                            self.progressive, self.lossless)
+
+    def settings(self) -> Dict[str, object]:
+        """Every setting that affects the encoded bytes."""
+        return {'ext': _ENCODERS.get(self.ext, self.ext), 'quality': self.quality,
+                'png_compression': self.png_compression, 'progressive': self.progressive,
+                'lossless': self.lossless}
+
+    def cv2_params(self) -> List[int]:
+        """Parameters of cv2.imencode and cv2.imwrite for these settings."""
+        encoder = _ENCODERS[self.ext]
+        if encoder == 'jpeg':
+            return [cv2.IMWRITE_JPEG_QUALITY, self.quality or 95,
+                    cv2.IMWRITE_JPEG_PROGRESSIVE, int(self.progressive)]
+        if encoder == 'webp':
+            # Qualities above 100 select lossless WebP
+            return [cv2.IMWRITE_WEBP_QUALITY, 101 if self.lossless else self.quality or 90]
+        if self.png_compression is not None:
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        return []
+
+    def encode(self, img: np.ndarray) -> bytes:
+        """
+        Encode a cv2-layout image.
+        
+        Args:
+            img: Image array (BGR/BGRA or grayscale, 8 or 16 bit)
+            
+        Returns:
+            bytes: The encoded image
+        """
+        if self.ext is None:
+            raise ValueError("No output format given")
+        if _ENCODERS[self.ext] == 'webp' and img.dtype == np.uint8:
+            data = _encode_webp_pillow(img, self.quality or 90, self.lossless)
+            if data is not None:
+                return data
+        success, buffer = cv2.imencode(self.ext, img, self.cv2_params())
+        if not success:
+            raise ValueError(f"Could not encode output image as {self.ext}")
+        return buffer.tobytes()
+
+def _write_image(path: Path, img: np.ndarray, output_format: Optional[OutputFormat] = None) -> int:
+    """Encode and write an image in the format of its extension and return its size in bytes."""
+    data = (output_format or OutputFormat()).for_path(path).encode(img)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+def _matches(relative: str, patterns: Optional[List[str]]) -> bool:
+    """Whether a POSIX path relative to the input directory matches any of the fnmatch patterns."""
+    return bool(patterns) and any(fnmatch.fnmatch(relative, pattern) for pattern in patterns)
+
+def _scan_images(input_dir: Path, extensions: List[str], recursive: bool = False,
+                 include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                 skip_dirs: Iterable[Path] = ()) -> Iterator[Path]:
+    """
+    Yield the images in a directory as they are found.
+    
+    The tree is walked with os.scandir, depth first and in name order, so
+    the first images are yielded long before a large tree is fully listed.
+    Extensions match case-insensitively and a file reached twice (through
+    hard or symbolic links) is yielded once. Symlinked directories and
+    `skip_dirs` are not entered.
+    
+    Args:
+        input_dir: Directory to scan
+        extensions: File extensions of the images, e.g. ['.jpg', '.png']
+        recursive: Also scan subdirectories
+        include: fnmatch patterns, matched against the path relative to input_dir in
+            POSIX form (e.g. 'shoots/*.png'); if given, only matching images are yielded
+        exclude: fnmatch patterns of images to leave out; directories matching one are not entered
+        skip_dirs: Directories never entered, such as an output directory inside input_dir
+    """
+    extensions = {ext.lower() for ext in extensions}
+    skip = {os.path.realpath(path) for path in skip_dirs}
+    seen = set()
+    stack = [str(input_dir)]
+    while stack:
+        directory = stack.pop()
+        try:
+            device = os.stat(directory).st_dev
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.warning(f"Cannot list {directory}: {str(e)}")
+            continue
+        prefix = os.path.relpath(directory, input_dir).replace(os.sep, '/') + '/'
+        prefix = '' if prefix == './' else prefix
+        subdirs = []
+        for entry in entries:
+            # File types and inode numbers come with the directory listing, so
+            # only symbolic links cost a stat call
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if (recursive and not _matches(prefix + entry.name, exclude)
+                            and os.path.realpath(entry.path) not in skip):
+                        subdirs.append(entry.path)
+                    continue
+                if os.path.splitext(entry.name)[1].lower() not in extensions or not entry.is_file():
+                    continue
+                relative = prefix + entry.name
+                if _matches(relative, exclude) or (include and not _matches(relative, include)):
+                    continue
+                if entry.is_symlink():
+                    stat = entry.stat()
+                    identity = (stat.st_dev, stat.st_ino)
+                else:
+                    identity = (device, entry.inode())
+            except OSError:
+                continue
+            if not identity[1]:
+                # No inode numbers on this platform
+                identity = os.path.normcase(os.path.realpath(entry.path))
+            if identity in seen:
+                continue
+            seen.add(identity)
+            yield Path(entry.path)
+        stack.extend(reversed(subdirs))
+
+def _pixel_count(path: Path) -> int:
+    """
+    Pixels of an image, read from its header without decoding it.
+    
+    Falls back to the file size in bytes when the header cannot be read
+    (or Pillow is not installed), which still ranks images roughly by size.
+    """
+    try:
+        from PIL import Image
+        try:
+            with Image.open(path) as img:
+                return img.width * img.height
+        except Image.DecompressionBombError:
+            # Pillow refuses to open images this large, which makes them the largest
+            return sys.maxsize
+    except Exception:
+        pass
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+def _batch_output_path(img_path: Path, output_dir: Path, ext: Optional[str] = None,
+                       input_dir: Optional[Path] = None) -> Path:
+    """
+    Output location of an image processed in batch mode, keeping its format unless `ext` is given.
+    
+    With `input_dir`, the image's subdirectory below it is mirrored below output_dir.
+    """
+    if input_dir is not None:
+        output_dir = output_dir / img_path.parent.relative_to(input_dir)
+    return output_dir / f"{img_path.stem}_upscaled{ext or img_path.suffix}"
+
+def _probe_video(path: Union[str, Path]) -> Dict[str, object]:
+    """
+    Read the frame size, frame rate, frame count and rotation of a video's first video stream with ffprobe.
+    
+    The size is the stored one, before any rotation. The rotation is the
+    counter-clockwise turn, a multiple of 90 degrees, that displays the
+    frames upright. The frame count is None when the container does not
+    record it.
+    """
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+         '-show_entries', 'stream=width,height,r_frame_rate,avg_frame_rate,nb_frames'
+                          ':stream_tags=rotate:stream_side_data=rotation',
+         '-of', 'json', str(path)],
+        capture_output=True, check=True, text=True)
+    streams = json.loads(result.stdout).get('streams')
+    if not streams:
+        raise ValueError(f"No video stream in {path}")
+    stream = streams[0]
+    # r_frame_rate is 0/0 in some containers
+    frame_rate = stream.get('r_frame_rate', '0/0')
+    if frame_rate.startswith('0/') or frame_rate.endswith('/0'):
+        frame_rate = stream.get('avg_frame_rate', '25/1')
+    frames = stream.get('nb_frames', '')
+    # Newer ffprobe reports the display matrix (counter-clockwise), older the rotate tag (clockwise)
+    rotations = [data['rotation'] for data in stream.get('side_data_list', []) if 'rotation' in data]
+    rotation = float(rotations[0]) if rotations else -float(stream.get('tags', {}).get('rotate', 0))
+    return {
+        'width': int(stream['width']),
+        'height': int(stream['height']),
+        'frame_rate': frame_rate,
+        'frames': int(frames) if frames.isdigit() else None,
+        'rotation': round(rotation / 90) % 4 * 90,
+    }
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    """Serialize one PNG chunk."""
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+def _write_png_strips(path: Union[str, Path], img: np.ndarray, strip_rows: int = 256,
+                      compression: int = 1) -> None:
+    """
+    Encode a (possibly memory-mapped) cv2-layout image as PNG, a strip of rows at a time.
+    
+    Only `strip_rows` rows are held in memory at once, so images far larger
+    than RAM can be written straight from a numpy.memmap.
+    
+    Args:
+        path: Destination file
+        img: Grayscale, BGR or BGRA image, 8 or 16 bit
+        strip_rows: Number of rows encoded per step
+        compression: zlib compression level (0-9)
+    """
+    height, width = img.shape[:2]
+    channels = 1 if img.ndim == 2 else img.shape[2]
+    bit_depth = 16 if img.dtype == np.uint16 else 8
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    bytes_per_pixel = channels * bit_depth // 8
+    compressor = zlib.compressobj(compression)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)))
+        for y0 in range(0, height, strip_rows):
+            strip = np.asarray(img[y0:y0 + strip_rows])
+            if channels == 3:
+                strip = strip[:, :, ::-1]
+            elif channels == 4:
+                strip = strip[:, :, [2, 1, 0, 3]]
+            # PNG stores 16-bit samples big-endian
+            strip = np.ascontiguousarray(strip, dtype='>u2' if bit_depth == 16 else np.uint8)
+            raw = strip.view(np.uint8).reshape(strip.shape[0], -1)
+            # Sub filter: every byte minus the same byte of the previous pixel
+            rows = np.empty((raw.shape[0], raw.shape[1] + 1), dtype=np.uint8)
+            rows[:, 0] = 1
+            rows[:, 1:1 + bytes_per_pixel] = raw[:, :bytes_per_pixel]
+            np.subtract(raw[:, bytes_per_pixel:], raw[:, :-bytes_per_pixel], out=rows[:, 1 + bytes_per_pixel:])
+            data = compressor.compress(rows.tobytes())
+            if data:
+                f.write(_png_chunk(b'IDAT', data))
+        f.write(_png_chunk(b'IDAT', compressor.flush()))
+        f.write(_png_chunk(b'IEND', b''))
+
+class BatchManifest:
+    """
+    Record of batch results kept in the output directory, used to resume runs.
+    
+    Every finished image appends one JSON line (input path, size, mtime,
+    output path, status, duration) and flushes it, so an interrupted run
+    loses at most the images that were in flight. On the next run, inputs
+    whose size and mtime match a successful entry with an existing output
+    are skipped; new, changed and failed inputs are processed again.
+    """
+    FILENAME = '.upscale_manifest.jsonl'
+
+    def __init__(self, output_dir: Union[str, Path]):
+        self.path = Path(output_dir) / self.FILENAME
+        self.entries = {}
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line from a crash
+                        continue
+                    self.entries[entry['input']] = entry
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def is_up_to_date(self, input_path: Path, output_path: Path) -> bool:
+        """
+        Check whether an input was already processed successfully in its current state.
+        
+        Also snapshots the input's size and mtime, which record() stores, so
+        an input modified while it is being processed is picked up next run.
+        """
+        stat = input_path.stat()
+        self._snapshots[str(input_path)] = stat
+        entry = self.entries.get(str(input_path))
+        return (entry is not None and entry['status'] == 'done'
+                and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+                and entry['output'] == str(output_path) and output_path.exists())
+
+    def record(self, input_path: Path, output_path: Path, success: bool, duration: float):
+        """Append the result of one image and flush it to disk."""
+        stat = self._snapshots.pop(str(input_path), None) or input_path.stat()
+        entry = {
+            'input': str(input_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'output': str(output_path),
+            'status': 'done' if success else 'failed',
+            'duration': round(duration, 3),
+        }
+        with self._lock:
+            self.entries[entry['input']] = entry
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+
+    def close(self):
+        """Rewrite the manifest with one line per input, dropping superseded entries."""
+        with self._lock:
+            self._file.close()
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp_path, self.path)
+
+def _discover_jobs(input_dir: Path, output_dir: Path, extensions: List[str], manifest: BatchManifest,
+                   force: bool = False, ext: Optional[str] = None, recursive: bool = False,
+                   include: Optional[List[str]] = None,
+                   exclude: Optional[List[str]] = None) -> Iterator[Tuple[Path, Path]]:
+    """
+    Yield the (input_path, output_path) jobs of a batch run as the images are found.
+    
+    Outputs keep the extension of their input unless `ext` is given, and
+    mirror the input's subdirectory. Inputs the manifest shows as already
+    up to date are left out unless `force` is set. See _scan_images for
+    `recursive`, `include` and `exclude`.
+    """
+    found = 0
+    skipped = 0
+    for img_path in _scan_images(input_dir, extensions, recursive, include, exclude, skip_dirs=[output_dir]):
+        found += 1
+        output_path = _batch_output_path(img_path, output_dir, ext, input_dir)
+        if manifest.is_up_to_date(img_path, output_path) and not force:
+            skipped += 1
+            continue
+        yield img_path, output_path
+
+    if not found:
+        logger.warning(f"No images found in {input_dir} with extensions {extensions}")
+    elif skipped:
+        logger.info(f"Skipping {skipped}/{found} images that are already up to date")
+    logger.info(f"Found {found - skipped} images to process")
+
+class LargestFirstQueue:
+    """
+    Jobs found on a background thread, handed out largest first.
+    
+    A daemon thread consumes `jobs` and ranks each by `key`, so callers can
+    start on the largest jobs found so far while discovery is still running,
+    and a run does not end on one large image started last. Iterating blocks
+    until a job is available and ends once discovery is done and every job
+    has been handed out.
+    
+    Args:
+        jobs: Iterable of jobs, consumed on the background thread
+        key: Size of a job, e.g. the pixel count of its image; larger jobs come first
+    """
+
+    def __init__(self, jobs: Iterable, key: Callable[[object], int]):
+        self.count = 0
+        self.finished = False
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._discover, args=(jobs, key), name='discovery', daemon=True)
+        self._thread.start()
+
+    def _discover(self, jobs: Iterable, key: Callable[[object], int]):
+        try:
+            for job in jobs:
+                size = key(job)
+                with self._condition:
+                    # The count breaks ties in discovery order and keeps jobs from being compared
+                    heapq.heappush(self._heap, (-size, self.count, job))
+                    self.count += 1
+                    self._condition.notify()
+        except Exception as e:
+            # The jobs found so far are still processed
+            logger.error(f"Error discovering images: {str(e)}")
+        finally:
+            with self._condition:
+                self.finished = True
+                self._condition.notify_all()
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Return the largest job found so far, waiting for one if there is none yet.
+        
+        Returns None once discovery is done and every job has been handed out.
+        Raises queue.Empty if no job turned up within `timeout` seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._heap or self.finished, timeout):
+                raise queue.Empty
+            return heapq.heappop(self._heap)[2] if self._heap else None
+
+    def __iter__(self):
+        while True:
+            job = self.get()
+            if job is None:
+                return
+            yield job
+
+class TileCache:
+    """
+    Tiles of the previous frame of a sequence, kept to skip unchanged tiles.
+
+    Holds the input window and the upscaled output of every tile of the last
+    frame passed to TileBatchEngine.infer. A tile of the next frame whose
+    window differs from the cached one by at most `threshold` reuses the
+    cached output. The comparison is always against the window the cached
+    output was computed from, so slow changes cannot accumulate unnoticed.
+
+    Args:
+        threshold: Largest per-pixel difference (in [0, 1]) of a window that
+            still reuses the cached output. 0 only reuses identical windows.
+    """
+
+    def __init__(self, threshold: float = 0.0):
+        self.threshold = threshold
+        # Tile size of the last frame; frames keep it so their tiles line up
+        self.tile_size: Optional[int] = None
+        self.entries: Dict[Tuple[int, Tuple[int, ...]], Tuple[torch.Tensor, torch.Tensor]] = {}
+
+    def lookup(self, index: int, plan: Tuple[int, ...], window: torch.Tensor) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+        """Return the cached (window, output) of a tile if its window is unchanged, else None."""
+        entry = self.entries.get((index, plan))
+        if entry is None or entry[0].shape != window.shape:
+            return None
+        if self.threshold <= 0:
+            unchanged = torch.equal(entry[0], window)
+        else:
+            unchanged = (entry[0] - window).abs_().max().item() <= self.threshold
+        return entry if unchanged else None
+
+class TileBatchEngine:
+    """
+    Tiled Real-ESRGAN inference that batches tiles across images.
+    
+    Every image is cut into tiles of `tile_size` pixels, each read with
+    `tile_pad` pixels of surrounding context, as in RealESRGANer.tile_process.
+    Windows at the image border are not clipped but moved inwards, so every
+    window has the same `tile_size + 2 * tile_pad` shape (or the image's own
+    extent where it is smaller). Windows of equal shape, from one
+    image or many, are stacked into batches and run through the network in a
+    single forward call, then the tile's part of each result is stitched into
+    its image. With `pad_batches`, smaller windows, such as whole small images,
+    are also extended to the shape of the largest window in their batch so
+    they can share it. The extension changes the context the network sees at
+    their right and bottom edges, so those pixels then depend on which other
+    windows shared the pass; without it every window gives the same output
+    whatever it is batched with.
+    
+    Two kinds of tiles skip the network. With a `flat_threshold`, tiles whose
+    padded window has no neighbouring pixels differing by more than the
+    threshold (solid colours and gentle gradients) are filled by bilinear
+    interpolation of the window. With `dedup_tiles`, a tile whose window and
+    position in it match those of a tile already queued in the same call is
+    copied from that tile's output, which is exactly what the network would
+    produce for it, seams included. Given a TileCache, tiles that did not
+    change since the previous frame reuse that frame's output.
+    
+    Args:
+        model: Loaded super-resolution network (already on `device`)
+        scale: Upsampling factor of the network
+        device: Device the network lives on
+        tile_size: Tile edge in input pixels. 0 processes each image as a single tile.
+        tile_pad: Context pixels read around each tile and discarded after inference
+        batch_size: Maximum number of tiles per forward call
+        activation_elements: Approximate activation elements per input pixel of a forward pass
+        dtype: Input dtype of the network. Defaults to the dtype of its parameters.
+        memory_format: Memory layout of the batches fed to the network
+        flat_threshold: Largest difference between neighbouring pixels (in [0, 1])
+            of a window filled by interpolation. None runs every tile through the network.
+        dedup_tiles: Reuse the output of identical tiles
+        pad_batches: Let windows of different shapes share forward passes
+    """
+    # Share of extra pixels a forward pass may compute to let windows of
+    # different shapes (e.g. small images of different sizes) run together
+    MAX_PAD_OVERHEAD = 0.5
+
+    def __init__(self, model: Callable[[torch.Tensor], torch.Tensor], scale: int,
+                 device: Union[str, torch.device], tile_size: int = 512, tile_pad: int = 32,
+                 batch_size: int = 4, activation_elements: int = _ACTIVATION_ELEMENTS_PER_PIXEL,
+                 dtype: Optional[torch.dtype] = None,
+                 memory_format: torch.memory_format = torch.contiguous_format,
+                 flat_threshold: Optional[float] = None, dedup_tiles: bool = True,
+                 pad_batches: bool = False):
+        self.model = model
+        self.flat_threshold = flat_threshold
+        self.dedup_tiles = dedup_tiles
+        self.pad_batches = pad_batches
+        self.activation_elements = activation_elements
+        self.scale = scale
+        self.device = torch.device(device)
+        self.batch_size = max(1, batch_size)
+        self.dtype = dtype or next(model.parameters()).dtype
+        self.memory_format = memory_format
+        # Networks running below 4x pixel-unshuffle their input, so every
+        # window has to stay divisible by this
+        self.mod_scale = {1: 4, 2: 2}.get(scale, 1)
+        self.tile_size = tile_size - tile_size % self.mod_scale
+        self.tile_pad = tile_pad - tile_pad % self.mod_scale
+
+    def _plan_axis(self, length: int, tile: int) -> List[Tuple[int, int, int, int]]:
+        """
+        Split one axis into (start, end, window_start, window_end) spans.
+        
+        Every window is `tile + 2 * tile_pad` long, or the whole axis where it is
+        shorter. A window is placed `tile_pad` before its tile and moved inside
+        the image at the border, where the tile then takes the context the
+        border does not need. Interior windows stay on the `tile` grid.
+        """
+        window = tile + 2 * self.tile_pad
+        if length <= window:
+            return [(0, length, 0, length)]
+        spans = []
+        start = 0
+        while start < length:
+            window_start = min(max(start - self.tile_pad, 0), length - window)
+            window_end = window_start + window
+            end = length if window_end == length else window_end - self.tile_pad
+            spans.append((start, end, window_start, window_end))
+            start = end
+        return spans
+
+    def _plan_tiles(self, height: int, width: int, tile: int) -> List[Tuple[int, ...]]:
+        """
+        Return the tiles of an image as (y0, y1, x0, x1, window_y0, window_y1, window_x0, window_x1).
+        
+        All windows of an image, and of every image at least `tile + 2 * tile_pad`
+        pixels along both axes, have the same shape, so they stack into the same batches.
+        """
+        if tile <= 0:
+            return [(0, height, 0, width, 0, height, 0, width)]
+        return [(y0, y1, x0, x1, window_y0, window_y1, window_x0, window_x1)
+                for y0, y1, window_y0, window_y1 in self._plan_axis(height, tile)
+                for x0, x1, window_x0, window_x1 in self._plan_axis(width, tile)]
+
+    def _is_flat(self, gradients: Tuple[np.ndarray, np.ndarray], plan: Tuple[int, ...]) -> bool:
+        """Whether a tile's window has no neighbouring pixels differing by more than flat_threshold."""
+        dx, dy = gradients
+        window_y0, window_y1, window_x0, window_x1 = plan[4:]
+        return (dx[window_y0:window_y1, window_x0:window_x1 - 1].max(initial=0) <= self.flat_threshold
+                and dy[window_y0:window_y1 - 1, window_x0:window_x1].max(initial=0) <= self.flat_threshold)
+
+    def _interpolate(self, image: torch.Tensor, plan: Tuple[int, ...]) -> torch.Tensor:
+        """Upscale a tile bilinearly from its window, cropped like a network output."""
+        y0, y1, x0, x1, window_y0, window_y1, window_x0, window_x1 = plan
+        scale = self.scale
+        window = np.ascontiguousarray(image[:, window_y0:window_y1, window_x0:window_x1].numpy().transpose(1, 2, 0))
+        upscaled = cv2.resize(window, ((window_x1 - window_x0) * scale, (window_y1 - window_y0) * scale),
+                              interpolation=cv2.INTER_LINEAR)
+        return torch.from_numpy(upscaled[(y0 - window_y0) * scale:(y1 - window_y0) * scale,
+                                         (x0 - window_x0) * scale:(x1 - window_x0) * scale].transpose(2, 0, 1))
+
+    def _pack(self, tiles: List[Tuple[int, ...]]) -> List[Tuple[List[Tuple[int, ...]], int, int]]:
+        """
+        Group tiles into forward passes of up to batch_size windows.
+        
+        Windows are taken largest first. Windows of one shape always share
+        passes. With pad_batches, a window of another shape joins the current
+        pass while extending every window of the pass to its largest height
+        and width adds at most MAX_PAD_OVERHEAD to the pixels computed, so
+        small images of different sizes share passes when they are close
+        enough in size.
+        
+        Returns:
+            List of (tiles, height, width) per forward pass
+        """
+        def shape(tile):
+            return tile[6] - tile[5], tile[8] - tile[7]
+
+        passes = []
+        chunk, height, width, pixels = [], 0, 0, 0
+        for tile in sorted(tiles, key=lambda tile: (shape(tile)[0] * shape(tile)[1],) + shape(tile), reverse=True):
+            tile_height, tile_width = shape(tile)
+            next_height, next_width = max(height, tile_height), max(width, tile_width)
+            if chunk and (len(chunk) == self.batch_size
+                          or (not self.pad_batches and (tile_height, tile_width) != (height, width))
+                          or (len(chunk) + 1) * next_height * next_width
+                          > (1 + self.MAX_PAD_OVERHEAD) * (pixels + tile_height * tile_width)):
+                passes.append((chunk, height, width))
+                chunk, pixels = [], 0
+                next_height, next_width = tile_height, tile_width
+            chunk.append(tile)
+            height, width = next_height, next_width
+            pixels += tile_height * tile_width
+        if chunk:
+            passes.append((chunk, height, width))
+        return passes
+
+    @torch.no_grad()
+    def infer(self, images: List[np.ndarray], tile_size: Optional[int] = None,
+              metrics: Metrics = NULL_METRICS, tile_cache: Optional[TileCache] = None) -> List[np.ndarray]:
+        """
+        Upscale RGB float images in [0, 1].
+        
+        Args:
+            images: List of HxWx3 float32 arrays
+            tile_size: Tile edge for this call. Defaults to the engine's tile_size.
+            metrics: Receives the pre_process, stitch, tile_fill and tile_inference timings
+                and the tiles, tiles_flat, tiles_duplicate, tiles_reused and forward_passes counts
+            tile_cache: Tiles of the previous call on the same sequence, replaced by
+                the tiles of this one
+            
+        Returns:
+            List[np.ndarray]: The upscaled HxWx3 float32 arrays, clipped to [0, 1]
+        """
+        scale = self.scale
+        tile = self.tile_size if tile_size is None else tile_size - tile_size % self.mod_scale
+        inputs = []
+        outputs = []
+        # Tiles that go through the network, as (index,) + plan
+        pending = []
+        # Tiles that skip the network: (index, plan) filled by interpolation, and
+        # (index, plan, source index, source plan) copied from an identical tile
+        # and (index, plan, cached entry) unchanged since the previous frame
+        flat = []
+        duplicates = []
+        reused = []
+        queued = {}
+        cached = {}
+        with metrics.stage('pre_process'):
+            for index, img in enumerate(images):
+                height, width = img.shape[:2]
+                tensor = torch.from_numpy(np.ascontiguousarray(img.transpose(2, 0, 1)))
+                pad_h = -height % self.mod_scale
+                pad_w = -width % self.mod_scale
+                if pad_h or pad_w:
+                    tensor = torch.nn.functional.pad(tensor[None], (0, pad_w, 0, pad_h), 'replicate')[0]
+                inputs.append(tensor)
+                outputs.append(torch.zeros((3, tensor.shape[1] * scale, tensor.shape[2] * scale)))
+                if self.flat_threshold is not None:
+                    # Largest difference between horizontal and vertical neighbours, over channels
+                    pixels = tensor.numpy()
+                    gradients = (np.abs(np.diff(pixels, axis=2)).max(axis=0),
+                                 np.abs(np.diff(pixels, axis=1)).max(axis=0))
+                for plan in self._plan_tiles(tensor.shape[1], tensor.shape[2], tile):
+                    if self.flat_threshold is not None and self._is_flat(gradients, plan):
+                        flat.append((index, plan))
+                        continue
+                    y0, y1, x0, x1, window_y0, window_y1, window_x0, window_x1 = plan
+                    window = tensor[:, window_y0:window_y1, window_x0:window_x1]
+                    if tile_cache is not None:
+                        entry = tile_cache.lookup(index, plan, window)
+                        if entry is not None:
+                            reused.append((index, plan, entry))
+                            continue
+                    if self.dedup_tiles:
+                        key = (tuple(window.shape), y0 - window_y0, y1 - window_y0, x0 - window_x0, x1 - window_x0,
+                               hashlib.blake2b(np.ascontiguousarray(window.numpy()), digest_size=16).digest())
+                        if key in queued:
+                            duplicates.append((index, plan) + queued[key])
+                            continue
+                        queued[key] = (index, plan)
+                    pending.append((index,) + plan)
+
+        for chunk, batch_height, batch_width in self._pack(pending):
+            with metrics.stage('stitch'):
+                windows = []
+                for index, _, _, _, _, window_y0, window_y1, window_x0, window_x1 in chunk:
+                    window = inputs[index][:, window_y0:window_y1, window_x0:window_x1]
+                    if window.shape[1:] != (batch_height, batch_width):
+                        # Smaller windows are extended to the batch's shape; the extra
+                        # output lies beyond the tile and is cropped away below
+                        window = torch.nn.functional.pad(
+                            window[None], (0, batch_width - window.shape[2], 0, batch_height - window.shape[1]),
+                            'replicate')[0]
+                    windows.append(window)
+                batch = torch.stack(windows)
+            with metrics.stage('tile_inference'):
+                batch = batch.to(self.device, dtype=self.dtype, non_blocking=True)
+                batch = batch.contiguous(memory_format=self.memory_format)
+                # Copying the result back to the host waits for the device to finish
+                result = self.model(batch).float().clamp_(0, 1).cpu()
+            metrics.count('tiles', len(chunk))
+            metrics.count('forward_passes')
+            with metrics.stage('stitch'):
+                for tile_output, (index, *plan) in zip(result, chunk):
+                    y0, y1, x0, x1, window_y0, window_y1, window_x0, window_x1 = plan
+                    tile_output = tile_output[:, (y0 - window_y0) * scale:(y1 - window_y0) * scale,
+                                              (x0 - window_x0) * scale:(x1 - window_x0) * scale]
+                    outputs[index][:, y0 * scale:y1 * scale, x0 * scale:x1 * scale] = tile_output
+                    if tile_cache is not None:
+                        cached[(index, tuple(plan))] = (
+                            inputs[index][:, window_y0:window_y1, window_x0:window_x1].clone(),
+                            tile_output.clone())
+
+        if flat or duplicates or reused:
+            with metrics.stage('tile_fill'):
+                for index, plan in flat:
+                    y0, y1, x0, x1 = plan[:4]
+                    outputs[index][:, y0 * scale:y1 * scale, x0 * scale:x1 * scale] = self._interpolate(
+                        inputs[index], plan)
+                for index, plan, source, source_plan in duplicates:
+                    y0, y1, x0, x1 = plan[:4]
+                    source_y0, source_y1, source_x0, source_x1 = source_plan[:4]
+                    outputs[index][:, y0 * scale:y1 * scale, x0 * scale:x1 * scale] = outputs[source][
+                        :, source_y0 * scale:source_y1 * scale, source_x0 * scale:source_x1 * scale]
+                    if (source, source_plan) in cached:
+                        cached[(index, plan)] = cached[(source, source_plan)]
+                for index, plan, entry in reused:
+                    y0, y1, x0, x1 = plan[:4]
+                    outputs[index][:, y0 * scale:y1 * scale, x0 * scale:x1 * scale] = entry[1]
+                    cached[(index, plan)] = entry
+            metrics.count('tiles_flat', len(flat))
+            metrics.count('tiles_duplicate', len(duplicates))
+            metrics.count('tiles_reused', len(reused))
+            skipped = len(flat) + len(duplicates) + len(reused)
+            total = skipped + len(pending)
+            logger.info(f"Skipped the network for {skipped}/{total} tiles "
+                         f"({len(flat)} flat, {len(duplicates)} duplicate, {len(reused)} unchanged)")
+        if tile_cache is not None:
+            tile_cache.entries = cached
+
+        results = []
+        with metrics.stage('stitch'):
+            for img, output in zip(images, outputs):
+                height, width = img.shape[:2]
+                results.append(output[:, :height * scale, :width * scale].numpy().transpose(1, 2, 0))
+        return results
+
+    def enhance(self, imgs: List[np.ndarray], tile_size: Optional[int] = None,
+                metrics: Metrics = NULL_METRICS, tile_cache: Optional[TileCache] = None) -> List[np.ndarray]:
+        """
+        Upscale images as read by cv2, batching tiles across all of them.
+        
+        Mirrors RealESRGANer.enhance: grayscale, BGR and BGRA inputs in 8 or
+        16 bit are accepted and returned in the same layout and dtype. Alpha
+        channels are upscaled with the network alongside the colour planes.
+        
+        Args:
+            imgs: List of images as returned by cv2.imread / cv2.imdecode
+            tile_size: Tile edge for this call. Defaults to the engine's tile_size.
+            metrics: Receives the stage timings of this call (see infer)
+            tile_cache: Tiles of the previous frame to reuse (see infer)
+            
+        Returns:
+            List[np.ndarray]: The upscaled images
+        """
+        planes = []
+        layouts = []
+        with metrics.stage('pre_process'):
+            for img in imgs:
+                # Decided by dtype too, so every block of a 16-bit image gets the same range
+                max_range = 65535 if img.dtype == np.uint16 or np.max(img) > 256 else 255
+                img = img.astype(np.float32)
+                img = img / max_range
+                if img.ndim == 2:
+                    planes.append(cv2.cvtColor(img, cv2.COLOR_GRAY2RGB))
+                    layouts.append(('L', max_range, None))
+                elif img.shape[2] == 4:
+                    planes.append(cv2.cvtColor(img[:, :, 0:3], cv2.COLOR_BGR2RGB))
+                    planes.append(cv2.cvtColor(img[:, :, 3], cv2.COLOR_GRAY2RGB))
+                    layouts.append(('RGBA', max_range, len(planes) - 1))
+                else:
+                    planes.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+                    layouts.append(('RGB', max_range, None))
+
+        upscaled = self.infer(planes, tile_size=tile_size, metrics=metrics, tile_cache=tile_cache)
+
+        outputs = []
+        plane = 0
+        with metrics.stage('post_process'):
+            for mode, max_range, alpha_plane in layouts:
+                output = cv2.cvtColor(upscaled[plane], cv2.COLOR_RGB2BGR)
+                if mode == 'L':
+                    output = cv2.cvtColor(output, cv2.COLOR_BGR2GRAY)
+                elif mode == 'RGBA':
+                    output = cv2.cvtColor(output, cv2.COLOR_BGR2BGRA)
+                    output[:, :, 3] = cv2.cvtColor(upscaled[alpha_plane], cv2.COLOR_RGB2GRAY)
+                    plane += 1
+                plane += 1
+                dtype = np.uint16 if max_range == 65535 else np.uint8
+                outputs.append((output * float(max_range)).round().astype(dtype))
+        return outputs
+
+class MicroBatcher:
+    """
+    Inference queue that coalesces small images of concurrent callers into shared batches.
+    
+    Submitted images are run by a single background thread in order of
+    arrival, so the queue also serializes access to the models. Images that
+    fit in a single tile are collected until the batch holds `max_batch`
+    images or the first of them has waited `max_wait` seconds, then upscaled
+    together with ImageUpscaler.upscale_arrays, where images of the same
+    size share forward passes. With the upscaler's `pad_batches`, images of
+    different sizes are extended to a common shape so they share them too
+    (see TileBatchEngine). Only small images of the same model share a
+    batch; larger images run alone. If a batch fails, its images are
+    retried one at a time so a bad input only fails its own request.
+    
+    Args:
+        upscaler: Upscaler that runs the batches
+        max_batch: Maximum number of images per batch
+        max_wait: Seconds a small image waits at most for others to join its batch.
+            0 only batches images that are already queued.
+    """
+
+    def __init__(self, upscaler: 'ImageUpscaler', max_batch: int, max_wait: float):
+        self.upscaler = upscaler
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        # Pending requests: (image, model name, metrics, submit time, future, batchable)
+        self._queue = queue.Queue()
+        # Requests for another model than the batch being collected, served next
+        self._held = deque()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, img: np.ndarray, model_name: str = None,
+               metrics: Metrics = NULL_METRICS) -> Future:
+        """
+        Queue an image for upscaling.
+        
+        Args:
+            img: Image array as returned by cv2
+            model_name: Model to use for this image (default: the upscaler's model)
+            metrics: Receives the time spent waiting for the batch (batch_wait),
+                the number of batches (micro_batches) and the inference stages of the batch
+            
+        Returns:
+            Future: Resolves to the upscaled image, or to the error of its inference
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((img, model_name or self.upscaler.model_name, metrics, time.perf_counter(), future,
+                         self.upscaler._is_single_tile(img.shape)))
+        return future
+
+    def _collect(self) -> List[tuple]:
+        """Block until a batch is ready and return its requests."""
+        first = self._held.popleft() if self._held else self._queue.get()
+        model_name = first[1]
+        batch = [first]
+        if not first[5]:
+            return batch
+        for request in list(self._held):
+            if len(batch) < self.max_batch and request[1] == model_name and request[5]:
+                self._held.remove(request)
+                batch.append(request)
+        # The window starts at the first submission, so no image waits longer
+        # than max_wait; requests already queued still join after it closes
+        deadline = first[3] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            (batch if request[1] == model_name and request[5] else self._held).append(request)
+        return batch
+
+    def _upscale(self, batch: List[tuple]) -> List[np.ndarray]:
+        """Upscale the images of a batch, adding its readings to every request's metrics."""
+        started = time.perf_counter()
+        instrumented = [request for request in batch if request[2].enabled]
+        metrics = Metrics() if instrumented else NULL_METRICS
+        try:
+            return self.upscaler.upscale_arrays([request[0] for request in batch],
+                                                model_name=batch[0][1], metrics=metrics)
+        finally:
+            recorders = {}
+            for _, _, recorder, submitted, _, _ in instrumented:
+                recorder.add_time('batch_wait', started - submitted)
+                recorders[id(recorder)] = recorder
+            # Images of one request share its metrics, which count the batch once
+            for recorder in recorders.values():
+                recorder.count('micro_batches')
+                recorder.merge(metrics)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if len(batch) > 1:
+                logger.debug(f"Micro-batching {len(batch)} images")
+            try:
+                outputs = self._upscale(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][4].set_exception(e)
+                    continue
+                logger.warning(f"Batch of {len(batch)} images failed ({str(e)}), retrying them one by one")
+                for request in batch:
+                    try:
+                        request[4].set_result(self._upscale([request])[0])
+                    except Exception as e:
+                        request[4].set_exception(e)
+                continue
+            for request, output in zip(batch, outputs):
+                request[4].set_result(output)
+
 class ImageUpscaler:
     def __init__(self, model_name: str = 'RealESRGAN_x4plus', device: str = None, 
-                 gpu_id: int = 0, memory_efficient: bool = True):
+                 gpu_id: int = 0, memory_efficient: bool = True, tile_batch_size: int = 4,
+                 cache: Optional[ResultCache] = None, model_memory_budget: int = 2 * 1024**3,
+                 precision: Optional[str] = None, backend: str = 'torch', cpu_threads: Optional[int] = None,
+                 micro_batch_wait: Optional[float] = None, micro_batch_size: Optional[int] = None,
+                 flat_tile_threshold: Optional[float] = None, dedup_tiles: bool = True,
+                 pad_batches: bool = False):
         """
         Initialize the image upscaler with specified model and device.
         
+        Other models from MODEL_REGISTRY can be selected per call; they are
+        loaded on first use and kept resident, least recently used first out,
+        while their weights fit in `model_memory_budget`.
+        
+        On the CPU the network runs in bf16 where the CPU supports it and fp32
+        otherwise, with channels_last tensors and one thread per usable CPU.
+        The 'onnx' backend runs it through ONNX Runtime instead (CPU only,
+        fp32, needs the onnxruntime package).
+        
+        With a `micro_batch_wait`, images passed to upscale_array (and so
+        upscale_bytes) from concurrent threads go through a MicroBatcher, which
+        runs them in order of arrival and coalesces small ones into shared
+        inference batches.
+        
         Args:
-            model_name: Name of the model to use
+            model_name: Name of the default model (a key of MODEL_REGISTRY)
             device: Device to use ('cuda' or 'cpu'). If None, will automatically detect.
             gpu_id: GPU ID to use if multiple GPUs are available
             memory_efficient: If True, enables memory-efficient mode for vGPUs
+            tile_batch_size: Maximum number of tiles run through the model in one forward call
+            cache: Optional result cache consulted by upscale_bytes and upscale_image
+            model_memory_budget: Bytes of model weights kept resident across models
+            precision: 'fp16', 'bf16' or 'fp32'. If None, picked for the device.
+            backend: 'torch' or 'onnx'
+            cpu_threads: Intra-op threads used on the CPU. If None, every usable CPU.
+            micro_batch_wait: Seconds a small image waits at most for others to share
+                its batch. None runs upscale_array directly on the calling thread.
+            micro_batch_size: Maximum images per micro-batch (default: tile_batch_size)
+            flat_tile_threshold: Tiles whose neighbouring pixels differ by at most this many
+                8-bit levels are upscaled by interpolation instead of the network.
+                None runs the network on every tile.
+            dedup_tiles: Copy the output of tiles identical to one already processed
+            pad_batches: Extend small images of different sizes to a common shape so they
+                share forward passes. Their right and bottom edge pixels then depend on
+                the other images of the batch, and the result cache keeps whichever
+                variant is stored first.
         """
+        if model_name not in MODEL_REGISTRY:
+            raise ValueError(f"Unsupported model: {model_name}. Available: {', '.join(MODEL_REGISTRY)}")
+        if precision is not None and precision not in _PRECISIONS:
+            raise ValueError(f"Unsupported precision: {precision}. Available: {', '.join(_PRECISIONS)}")
+        if backend not in ('torch', 'onnx'):
+            raise ValueError(f"Unsupported backend: {backend}. Available: torch, onnx")
         self.model_name = model_name
+        self.model_memory_budget = model_memory_budget
+        # Tiles are sized per image from free memory; this is only the upper bound
+        self.max_tile_size = 512 if memory_efficient else 0  # Larger tile size for RTX A5000
+        self.tile_pad = 32  # Increased padding for better quality
+        # Resident models, least recently used first: name -> (TileBatchEngine, bytes)
+        self._models = OrderedDict()
+        # RealESRGANer of the default model, built on first access of `upscaler`
+        self._reference_upsampler = None
+        # Seconds spent in each startup phase: device_init, weight_load, first_inference
+        self.startup_timings = {}
         self.memory_efficient = memory_efficient
+        self.tile_batch_size = tile_batch_size
+        self.flat_tile_threshold = flat_tile_threshold
+        self.dedup_tiles = dedup_tiles
+        self.pad_batches = pad_batches
+        self.cache = cache
+        # Only one inference runs on the device at a time
+        self._lock = threading.Lock()
+        self._batcher = (MicroBatcher(self, micro_batch_size or tile_batch_size, micro_batch_wait)
+                         if micro_batch_wait is not None else None)
         
         # Set PyTorch to use TF32 for better performance on Ampere GPUs
         torch.backends.cuda.matmul.allow_tf32 = True
@@ -41,7 +1373,9 @@ class ImageUpscaler:
         torch.backends.cudnn.benchmark = True
         torch.backends.cudnn.deterministic = False
         
-        # GPU device selection and verification
+        # GPU device selection. The CUDA context is created by the first real
+        # allocation (the weights), so no probe tensor is needed here.
+        started = time.perf_counter()
         if device == 'cuda' or (device is None and torch.cuda.is_available()):
             try:
                 # Set specific GPU if multiple are available
@@ -56,63 +1390,136 @@ class ImageUpscaler:
                 
                 self.device = f'cuda:{gpu_id}'
                 
-                # Enable memory efficient mode if requested
                 if self.memory_efficient:
-                    torch.cuda.empty_cache()
                     logger.info("Memory efficient mode enabled")
                     
-                # Test CUDA memory allocation
-                try:
-                    # Allocate a larger test tensor for RTX A5000
-                    test_size = (1, 3, 512, 512)  # Typical image size
-                    test_tensor = torch.zeros(test_size, device=self.device)
-                    del test_tensor
-                    torch.cuda.empty_cache()
-                    logger.info(f"CUDA memory allocation test successful with size {test_size}")
-                except Exception as e:
-                    raise RuntimeError(f"CUDA memory allocation test failed: {str(e)}")
-                    
             except Exception as e:
                 logger.error(f"Error initializing GPU: {str(e)}. Falling back to CPU")
                 self.device = 'cpu'
         else:
             self.device = 'cpu'
             
-        logger.info(f"Using device: {self.device}")
+        if backend == 'onnx' and self.device.startswith('cuda'):
+            logger.warning("The onnx backend only runs on the CPU, using the torch backend on the GPU")
+            backend = 'torch'
+        self.backend = backend
+        self.precision = 'fp32' if backend == 'onnx' else precision or _default_precision(self.device)
+        self.dtype = _PRECISIONS[self.precision]
+        # oneDNN convolutions are fastest on NHWC tensors
+        if self.device == 'cpu' and backend == 'torch':
+            self.memory_format = torch.channels_last
+        else:
+            self.memory_format = torch.contiguous_format
+        if self.device == 'cpu':
+            self.cpu_threads = cpu_threads or _cpu_thread_count()
+            torch.set_num_threads(self.cpu_threads)
+        else:
+            self.cpu_threads = None
+            
+        self.startup_timings['device_init'] = time.perf_counter() - started
+        logger.info(f"Using device: {self.device} ({self.backend} backend, {self.precision}"
+                    + (f", {self.cpu_threads} threads)" if self.cpu_threads else ")"))
+        
+        # Load the default model up front so configuration errors surface at startup
+        started = time.perf_counter()
+        self._load_model(model_name)
+        self.startup_timings['weight_load'] = time.perf_counter() - started
+
+    def _load_model(self, model_name: str) -> TileBatchEngine:
+        """
+        Return the tile engine of a resident model, loading the model first if needed.
         
+        Loading a model may evict the least recently used others to stay
+        within the memory budget. The model just requested is never evicted.
+        """
+        if model_name in self._models:
+            self._models.move_to_end(model_name)
+            return self._models[model_name][0]
+        if model_name not in MODEL_REGISTRY:
+            raise ValueError(f"Unsupported model: {model_name}. Available: {', '.join(MODEL_REGISTRY)}")
+
         try:
-            # Initialize model
-            if self.model_name == 'RealESRGAN_x4plus':
-                model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-                netscale = 4
-            else:
-                raise ValueError(f"Unsupported model: {model_name}")
+            started = time.perf_counter()
+            spec = MODEL_REGISTRY[model_name]
 
             # Get model path from environment variable or use default
-            model_path = os.getenv('MODEL_PATH', f"https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/{model_name}.pth")
-            logger.info(f"Using model path: {model_path}")
-
-            if not os.path.exists(model_path):
-                raise FileNotFoundError(f"Model file not found at {model_path}")
-
-            # Initialize the upscaler with optimized settings for RTX A5000
-            tile_size = 512 if self.memory_efficient else 0  # Larger tile size for RTX A5000
-            self.upscaler = RealESRGANer(
-                scale=netscale,
-                model_path=model_path,
-                model=model,
-                tile=tile_size,
-                tile_pad=32,  # Increased padding for better quality
-                pre_pad=0,
-                device=self.device,
-                half=True  # Always use half precision for better performance
-            )
-            logger.info(f"Model {model_name} initialized successfully with tile_size={tile_size}")
+            model_path = _model_path(model_name, self.model_name)
+            tile_size = self.max_tile_size
+            if self.backend == 'onnx':
+                onnx_path = _derived_path(model_path, model_name, '.onnx')
+                if not _is_fresh(onnx_path, model_path):
+                    state_dict, _ = _load_state_dict(model_name, model_path)
+                    _OnnxModel.export(_build_network(model_name, state_dict), onnx_path)
+                logger.info(f"Using ONNX model: {onnx_path}")
+                model = _OnnxModel(onnx_path, self.cpu_threads)
+                nbytes = model.nbytes
+            else:
+                state_dict, source = _load_state_dict(model_name, model_path)
+                logger.info(f"Using model weights: {source}")
+                model = _build_network(model_name, state_dict).to(self.device, dtype=self.dtype)
+                model = model.to(memory_format=self.memory_format)
+                nbytes = sum(p.numel() * p.element_size() for p in model.parameters())
+
+            engine = TileBatchEngine(model, spec['scale'], self.device,
+                                     tile_size=tile_size, tile_pad=self.tile_pad,
+                                     batch_size=self.tile_batch_size,
+                                     activation_elements=spec['activation_elements'],
+                                     dtype=self.dtype, memory_format=self.memory_format,
+                                     flat_threshold=(None if self.flat_tile_threshold is None
+                                                     else self.flat_tile_threshold / 255),
+                                     dedup_tiles=self.dedup_tiles, pad_batches=self.pad_batches)
+            logger.info(f"Model {model_name} initialized in {time.perf_counter() - started:.2f}s with "
+                        f"max tile_size={tile_size or 'none'}, tile_batch_size={self.tile_batch_size} "
+                        f"({nbytes / 1024**2:.1f}MB of weights)")
             
         except Exception as e:
             logger.error(f"Error initializing model: {str(e)}")
             raise
 
+        self._models[model_name] = (engine, nbytes)
+        while len(self._models) > 1 and sum(entry[1] for entry in self._models.values()) > self.model_memory_budget:
+            evicted, _ = self._models.popitem(last=False)
+            logger.info(f"Evicted model {evicted} to stay within the model memory budget")
+            if self.device.startswith('cuda'):
+                torch.cuda.empty_cache()
+        return engine
+
+    @property
+    def upscaler(self):
+        """
+        RealESRGANer wrapping the default model's network.
+        
+        Only used to compare against the reference per-tile implementation;
+        realesrgan (and with it basicsr) is imported on first access and is
+        not in requirements.txt; install it with `pip install realesrgan`. It
+        shares the torch network, so it needs fp16 or fp32 precision.
+        """
+        if self._reference_upsampler is None:
+            from realesrgan import RealESRGANer
+            engine = self.engine
+            if self.backend != 'torch' or self.precision == 'bf16':
+                raise ValueError("RealESRGANer needs the torch backend in fp16 or fp32 precision")
+            model_path = _model_path(self.model_name, self.model_name)
+            if _is_url(model_path):
+                model_path = _download_weights(model_path, self.model_name)
+            self._reference_upsampler = RealESRGANer(
+                scale=engine.scale, model_path=model_path, model=engine.model,
+                tile=self.max_tile_size, tile_pad=self.tile_pad, pre_pad=0,
+                device=self.device, half=self.precision == 'fp16')
+        return self._reference_upsampler
+
+    @property
+    def engine(self) -> TileBatchEngine:
+        """Tile engine of the default model."""
+        # Loading reorders and may evict resident models, which inference does under the same lock
+        with self._lock:
+            return self._load_model(self.model_name)
+
+    @property
+    def resident_models(self) -> List[str]:
+        """Names of the models currently loaded, least recently used first."""
+        return list(self._models)
+
     def _clear_gpu_memory(self):
         """Clear GPU memory cache if memory efficient mode is enabled."""
         if self.memory_efficient and self.device.startswith('cuda'):
@@ -120,13 +1527,308 @@ class ImageUpscaler:
             gc.collect()
             logger.debug(f"GPU Memory after cleanup: {torch.cuda.memory_allocated() / 1024**2:.2f}MB allocated, {torch.cuda.memory_reserved() / 1024**2:.2f}MB reserved")
 
-    def upscale_image(self, input_path: Union[str, Path], output_path: Union[str, Path]) -> bool:
+    def _available_memory(self) -> int:
+        """Bytes of memory the next inference can use on the current device."""
+        if self.device.startswith('cuda'):
+            free, _ = torch.cuda.mem_get_info(self.device)
+            # Blocks cached by PyTorch's allocator can be reused as well
+            return free + torch.cuda.memory_reserved(self.device) - torch.cuda.memory_allocated(self.device)
+        return _system_available_memory()
+
+    def _choose_tile_size(self, imgs: List[np.ndarray], engine: TileBatchEngine) -> int:
+        """
+        Pick the tile size for a group of images from their size and the free memory.
+        
+        Returns 0 (no tiling) when whole images fit, otherwise the largest tile
+        whose batched forward pass fits, capped at the configured tile size.
+        """
+        element_size = torch.finfo(engine.dtype).bits // 8
+        # Forward passes run on the largest window of their batch, padded to the model's multiple
+        height = max(img.shape[0] for img in imgs)
+        height += -height % engine.mod_scale
+        width = max(img.shape[1] for img in imgs)
+        width += -width % engine.mod_scale
+        budget = self._available_memory() * _MEMORY_SAFETY_FRACTION
+        if not self.device.startswith('cuda'):
+            # The stitched float32 outputs live in the same RAM as the activations
+            budget -= sum(img.shape[0] * img.shape[1] for img in imgs) * engine.scale ** 2 * 3 * 4
+        pixels_per_forward = max(budget, 0) / (engine.activation_elements * element_size)
+
+        images_per_forward = min(len(imgs), engine.batch_size)
+        fits_whole = height * width * images_per_forward <= pixels_per_forward
+        if fits_whole and (engine.tile_size <= 0 or max(height, width) <= engine.tile_size):
+            return 0
+
+        # Windows of tiled images are always tile + 2 * tile_pad, batch_size at a time
+        tile = int((pixels_per_forward / engine.batch_size) ** 0.5) - 2 * engine.tile_pad
+        tile -= tile % 16
+        if engine.tile_size > 0:
+            tile = min(tile, engine.tile_size)
+        return max(tile, _MIN_TILE_SIZE)
+
+    @contextmanager
+    def _device_lock(self, metrics: Metrics = NULL_METRICS):
+        """Hold the inference lock, timing the wait for it as lock_wait."""
+        with metrics.stage('lock_wait'):
+            self._lock.acquire()
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def _record_memory(self, metrics: Metrics):
+        """Record peak device memory of the last inference and the process RSS."""
+        if self.device.startswith('cuda'):
+            metrics.gauge('gpu_peak_allocated', torch.cuda.max_memory_allocated(self.device))
+            metrics.gauge('gpu_reserved', torch.cuda.memory_reserved(self.device))
+        metrics.gauge('rss', _current_rss())
+
+    def upscale_array(self, img: np.ndarray, model_name: str = None,
+                      metrics: Metrics = NULL_METRICS) -> np.ndarray:
+        """
+        Upscale a decoded image held in memory.
+        
+        With micro-batching enabled, the image is queued for the MicroBatcher, and
+        one that fits in a single tile is upscaled together with those of
+        concurrent calls.
+        
+        Args:
+            img: Image array as returned by cv2 (BGR/BGRA or grayscale, 8 or 16 bit)
+            model_name: Model to use for this image (default: the upscaler's model)
+            metrics: Receives stage timings, counters and memory readings
+            
+        Returns:
+            np.ndarray: The image upscaled by the model's native scale, in the same
+                channel layout and dtype
+        """
+        if self._batcher is not None:
+            return self._batcher.submit(img, model_name=model_name, metrics=metrics).result()
+        return self.upscale_arrays([img], model_name=model_name, metrics=metrics)[0]
+
+    def upscale_arrays(self, imgs: List[np.ndarray], model_name: str = None,
+                       metrics: Metrics = NULL_METRICS, tile_cache: Optional[TileCache] = None) -> List[np.ndarray]:
+        """
+        Upscale several decoded images, sharing inference batches between them.
+        
+        Args:
+            imgs: Image arrays as returned by cv2
+            model_name: Model to use for these images (default: the upscaler's model)
+            metrics: Receives stage timings, counters and memory readings
+            tile_cache: Tiles of the previous frame of a sequence; unchanged tiles reuse
+                their output and the frames keep one tile size while it fits
+            
+        Returns:
+            List[np.ndarray]: The upscaled images, in the same order
+        """
+        with self._device_lock(metrics):
+            with metrics.stage('model_load'):
+                engine = self._load_model(model_name or self.model_name)
+            # Clear GPU memory before processing
+            with metrics.stage('clear_gpu_memory'):
+                self._clear_gpu_memory()
+            if metrics.enabled and self.device.startswith('cuda'):
+                torch.cuda.reset_peak_memory_stats(self.device)
+            started = time.perf_counter()
+            tile_size = self._choose_tile_size(imgs, engine)
+            if tile_cache is not None and tile_cache.tile_size and (not tile_size or tile_cache.tile_size < tile_size):
+                # A smaller tile fits as well, and keeping it lines the tiles up with the previous frame
+                tile_size = tile_cache.tile_size
+            retries = 0
+            while True:
+                try:
+                    outputs = engine.enhance(imgs, tile_size=tile_size, metrics=metrics, tile_cache=tile_cache)
+                    break
+                except (RuntimeError, MemoryError) as e:
+                    if not _is_out_of_memory(e):
+                        raise
+                    next_tile_size = (tile_size or max(max(img.shape[:2]) for img in imgs)) // 2
+                    if next_tile_size < _MIN_TILE_SIZE:
+                        raise
+                # Tensors of the failed attempt are only released once the exception is gone
+                logger.warning(f"Out of memory with tile_size={tile_size or 'none'}, "
+                               f"retrying with tile_size={next_tile_size}")
+                tile_size = next_tile_size
+                retries += 1
+                metrics.count('oom_retries')
+                gc.collect()
+                if self.device.startswith('cuda'):
+                    torch.cuda.empty_cache()
+            logger.info(f"Upscaled {len(imgs)} image(s) with tile_size={tile_size or 'none'} "
+                        f"after {retries} out-of-memory retries")
+            if tile_cache is not None:
+                tile_cache.tile_size = tile_size
+            if 'first_inference' not in self.startup_timings:
+                self.startup_timings['first_inference'] = time.perf_counter() - started
+            if metrics.enabled:
+                self._record_memory(metrics)
+            # Clear GPU memory after processing
+            with metrics.stage('clear_gpu_memory'):
+                self._clear_gpu_memory()
+        return outputs
+
+    def plan_route(self, height: int, width: int, model_name: str = None,
+                   target_size: Optional[Tuple[int, int]] = None,
+                   max_edge: Optional[int] = None) -> Tuple[Optional[str], Tuple[int, int], Tuple[int, int]]:
+        """
+        Pick the cheapest way to bring an image to a requested size.
+        
+        Inputs that are already large enough skip the model and are only
+        resized. Otherwise the input is downscaled so the model's output just
+        covers the requested size, which costs the same model FLOPs for any
+        scale, and the model of the family (e.g. RealESRGAN_x2plus for
+        RealESRGAN_x4plus) with the smallest scale that reaches the size is
+        used, so the input keeps as much detail as possible. Sizes beyond the
+        largest scale run the model on the full input and enlarge the result.
+        
+        Args:
+            height: Input height in pixels
+            width: Input width in pixels
+            model_name: Requested model (default: the upscaler's model)
+            target_size: Exact output size as (width, height)
+            max_edge: Output long edge; the aspect ratio is kept
+            
+        Returns:
+            Tuple of the model to run (None to skip it), the (width, height) the
+            input is resized to before the model and the (width, height) of the output
+        """
+        model_name = model_name or self.model_name
+        if model_name not in MODEL_REGISTRY:
+            raise ValueError(f"Unsupported model: {model_name}. Available: {', '.join(MODEL_REGISTRY)}")
+        if (target_size is None) == (max_edge is None):
+            raise ValueError("Give exactly one of target_size and max_edge")
+        if target_size is not None:
+            output_size = (int(target_size[0]), int(target_size[1]))
+            if min(output_size) < 1:
+                raise ValueError(f"Invalid output size: {output_size[0]}x{output_size[1]}")
+        else:
+            if int(max_edge) < 1:
+                raise ValueError(f"Invalid max_edge: {max_edge}")
+            ratio = int(max_edge) / max(height, width)
+            output_size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+
+        factor = max(output_size[0] / width, output_size[1] / height)
+        if factor <= 1:
+            return None, (width, height), output_size
+        family = MODEL_REGISTRY[model_name]['family']
+        scales = sorted((config['scale'], name) for name, config in MODEL_REGISTRY.items()
+                        if config['family'] == family)
+        scale, route_model = next(((s, name) for s, name in scales if s >= factor), scales[-1])
+        # Never enlarge the input by interpolation; the model does that
+        model_input = (min(width, math.ceil(output_size[0] / scale)), min(height, math.ceil(output_size[1] / scale)))
+        return route_model, model_input, output_size
+
+    def upscale_to(self, img: np.ndarray, target_size: Optional[Tuple[int, int]] = None,
+                   max_edge: Optional[int] = None, model_name: str = None,
+                   metrics: Metrics = NULL_METRICS) -> np.ndarray:
+        """
+        Upscale a decoded image to a requested size along the route chosen by plan_route.
+        
+        Args:
+            img: Image array as returned by cv2
+            target_size: Exact output size as (width, height)
+            max_edge: Output long edge; the aspect ratio is kept
+            model_name: Requested model (default: the upscaler's model)
+            metrics: Receives stage timings (including resize) and counters
+            
+        Returns:
+            np.ndarray: The image at the requested size, in the same channel layout and dtype
+        """
+        height, width = img.shape[:2]
+        route_model, model_input, output_size = self.plan_route(height, width, model_name, target_size, max_edge)
+        logger.info(f"Route {width}x{height} -> {output_size[0]}x{output_size[1]}: "
+                    + (f"{route_model} on {model_input[0]}x{model_input[1]}" if route_model else "resize only"))
+        if route_model is None:
+            metrics.count('model_skipped')
+        else:
+            if model_input != (width, height):
+                with metrics.stage('resize'):
+                    img = cv2.resize(img, model_input, interpolation=cv2.INTER_AREA)
+            img = self.upscale_array(img, model_name=route_model, metrics=metrics)
+        if (img.shape[1], img.shape[0]) != output_size:
+            shrinking = img.shape[1] >= output_size[0] and img.shape[0] >= output_size[1]
+            with metrics.stage('resize'):
+                img = cv2.resize(img, output_size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+        return img
+
+    def _cache_key(self, data: bytes, output_format: OutputFormat, model_name: str,
+                   target_size: Optional[Tuple[int, int]] = None, max_edge: Optional[int] = None) -> str:
+        """Cache key of an input under the given model, the tiling settings, output size and format."""
+        return ResultCache.make_key(data, model=model_name, scale=MODEL_REGISTRY[model_name]['scale'],
+                                    tile_size=self.max_tile_size, tile_pad=self.tile_pad,
+                                    precision=self.precision, backend=self.backend,
+                                    flat_tile_threshold=self.flat_tile_threshold, pad_batches=self.pad_batches,
+                                    fmt=output_format.settings(), target_size=target_size, max_edge=max_edge)
+
+    def upscale_bytes(self, data: bytes, fmt: Union[str, OutputFormat] = '.png', model_name: str = None,
+                      metrics: Metrics = NULL_METRICS, target_size: Optional[Tuple[int, int]] = None,
+                      max_edge: Optional[int] = None) -> bytes:
+        """
+        Upscale an encoded image without touching the filesystem.
+        
+        If a result cache is configured, a repeated input returns the cached
+        result without running the model.
+        
+        Args:
+            data: Encoded image bytes (any format OpenCV can decode)
+            fmt: Output extension ('.jpg', '.png' or '.webp') or OutputFormat with encoder settings
+            model_name: Model to use for this image (default: the upscaler's model)
+            metrics: Receives stage timings, counters and memory readings, including
+                the encode time and the encoded size (encoded_bytes)
+            target_size: Exact output size as (width, height), reached along the
+                cheapest route (see plan_route). Default: the model's native scale.
+            max_edge: Output long edge instead of target_size, keeping the aspect ratio
+            
+        Returns:
+            bytes: The upscaled image encoded in the requested format
+        """
+        model_name = model_name or self.model_name
+        if model_name not in MODEL_REGISTRY:
+            raise ValueError(f"Unsupported model: {model_name}. Available: {', '.join(MODEL_REGISTRY)}")
+        output_format = fmt if isinstance(fmt, OutputFormat) else OutputFormat(fmt)
+        if self.cache is not None:
+            with metrics.stage('cache_lookup'):
+                key = self._cache_key(data, output_format, model_name, target_size, max_edge)
+                cached = self.cache.get(key)
+            if cached is not None:
+                metrics.count('cache_hits')
+                logger.info("Returning cached result")
+                return cached
+            metrics.count('cache_misses')
+
+        with metrics.stage('decode'):
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError("Could not decode input image")
+        if target_size is not None or max_edge is not None:
+            output = self.upscale_to(img, target_size=target_size, max_edge=max_edge, model_name=model_name,
+                                     metrics=metrics)
+        else:
+            output = self.upscale_array(img, model_name=model_name, metrics=metrics)
+        with metrics.stage('encode'):
+            result = output_format.encode(output)
+        metrics.count('encoded_bytes', len(result))
+
+        if self.cache is not None:
+            with metrics.stage('cache_store'):
+                self.cache.put(key, result)
+        return result
+
+    def upscale_image(self, input_path: Union[str, Path], output_path: Union[str, Path],
+                      model_name: str = None, metrics: Metrics = NULL_METRICS,
+                      output_format: Optional[OutputFormat] = None, target_size: Optional[Tuple[int, int]] = None,
+                      max_edge: Optional[int] = None) -> bool:
         """
         Upscale a single image.
         
         Args:
             input_path: Path to input image
-            output_path: Path to save the upscaled image
+            output_path: Path to save the upscaled image, in the format of its extension
+            model_name: Model to use for this image (default: the upscaler's model)
+            metrics: Receives stage timings, counters and memory readings, which
+                are also logged when enabled
+            output_format: Encoder settings (quality, compression, ...)
+            target_size: Exact output size as (width, height) (default: the model's native scale)
+            max_edge: Output long edge instead of target_size, keeping the aspect ratio
             
         Returns:
             bool: True if successful, False otherwise
@@ -141,21 +1843,25 @@ class ImageUpscaler:
                 return False
                 
             # Create output directory if it doesn't exist
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
             
-            # Clear GPU memory before processing
-            self._clear_gpu_memory()
+            with metrics.stage('read'):
+                with open(input_path, 'rb') as f:
+                    data = f.read()
             
-            # Upscale image
+            # Upscale image, encoding in the format implied by the output name
             logger.info(f"Processing image: {input_path}")
-            output, _ = self.upscaler.enhance(input_path, outscale=4)
+            output = self.upscale_bytes(data, fmt=(output_format or OutputFormat()).for_path(output_path),
+                                        model_name=model_name, metrics=metrics, target_size=target_size,
+                                        max_edge=max_edge)
             
             # Save the result
-            self.upscaler.save_image(output, output_path)
-            logger.info(f"Saved upscaled image to: {output_path}")
-            
-            # Clear GPU memory after processing
-            self._clear_gpu_memory()
+            with metrics.stage('write'):
+                with open(output_path, 'wb') as f:
+                    f.write(output)
+            logger.info(f"Saved upscaled image to: {output_path} ({len(output) / 1024:.0f}KB)")
+            if metrics.enabled:
+                logger.info(f"Metrics for {input_path}: {json.dumps(metrics.to_dict())}")
             
             return True
             
@@ -163,68 +1869,807 @@ class ImageUpscaler:
             logger.error(f"Error processing {input_path}: {str(e)}")
             return False
 
+    def upscale_large_image(self, input_path: Union[str, Path], output_path: Union[str, Path],
+                            block_size: int = 1024, scratch_dir: Union[str, Path] = None,
+                            model_name: str = None, metrics: Metrics = NULL_METRICS,
+                            output_format: Optional[OutputFormat] = None) -> bool:
+        """
+        Upscale an image whose output does not fit in memory.
+        
+        The input is processed in blocks of `block_size` pixels with tile_pad
+        context around each. Every upscaled block is written straight into a
+        numpy.memmap, so peak memory for the output depends on the block size
+        rather than the image size. A .npy output is the memmap itself and a
+        PNG output is encoded in strips from it; other output formats are
+        rejected, as their encoders need the whole image in memory. Either is
+        written to a temporary file next to the output and moved into place
+        once complete, so an interrupted run never leaves a partial output.
+        
+        Only a .npy input is mapped directly. Any other input is decoded into
+        memory once, then copied to a memory-mapped scratch file, so its
+        decoded size must fit in RAM.
+        
+        Args:
+            input_path: Path to input image
+            output_path: Path to save the upscaled image
+            block_size: Edge of the input blocks upscaled at a time
+            scratch_dir: Directory for the memory-mapped scratch files (default: next to the output)
+            model_name: Model to use for this image (default: the upscaler's model)
+            metrics: Receives the inference stage timings of every block
+            output_format: Encoder settings (quality, compression, ...)
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        input_path = Path(input_path)
+        output_path = Path(output_path)
+        scratch_files = []
+        try:
+            if not input_path.exists():
+                logger.error(f"Input file not found: {input_path}")
+                return False
+            if output_path.suffix.lower() not in _OUT_OF_CORE_FORMATS:
+                logger.error(f"Out-of-core mode writes {' or '.join(_OUT_OF_CORE_FORMATS)} outputs only, "
+                             f"not {output_path.suffix or 'no extension'}: other encoders need the whole image in memory")
+                return False
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            scratch_dir = Path(scratch_dir) if scratch_dir else output_path.parent
+
+            def scratch_memmap(dtype, shape):
+                fd, name = tempfile.mkstemp(dir=scratch_dir, prefix='.upscale-', suffix='.raw')
+                os.close(fd)
+                scratch_files.append(name)
+                return np.memmap(name, dtype=dtype, mode='w+', shape=shape)
+
+            # Map the input; compressed formats have to be decoded once first
+            if input_path.suffix.lower() == '.npy':
+                source = np.load(input_path, mmap_mode='r')
+            else:
+                logger.warning(f"{input_path.name} is decoded into memory before it is mapped; "
+                               f"save it as .npy to keep the input out of core as well")
+                img = _read_image(input_path)
+                source = scratch_memmap(img.dtype, img.shape)
+                source[:] = img
+                source.flush()
+                del img
+
+            model_name = model_name or self.model_name
+            if model_name not in MODEL_REGISTRY:
+                raise ValueError(f"Unsupported model: {model_name}. Available: {', '.join(MODEL_REGISTRY)}")
+            # The model itself is loaded by upscale_array, under the inference lock
+            scale = MODEL_REGISTRY[model_name]['scale']
+            pad = self.tile_pad
+            height, width = source.shape[:2]
+            output_shape = (height * scale, width * scale) + source.shape[2:]
+            # Same directory as the output, so os.replace can move it into place
+            fd, tmp_path = tempfile.mkstemp(dir=output_path.parent, prefix='.upscale-', suffix=output_path.suffix)
+            os.close(fd)
+            scratch_files.append(tmp_path)
+            if output_path.suffix.lower() == '.npy':
+                output = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=source.dtype, shape=output_shape)
+            else:
+                output = scratch_memmap(source.dtype, output_shape)
+            logger.info(f"Processing image out of core: {input_path} ({width}x{height} -> "
+                        f"{width * scale}x{height * scale}, blocks of {block_size})")
+
+            blocks = [(y0, x0) for y0 in range(0, height, block_size) for x0 in range(0, width, block_size)]
+            for y0, x0 in tqdm(blocks, desc="Upscaling blocks"):
+                y1 = min(y0 + block_size, height)
+                x1 = min(x0 + block_size, width)
+                window_y = max(y0 - pad, 0)
+                window_x = max(x0 - pad, 0)
+                window = np.asarray(source[window_y:min(y1 + pad, height), window_x:min(x1 + pad, width)])
+                upscaled = self.upscale_array(window, model_name=model_name, metrics=metrics)
+                output[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = upscaled[
+                    (y0 - window_y) * scale:(y1 - window_y) * scale,
+                    (x0 - window_x) * scale:(x1 - window_x) * scale]
+                del window, upscaled
+            output.flush()
+
+            # Encode the result without materializing it
+            if output_path.suffix.lower() == '.png':
+                compression = output_format.png_compression if output_format else None
+                _write_png_strips(tmp_path, output, compression=1 if compression is None else compression)
+            output = None
+            os.replace(tmp_path, output_path)
+            logger.info(f"Saved upscaled image to: {output_path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error processing {input_path}: {str(e)}")
+            return False
+        finally:
+            source = output = None
+            for name in scratch_files:
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def upscale_video(self, input_path: Union[str, Path], output_path: Union[str, Path],
+                      reuse_threshold: Optional[float] = None, codec: str = 'libx264', crf: int = 18,
+                      prefetch: int = 4, model_name: str = None, metrics: Metrics = NULL_METRICS) -> bool:
+        """
+        Upscale a video frame by frame without intermediate files.
+        
+        One ffmpeg process decodes the input into raw BGR frames on a pipe and
+        another encodes the upscaled frames from a pipe, muxing in the audio of
+        the input unchanged. Frames are decoded as stored and turned upright
+        after upscaling, so videos with rotation metadata (e.g. portrait phone
+        videos) come out the way players show them. Reading frames and writing results run on their
+        own threads, at most `prefetch` frames ahead of and behind inference,
+        so memory use does not depend on the length of the video. With a
+        `reuse_threshold`, tiles that did not change since the previous frame
+        reuse its output instead of running the network again, which saves
+        most of the work on static shots.
+        
+        Args:
+            input_path: Path to the input video (anything ffmpeg can read)
+            output_path: Path to save the upscaled video; the container follows its extension
+            reuse_threshold: Largest difference, in 8-bit levels, between a tile and the
+                same tile of the previous frame that still reuses its output. 0 only
+                reuses identical tiles, None runs every tile through the network.
+            codec: ffmpeg video encoder of the output
+            crf: Constant rate factor of the encoder (lower is better quality)
+            prefetch: Maximum number of frames buffered on each side of inference
+            model_name: Model to use for this video (default: the upscaler's model)
+            metrics: Receives the decode and encode time, the time inference waited on
+                them (decode_wait, encode_wait), the inference stages and the frame count
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        input_path = Path(input_path)
+        output_path = Path(output_path)
+        if not input_path.exists():
+            logger.error(f"Input file not found: {input_path}")
+            return False
+        try:
+            info = _probe_video(input_path)
+        except (OSError, ValueError, KeyError, subprocess.CalledProcessError) as e:
+            logger.error(f"Could not read video {input_path}: {(getattr(e, 'stderr', None) or str(e)).strip()}")
+            return False
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        model_name = model_name or self.model_name
+        scale = MODEL_REGISTRY[model_name]['scale']
+        # The decoder keeps the stored size, which is what ffprobe reports
+        width, height = info['width'], info['height']
+        frame_bytes = width * height * 3
+        turns = info['rotation'] // 90
+        output_width, output_height = (height, width) if turns % 2 else (width, height)
+        tile_cache = TileCache(reuse_threshold / 255) if reuse_threshold is not None else None
+        logger.info(f"Processing video: {input_path} ({output_width}x{output_height} -> "
+                    f"{output_width * scale}x{output_height * scale} at {info['frame_rate']} fps)")
+
+        decoder = subprocess.Popen(
+            ['ffmpeg', '-v', 'error', '-noautorotate', '-i', str(input_path), '-map', '0:v:0',
+             '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-'],
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+        try:
+            encoder = subprocess.Popen(
+                ['ffmpeg', '-v', 'error', '-y',
+                 '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{output_width * scale}x{output_height * scale}',
+                 '-framerate', info['frame_rate'], '-i', '-',
+                 '-i', str(input_path), '-map', '0:v', '-map', '1:a?', '-c:a', 'copy',
+                 '-c:v', codec, '-crf', str(crf), '-pix_fmt', 'yuv420p', str(output_path)],
+                stdin=subprocess.PIPE)
+        except OSError as e:
+            decoder.kill()
+            decoder.wait()
+            logger.error(f"Could not start the ffmpeg encoder: {str(e)}")
+            return False
+
+        def read_frame():
+            with metrics.stage('decode'):
+                data = decoder.stdout.read(frame_bytes)
+            if not data:
+                return None
+            if len(data) < frame_bytes:
+                raise ValueError(f"Truncated frame in {input_path}: {len(data)} of {frame_bytes} bytes")
+            return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+        def write_frame(frame):
+            with metrics.stage('encode'):
+                encoder.stdin.write(np.ascontiguousarray(np.rot90(frame, turns)).data)
+
+        frames = 0
+        success = False
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='video-decode') as decoders, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='video-encode') as encoders:
+            # A single thread on each side keeps the frames in order
+            decode_queue = deque(decoders.submit(read_frame) for _ in range(max(1, prefetch)))
+            encode_queue = deque()
+            try:
+                with tqdm(total=info['frames'], desc="Upscaling frames", unit='frame') as progress:
+                    while True:
+                        with metrics.stage('decode_wait'):
+                            frame = decode_queue.popleft().result()
+                        if frame is None:
+                            break
+                        decode_queue.append(decoders.submit(read_frame))
+                        output = self.upscale_arrays([frame], model_name=model_name, metrics=metrics,
+                                                     tile_cache=tile_cache)[0]
+                        while len(encode_queue) >= max(1, prefetch):
+                            with metrics.stage('encode_wait'):
+                                encode_queue.popleft().result()
+                        encode_queue.append(encoders.submit(write_frame, output))
+                        frames += 1
+                        progress.update(1)
+                    while encode_queue:
+                        with metrics.stage('encode_wait'):
+                            encode_queue.popleft().result()
+                encoder.stdin.close()
+                if encoder.wait() != 0:
+                    raise RuntimeError(f"ffmpeg failed to encode {output_path} (exit code {encoder.returncode})")
+                if decoder.wait() != 0:
+                    raise RuntimeError(f"ffmpeg failed to decode {input_path} (exit code {decoder.returncode})")
+                if not frames:
+                    raise ValueError(f"No frames decoded from {input_path}")
+                success = True
+            except Exception as e:
+                logger.error(f"Error processing {input_path}: {str(e)}")
+                # Unblock the reader and writer threads so the pools can shut down
+                for future in decode_queue:
+                    future.cancel()
+                for process in (decoder, encoder):
+                    process.kill()
+            finally:
+                for stream in (decoder.stdout, encoder.stdin):
+                    try:
+                        stream.close()
+                    except OSError:
+                        pass
+        decoder.wait()
+        encoder.wait()
+
+        metrics.count('frames', frames)
+        if success:
+            logger.info(f"Saved {frames} upscaled frames to: {output_path}")
+        if metrics.enabled:
+            logger.info(f"Metrics: {json.dumps(metrics.to_dict())}")
+        return success
+
+    def _fits_one_tile(self, future) -> bool:
+        """Whether a finished decode produced an image small enough to be a single tile."""
+        if not future.done() or future.exception() is not None:
+            return False
+        return self._is_single_tile(future.result().shape)
+
+    def _is_single_tile(self, shape: Tuple[int, ...]) -> bool:
+        """Whether an image of this shape is small enough to be a single tile."""
+        tile_size = self.max_tile_size
+        return 0 < tile_size and shape[0] <= tile_size and shape[1] <= tile_size
+
+    def _run_pipeline(self, jobs: Iterable[Tuple[Path, Path]], io_workers: int, prefetch: int,
+                      on_done: Callable[[Path, Path, bool, float], None],
+                      metrics: Metrics = NULL_METRICS, output_format: Optional[OutputFormat] = None) -> int:
+        """
+        Upscale (input_path, output_path) jobs with decode, inference and encode overlapped.
+        
+        Decoding and encoding run on their own thread pools while the calling
+        thread keeps the model busy. Small images that are already decoded are
+        upscaled together so their tiles share inference batches. At most
+        `prefetch` decoded inputs and `prefetch` upscaled outputs are held in
+        memory at any time, plus the group being upscaled.
+        
+        Args:
+            jobs: Iterable of (input_path, output_path) pairs, consumed lazily
+            io_workers: Number of threads in each of the decode and encode pools
+            prefetch: Maximum number of images buffered before and after inference
+            on_done: Called with (input_path, output_path, success, seconds) as each image
+                finishes, timed from the start of its decode to the end of its write
+            metrics: Receives the decode and encode time summed over the I/O threads,
+                the time inference waited on them (decode_wait, encode_wait), the
+                inference stages and the encoded size (encoded_bytes)
+            output_format: Encoder settings; each output keeps the format of its extension
+            
+        Returns:
+            int: Number of images processed successfully
+        """
+        jobs = iter(jobs)
+        decode_queue = deque()
+        encode_queue = deque()
+        started = {}
+        successful = 0
+        read_image = metrics.wrap('decode', _read_image)
+
+        def write_image(output_path, output):
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            with metrics.stage('encode'):
+                size = _write_image(output_path, output, output_format)
+            metrics.count('encoded_bytes', size)
+
+        def fill_decode_queue(decoders):
+            while len(decode_queue) < prefetch:
+                job = next(jobs, None)
+                if job is None:
+                    return
+                started[job[0]] = time.monotonic()
+                decode_queue.append((job, decoders.submit(read_image, job[0])))
+
+        def report(input_path, output_path, success):
+            metrics.count('images_succeeded' if success else 'images_failed')
+            on_done(input_path, output_path, success, time.monotonic() - started.pop(input_path, time.monotonic()))
+
+        def finish_encode():
+            (input_path, output_path), future = encode_queue.popleft()
+            try:
+                with metrics.stage('encode_wait'):
+                    future.result()
+            except Exception as e:
+                logger.error(f"Error saving {input_path}: {str(e)}")
+                report(input_path, output_path, False)
+                return 0
+            report(input_path, output_path, True)
+            return 1
+
+        def finish_written():
+            """Report the outputs already written, before possibly waiting for the next job."""
+            done = 0
+            while encode_queue and encode_queue[0][1].done():
+                done += finish_encode()
+            return done
+
+        with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='decode') as decoders, \
+                ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='encode') as encoders:
+            fill_decode_queue(decoders)
+            while decode_queue:
+                group = [decode_queue.popleft()]
+                # Small images that are already decoded share inference batches
+                while (decode_queue and len(group) < self.tile_batch_size
+                       and self._fits_one_tile(group[0][1]) and self._fits_one_tile(decode_queue[0][1])):
+                    group.append(decode_queue.popleft())
+                # Keep the decoders busy while this group is being upscaled
+                successful += finish_written()
+                fill_decode_queue(decoders)
+
+                ready = []
+                images = []
+                for (input_path, output_path), future in group:
+                    try:
+                        with metrics.stage('decode_wait'):
+                            images.append(future.result())
+                        ready.append((input_path, output_path))
+                    except Exception as e:
+                        logger.error(f"Error processing {input_path}: {str(e)}")
+                        report(input_path, output_path, False)
+                if not images:
+                    continue
+
+                try:
+                    outputs = self.upscale_arrays(images, metrics=metrics)
+                except Exception as e:
+                    for input_path, output_path in ready:
+                        logger.error(f"Error processing {input_path}: {str(e)}")
+                        report(input_path, output_path, False)
+                    continue
+                del images
+
+                for (input_path, output_path), output in zip(ready, outputs):
+                    while len(encode_queue) >= prefetch:
+                        successful += finish_encode()
+                    encode_queue.append(((input_path, output_path),
+                                         encoders.submit(write_image, output_path, output)))
+                del outputs
+
+            while encode_queue:
+                successful += finish_encode()
+
+        return successful
+
     def batch_upscale(self, input_dir: Union[str, Path], output_dir: Union[str, Path],
-                      extensions: List[str] = ['.jpg', '.jpeg', '.png', '.webp']) -> None:
+                      extensions: List[str] = ['.jpg', '.jpeg', '.png', '.webp'],
+                      io_workers: int = 2, prefetch: int = 4, force: bool = False,
+                      metrics: Metrics = NULL_METRICS, output_format: Optional[OutputFormat] = None,
+                      recursive: bool = False, include: Optional[List[str]] = None,
+                      exclude: Optional[List[str]] = None) -> None:
         """
         Batch upscale all images in a directory.
         
+        Outputs keep the format of their input unless `output_format` names
+        one. Progress is recorded in a manifest in the output directory, so a
+        rerun only processes new, changed or previously failed images.
+        
+        Processing starts as soon as the first images are found. Images are
+        taken largest first (by pixel count, read from their headers) among
+        those found so far, so the run does not end on one large image.
+        
         Args:
             input_dir: Directory containing input images
             output_dir: Directory to save upscaled images
             extensions: List of file extensions to process
+            io_workers: Number of threads used for decoding and for encoding
+            prefetch: Maximum number of images buffered on each side of inference
+            force: Reprocess every image, even if the manifest shows it up to date
+            metrics: Receives stage timings and counters of the whole run, which are
+                also logged when enabled
+            output_format: Output format and encoder settings
+            recursive: Also process subdirectories, mirrored below output_dir
+            include: fnmatch patterns of the paths below input_dir to process (default: all)
+            exclude: fnmatch patterns of the paths below input_dir to leave out
         """
+        output_format = output_format or OutputFormat()
         input_dir = Path(input_dir)
         output_dir = Path(output_dir)
         
         # Create output directory if it doesn't exist
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        # Get all image files
-        image_files = []
-        for ext in extensions:
-            image_files.extend(list(input_dir.glob(f"*{ext}")))
-            image_files.extend(list(input_dir.glob(f"*{ext.upper()}")))
+        manifest = BatchManifest(output_dir)
+        try:
+            # Find the images that still need work while the first ones are processed
+            jobs = LargestFirstQueue(
+                _discover_jobs(input_dir, output_dir, extensions, manifest, force, output_format.ext,
+                               recursive, include, exclude),
+                key=lambda job: _pixel_count(job[0]))
+            
+            # Decode, upscale and encode in overlapping stages
+            def on_done(input_path, output_path, success, duration):
+                manifest.record(input_path, output_path, success, duration)
+                progress.total = jobs.count
+                progress.update(1)
+            
+            with tqdm(desc="Processing images") as progress:
+                successful = self._run_pipeline(jobs, max(1, io_workers), max(1, prefetch), on_done, metrics,
+                                                output_format)
+        finally:
+            manifest.close()
         
-        if not image_files:
-            logger.warning(f"No images found in {input_dir} with extensions {extensions}")
+        if not jobs.count:
+            logger.info("Nothing to process")
             return
-        
-        logger.info(f"Found {len(image_files)} images to process")
-        
-        # Process each image
-        successful = 0
-        for img_path in tqdm(image_files, desc="Processing images"):
-            output_path = output_dir / f"{img_path.stem}_upscaled{img_path.suffix}"
-            if self.upscale_image(img_path, output_path):
-                successful += 1
-                
-            # Clear GPU memory after each image
-            self._clear_gpu_memory()
-        
-        logger.info(f"Batch processing complete. Successfully processed {successful}/{len(image_files)} images")
+        logger.info(f"Batch processing complete. Successfully processed {successful}/{jobs.count} images")
+        if metrics.enabled:
+            logger.info(f"Batch metrics: {json.dumps(metrics.to_dict())}")
+
+def _partition_cpus(workers: int) -> List[List[int]]:
+    """Split the CPUs available to this process into one disjoint set per worker."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    per_worker = len(cpus) // workers
+    return [cpus[i * per_worker:(i + 1) * per_worker] for i in range(workers)]
+
+def _shard_worker(worker_id: int, upscaler_kwargs: Dict, cpu_set: List[int],
+                  task_queue, result_queue, io_workers: int, prefetch: int,
+                  output_format: Optional[OutputFormat] = None) -> None:
+    """
+    Worker process for sharded batch mode.
+    
+    Pins itself to its CPU set, builds its own ImageUpscaler and pulls
+    (input_path, output_path) jobs from the shared queue until it receives
+    None. Every finished image is reported as (input_path, output_path,
+    success, seconds), and a final (None, worker_id) marks the worker as done.
+    """
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpu_set)
+        cv2.setNumThreads(len(cpu_set))
+
+        upscaler = ImageUpscaler(cpu_threads=len(cpu_set), **upscaler_kwargs)
+        logger.info(f"Worker {worker_id} ready on {upscaler.device} with CPUs {cpu_set}")
+
+        def jobs():
+            while True:
+                job = task_queue.get()
+                if job is None:
+                    return
+                yield Path(job[0]), Path(job[1])
+
+        upscaler._run_pipeline(jobs(), io_workers, prefetch,
+                               lambda *result: result_queue.put(result), output_format=output_format)
+    except Exception as e:
+        logger.error(f"Worker {worker_id} failed: {str(e)}")
+    finally:
+        result_queue.put((None, worker_id, False, 0.0))
+
+def sharded_batch_upscale(input_dir: Union[str, Path], output_dir: Union[str, Path], workers: int,
+                          device: str = None, memory_efficient: bool = True,
+                          extensions: List[str] = ['.jpg', '.jpeg', '.png', '.webp'],
+                          io_workers: int = 2, prefetch: int = 4, tile_batch_size: int = 4,
+                          force: bool = False, model_name: str = 'RealESRGAN_x4plus',
+                          precision: Optional[str] = None, backend: str = 'torch',
+                          output_format: Optional[OutputFormat] = None,
+                          flat_tile_threshold: Optional[float] = None, recursive: bool = False,
+                          include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                          pad_batches: bool = False) -> None:
+    """
+    Batch upscale a directory with several worker processes.
+    
+    Each worker loads its own model, pinned to a GPU (round-robin over the
+    visible devices) or, on CPU, to a disjoint set of cores. Images are
+    handed out largest first (by pixel count) from a shared queue while
+    discovery is still running, so the workers stay balanced and the run
+    does not end on one large file. Results are recorded in the same
+    manifest as batch_upscale, so runs can be resumed.
+    
+    Args:
+        input_dir: Directory containing input images
+        output_dir: Directory to save upscaled images
+        workers: Number of worker processes
+        device: Device to use ('cuda' or 'cpu'). If None, will automatically detect.
+        memory_efficient: Passed through to every worker's ImageUpscaler
+        extensions: List of file extensions to process
+        io_workers: Number of decode and encode threads per worker
+        prefetch: Images buffered on each side of inference per worker
+        tile_batch_size: Maximum number of tiles per forward call in each worker
+        force: Reprocess every image, even if the manifest shows it up to date
+        model_name: Model loaded by every worker
+        precision: Inference precision of every worker (default: picked for the device)
+        backend: Inference backend of every worker ('torch' or 'onnx')
+        output_format: Output format and encoder settings (default: keep each input's format)
+        flat_tile_threshold: Passed through to every worker's ImageUpscaler
+        recursive: Also process subdirectories, mirrored below output_dir
+        include: fnmatch patterns of the paths below input_dir to process (default: all)
+        exclude: fnmatch patterns of the paths below input_dir to leave out
+        pad_batches: Passed through to every worker's ImageUpscaler
+    """
+    output_format = output_format or OutputFormat()
+    input_dir = Path(input_dir)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    upscaler_kwargs = {
+        'model_name': model_name,
+        'memory_efficient': memory_efficient,
+        'tile_batch_size': tile_batch_size,
+        'precision': precision,
+        'backend': backend,
+        'flat_tile_threshold': flat_tile_threshold,
+        'pad_batches': pad_batches,
+    }
+
+    manifest = BatchManifest(output_dir)
+    try:
+        jobs = LargestFirstQueue(
+            _discover_jobs(input_dir, output_dir, extensions, manifest, force, output_format.ext,
+                           recursive, include, exclude),
+            key=lambda job: _pixel_count(job[0]))
+        successful = _run_sharded(jobs, workers, device, upscaler_kwargs, io_workers, prefetch, manifest,
+                                  output_format)
+    finally:
+        manifest.close()
+
+    if not jobs.count:
+        logger.info("Nothing to process")
+        return
+    logger.info(f"Batch processing complete. Successfully processed {successful}/{jobs.count} images")
+
+def _run_sharded(jobs: LargestFirstQueue, workers: int, device: Optional[str], upscaler_kwargs: Dict,
+                 io_workers: int, prefetch: int, manifest: BatchManifest,
+                 output_format: Optional[OutputFormat] = None) -> int:
+    """
+    Distribute jobs over worker processes and return the number of successes.
+    
+    Only enough jobs to keep every worker's pipeline full are queued ahead of
+    the results, so large images found late still overtake small ones found
+    early. Workers are started as jobs arrive, up to `workers`.
+    """
+    use_cuda = device == 'cuda' or (device is None and torch.cuda.is_available())
+    gpu_count = torch.cuda.device_count() if use_cuda else 0
+    cpu_sets = _partition_cpus(workers)
+    # Every worker holds up to `prefetch` images on each side of inference and
+    # a group of up to `tile_batch_size` images being upscaled
+    ahead = workers * (2 * prefetch + upscaler_kwargs['tile_batch_size'] + 2)
+
+    # spawn keeps CUDA usable in the children
+    ctx = mp.get_context('spawn')
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    processes = []
+    # Jobs queued but not reported back, and workers that have not exited yet
+    pending = 0
+    running = 0
+    exhausted = False
+
+    def start_worker():
+        nonlocal running
+        worker_id = len(processes)
+        if gpu_count:
+            worker_kwargs = dict(upscaler_kwargs, device='cuda', gpu_id=worker_id % gpu_count)
+        else:
+            worker_kwargs = dict(upscaler_kwargs, device='cpu')
+        process = ctx.Process(target=_shard_worker, name=f"upscale-worker-{worker_id}",
+                              args=(worker_id, worker_kwargs, cpu_sets[worker_id], task_queue,
+                                    result_queue, io_workers, prefetch, output_format))
+        process.start()
+        processes.append(process)
+        running += 1
+
+    def feed():
+        """Queue the largest jobs found so far, without waiting for discovery."""
+        nonlocal pending, exhausted
+        while not exhausted and pending < ahead:
+            try:
+                job = jobs.get(timeout=0)
+            except queue.Empty:
+                return
+            if job is None:
+                exhausted = True
+                for _ in processes:
+                    task_queue.put(None)
+                return
+            task_queue.put((str(job[0]), str(job[1])))
+            pending += 1
+            if len(processes) < min(workers, pending):
+                start_worker()
+
+    successful = 0
+    with tqdm(desc="Processing images") as progress:
+        while True:
+            feed()
+            if exhausted and not running:
+                break
+            try:
+                input_path, output_path, ok, duration = result_queue.get(timeout=5 if exhausted else 0.1)
+            except queue.Empty:
+                # Stop waiting if every worker died without reporting back
+                if processes and not any(process.is_alive() for process in processes):
+                    logger.error("All workers exited before finishing the batch")
+                    break
+                continue
+            if input_path is None:
+                running -= 1
+                continue
+            pending -= 1
+            manifest.record(Path(input_path), Path(output_path), ok, duration)
+            successful += int(ok)
+            progress.total = jobs.count
+            progress.update(1)
+
+    for process in processes:
+        process.join()
+
+    return successful
 
 def main():
     parser = argparse.ArgumentParser(description="AI Image Upscaler using Real-ESRGAN")
     parser.add_argument('--input', required=True, help='Input image path or directory')
     parser.add_argument('--output', required=True, help='Output image path or directory')
     parser.add_argument('--device', choices=['cuda', 'cpu'], help='Device to use (default: auto-detect)')
+    parser.add_argument('--model', choices=list(MODEL_REGISTRY), default='RealESRGAN_x4plus',
+                       help='Model to use (default: RealESRGAN_x4plus)')
     parser.add_argument('--batch', action='store_true', help='Enable batch processing of a directory')
     parser.add_argument('--gpu-id', type=int, default=0, help='GPU ID to use if multiple GPUs are available')
     parser.add_argument('--memory-efficient', action='store_true', 
                        help='Enable memory-efficient mode for vGPUs (uses tiling and half precision)')
+    parser.add_argument('--io-workers', type=int, default=2,
+                       help='Threads used for decoding and for encoding in batch mode (default: 2)')
+    parser.add_argument('--prefetch', type=int, default=4,
+                       help='Images buffered before and after inference in batch and video mode (default: 4)')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Worker processes for batch mode, each with its own model (default: 1)')
+    parser.add_argument('--tile-batch-size', type=int, default=4,
+                       help='Maximum number of tiles run through the model in one forward call (default: 4)')
+    parser.add_argument('--force', action='store_true',
+                       help='In batch mode, reprocess images the manifest shows as up to date')
+    parser.add_argument('--recursive', action='store_true',
+                       help='In batch mode, also process subdirectories, mirrored in the output directory')
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                       help='In batch mode, only process paths below --input matching this pattern, '
+                            'e.g. "shoots/*.png" (repeatable)')
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                       help='In batch mode, leave out paths below --input matching this pattern; '
+                            'matching directories are not entered (repeatable)')
+    parser.add_argument('--out-of-core', action='store_true',
+                       help='Upscale a single very large image through memory-mapped files on disk. '
+                            'The output must be .png or .npy; only a .npy input is read out of core, '
+                            'other inputs are decoded into memory once')
+    parser.add_argument('--block-size', type=int, default=1024,
+                       help='Input block edge processed at a time in out-of-core mode (default: 1024)')
+    parser.add_argument('--video', action='store_true',
+                       help='Upscale a video through ffmpeg pipes, frame by frame')
+    parser.add_argument('--video-codec', default='libx264',
+                       help='ffmpeg encoder of the upscaled video (default: libx264)')
+    parser.add_argument('--crf', type=int, default=18,
+                       help='Constant rate factor of the video encoder, lower is better (default: 18)')
+    parser.add_argument('--reuse-tiles', type=float, metavar='LEVELS',
+                       help='In video mode, reuse the previous frame\'s output for tiles that changed by at most '
+                            'LEVELS (8-bit), e.g. 0 for identical tiles only (default: off)')
+    parser.add_argument('--precision', choices=list(_PRECISIONS),
+                       help='Inference precision (default: fp16 on GPU, bf16 or fp32 on CPU by capability)')
+    parser.add_argument('--backend', choices=['torch', 'onnx'], default='torch',
+                       help='Inference backend; onnx runs ONNX Runtime on the CPU (default: torch)')
+    parser.add_argument('--cpu-threads', type=int,
+                       help='Intra-op threads on the CPU (default: every usable CPU)')
+    parser.add_argument('--format', choices=['jpg', 'png', 'webp'],
+                       help='Output format in batch mode (default: keep each input\'s format); '
+                            'single images use the extension of --output')
+    parser.add_argument('--quality', type=int,
+                       help='JPEG or lossy WebP quality, 1-100 (default: 95 for JPEG, 90 for WebP)')
+    parser.add_argument('--png-compression', type=int,
+                       help='PNG compression level, 0-9 (default: the fastest setting)')
+    parser.add_argument('--progressive', action='store_true', help='Write progressive JPEGs')
+    parser.add_argument('--lossless', action='store_true', help='Write lossless WebP')
+    parser.add_argument('--flat-tile-threshold', type=float, metavar='LEVELS',
+                       help='Upscale tiles whose neighbouring pixels differ by at most LEVELS (8-bit) by '
+                            'interpolation instead of the model, e.g. 1 for flat backgrounds (default: off)')
+    parser.add_argument('--pad-batches', action='store_true',
+                       help='Let small images of different sizes share forward passes; their edge pixels '
+                            'then depend on the images batched with them')
+    parser.add_argument('--max-edge', type=int,
+                       help='Long edge of the output in pixels, reached with the least model work')
+    parser.add_argument('--target-size', metavar='WIDTHxHEIGHT',
+                       help='Exact output size, reached with the least model work')
+    parser.add_argument('--metrics', action='store_true',
+                       help='Log per-stage timings, counters and memory readings')
+    parser.add_argument('--prometheus', metavar='FILE',
+                       help='Write the collected metrics to FILE in the Prometheus text format')
     args = parser.parse_args()
+    try:
+        output_format = OutputFormat(args.format, quality=args.quality, png_compression=args.png_compression,
+                                     progressive=args.progressive, lossless=args.lossless)
+    except ValueError as e:
+        parser.error(str(e))
+    target_size = None
+    if args.target_size:
+        try:
+            target_size = tuple(int(value) for value in args.target_size.lower().split('x'))
+        except ValueError:
+            target_size = ()
+        if len(target_size) != 2 or min(target_size) < 1:
+            parser.error(f"--target-size must look like 3840x2160, got {args.target_size}")
+    if args.max_edge is not None and args.max_edge < 1:
+        parser.error(f"--max-edge must be a positive number of pixels, got {args.max_edge}")
+    if (target_size or args.max_edge is not None) and (args.batch or args.out_of_core or args.video):
+        parser.error("--max-edge and --target-size apply to single images only")
+    if (args.recursive or args.include or args.exclude) and not args.batch:
+        parser.error("--recursive, --include and --exclude apply to --batch only")
+    if args.out_of_core and Path(args.output).suffix.lower() not in _OUT_OF_CORE_FORMATS:
+        parser.error("--out-of-core writes .png or .npy outputs only")
+    if args.video and (args.batch or args.out_of_core):
+        parser.error("--video cannot be combined with --batch or --out-of-core")
+    if args.reuse_tiles is not None and not args.video:
+        parser.error("--reuse-tiles applies to --video only")
+    if target_size and args.max_edge is not None:
+        parser.error("Give only one of --max-edge and --target-size")
+
+    if args.batch and args.workers > 1:
+        sharded_batch_upscale(args.input, args.output, args.workers, device=args.device,
+                              memory_efficient=args.memory_efficient, io_workers=args.io_workers,
+                              prefetch=args.prefetch, tile_batch_size=args.tile_batch_size,
+                              force=args.force, model_name=args.model, precision=args.precision,
+                              backend=args.backend, output_format=output_format,
+                              flat_tile_threshold=args.flat_tile_threshold, recursive=args.recursive,
+                              include=args.include, exclude=args.exclude, pad_batches=args.pad_batches)
+        return
 
     # Initialize upscaler
-    upscaler = ImageUpscaler(device=args.device, gpu_id=args.gpu_id, 
-                            memory_efficient=args.memory_efficient)
+    upscaler = ImageUpscaler(model_name=args.model, device=args.device, gpu_id=args.gpu_id, 
+                            memory_efficient=args.memory_efficient,
+                            tile_batch_size=args.tile_batch_size, precision=args.precision,
+                            backend=args.backend, cpu_threads=args.cpu_threads,
+                            flat_tile_threshold=args.flat_tile_threshold, pad_batches=args.pad_batches)
 
+    metrics = Metrics() if args.metrics or args.prometheus else NULL_METRICS
+    started = time.perf_counter()
     if args.batch:
-        upscaler.batch_upscale(args.input, args.output)
+        upscaler.batch_upscale(args.input, args.output, io_workers=args.io_workers,
+                               prefetch=args.prefetch, force=args.force, metrics=metrics,
+                               output_format=output_format, recursive=args.recursive,
+                               include=args.include, exclude=args.exclude)
+        success = True
+    elif args.video:
+        success = upscaler.upscale_video(args.input, args.output, reuse_threshold=args.reuse_tiles,
+                                         codec=args.video_codec, crf=args.crf, prefetch=args.prefetch,
+                                         metrics=metrics)
+    elif args.out_of_core:
+        success = upscaler.upscale_large_image(args.input, args.output, block_size=args.block_size,
+                                               metrics=metrics, output_format=output_format)
+        if metrics.enabled:
+            logger.info(f"Metrics: {json.dumps(metrics.to_dict())}")
     else:
-        success = upscaler.upscale_image(args.input, args.output)
-        if not success:
-            logger.error("Failed to process image")
-            exit(1)
+        success = upscaler.upscale_image(args.input, args.output, metrics=metrics, output_format=output_format,
+                                         target_size=target_size, max_edge=args.max_edge)
+    if args.prometheus:
+        REGISTRY.observe(metrics, time.perf_counter() - started)
+        with open(args.prometheus, 'w') as f:
+            f.write(REGISTRY.render())
+    if not success:
+        logger.error("Failed to process image")
+        exit(1)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file